@@ -0,0 +1,161 @@
+#******************
+# NMEA Logger
+# AIS VDM/VDO decoding: 6-bit de-armoring, multi-fragment reassembly and
+# typed records for position (1, 2, 3, 18, 19) and static (5, 24) reports
+#******************
+
+
+from collections import namedtuple
+from nmea_position import checksum_ok
+
+
+Position = namedtuple("Position", "msg_type mmsi lat lon sog cog heading second status")
+Static = namedtuple("Static", "msg_type mmsi name callsign ship_type imo destination to_bow to_stern to_port to_starboard")
+
+AIS_TYPES = ("VDM", "VDO")
+
+#Armored payload character -> its 6 bits as a string of 0/1
+_ARMOR = {}
+for _v in range(64):
+   _ARMOR[ord(chr(_v + 48 if _v < 40 else _v + 56))] = format(_v, "06b")
+#6 bits -> AIS text character
+_TEXT = {}
+for _v in range(64):
+   _TEXT[format(_v, "06b")] = chr(_v + 64 if _v < 32 else _v)
+
+
+def payload_bits(payload, fill=0):
+   #De-armor a payload into a string of bits. Raises ValueError for
+   #characters outside the AIS alphabet.
+   bits = payload.translate(_ARMOR)
+   if len(bits) != len(payload) * 6:
+      raise ValueError("invalid payload character")
+   if fill:
+      bits = bits[:-fill]
+   return bits
+
+
+def _u(bits, start, width):
+   return int(bits[start:start + width], 2)
+
+
+def _s(bits, start, width):
+   v = int(bits[start:start + width], 2)
+   if v >= 1 << (width - 1):
+      v = v - (1 << width)
+   return v
+
+
+def _text(bits, start, width):
+   #A field cut short at the end of the message (type 5 is sent with 420 to
+   #424 bits) keeps its whole characters
+   end = min(start + width, len(bits))
+   s = "".join([_TEXT[bits[i:i + 6]] for i in range(start, end - 5, 6)])
+   return s.split("@", 1)[0].rstrip()
+
+
+def _latlon(lat, lon):
+   #1/10000 minute units; 91 and 181 degrees mean not available
+   lat = lat / 600000.0
+   lon = lon / 600000.0
+   if lat == 91 or lon == 181:
+      return None, None
+   return lat, lon
+
+
+def decode(bits):
+   #Typed record for a complete message, None for unsupported types
+   n = len(bits)
+   msg_type = int(bits[0:6], 2)
+   if msg_type in (1, 2, 3) and n >= 149:
+      lat, lon = _latlon(_s(bits, 89, 27), _s(bits, 61, 28))
+      return Position(msg_type, _u(bits, 8, 30), lat, lon, _u(bits, 50, 10) / 10.0,
+         _u(bits, 116, 12) / 10.0, _u(bits, 128, 9), _u(bits, 137, 6), _u(bits, 38, 4))
+   if msg_type in (18, 19) and n >= 139:
+      lat, lon = _latlon(_s(bits, 85, 27), _s(bits, 57, 28))
+      return Position(msg_type, _u(bits, 8, 30), lat, lon, _u(bits, 46, 10) / 10.0,
+         _u(bits, 112, 12) / 10.0, _u(bits, 124, 9), _u(bits, 133, 6), None)
+   if msg_type == 5 and n >= 420:
+      return Static(5, _u(bits, 8, 30), _text(bits, 112, 120), _text(bits, 70, 42), _u(bits, 232, 8),
+         _u(bits, 40, 30), _text(bits, 302, 120), _u(bits, 240, 9), _u(bits, 249, 9), _u(bits, 258, 6), _u(bits, 264, 6))
+   if msg_type == 24 and n >= 160:
+      if _u(bits, 38, 2) == 0:
+         return Static(24, _u(bits, 8, 30), _text(bits, 40, 120), None, None, None, None, None, None, None, None)
+      if n >= 162:
+         return Static(24, _u(bits, 8, 30), None, _text(bits, 90, 42), _u(bits, 40, 8), None, None,
+            _u(bits, 132, 9), _u(bits, 141, 9), _u(bits, 150, 6), _u(bits, 156, 6))
+   return None
+
+
+class AisDecoder(object):
+   #Feeds !xxVDM/!xxVDO sentences; multi-fragment messages are collected by
+   #sequence id and channel until complete, incomplete ones are dropped after
+   #timeout seconds.
+   def __init__(self, timeout=10.0, max_pending=256, check=True):
+      self.timeout = timeout
+      self.max_pending = max_pending
+      self.check = check
+      self.pending = {}
+      self.decoded = 0
+      self.errors = 0
+      self.expired = 0
+      self.unsupported = 0
+
+   def feed(self, sentence, now=0.0):
+      #Record for the message completed by this sentence, or None.
+      #now is the receipt time in seconds, used for fragment timeouts.
+      if self.check and not checksum_ok(sentence):
+         self.errors = self.errors + 1
+         return None
+      start = 0
+      if sentence[0] == "\\":
+         start = sentence.find("\\", 1) + 1
+      f = sentence[start:sentence.rfind("*")].split(",")
+      try:
+         count = int(f[1])
+         num = int(f[2])
+         fill = int(f[6] or 0)
+         payload = f[5]
+         if count == 1:
+            bits = payload_bits(payload, fill)
+         else:
+            bits = self._fragment(f[3], f[4], count, num, payload, fill, now)
+            if bits is None:
+               return None
+         rec = decode(bits)
+      except (ValueError, IndexError, KeyError):
+         self.errors = self.errors + 1
+         return None
+      if rec is None:
+         self.unsupported = self.unsupported + 1
+      else:
+         self.decoded = self.decoded + 1
+      return rec
+
+   def _fragment(self, seq, channel, count, num, payload, fill, now):
+      key = (seq, channel, count)
+      if num == 1:
+         self._expire(now)
+         self.pending[key] = [now, [payload]]
+         return None
+      entry = self.pending.get(key)
+      if entry is None or len(entry[1]) != num - 1 or now - entry[0] > self.timeout:
+         #Missing or stale earlier fragment
+         if entry is not None:
+            del self.pending[key]
+            self.expired = self.expired + 1
+         return None
+      entry[1].append(payload)
+      if num < count:
+         return None
+      del self.pending[key]
+      return payload_bits("".join(entry[1]), fill)
+
+   def _expire(self, now):
+      #Drop stale fragments; if still full, drop the oldest
+      for key in [k for k, e in self.pending.items() if now - e[0] > self.timeout]:
+         del self.pending[key]
+         self.expired = self.expired + 1
+      while len(self.pending) >= self.max_pending:
+         del self.pending[min(self.pending, key=lambda k: self.pending[k][0])]
+         self.expired = self.expired + 1
@@ -0,0 +1,167 @@
+#******************
+# NMEA Logger
+# Background compression of finished data files
+#******************
+# Logger threads rename a finished file into complete/ and hand it to the
+# Archiver, which zips it on its own worker thread(s). The ingest loop never
+# waits for compression. The queue is bounded; if it is full the file stays
+# uncompressed in complete/ and is picked up by a sweep once the queue drains.
+# on_ready(path) is called for every archive that is ready for transfer.
+# Files may come from the complete/ directory of any flash drive; add_dir()
+# adds the complete/ of a spill-over volume to the startup and overflow sweeps.
+# Zips are written to a .part file, fsynced and renamed into place, so a crash
+# never leaves a half-written zip that the transfer thread could pick up.
+#******************
+
+
+import logging
+import os
+import queue
+import threading
+import time
+import zipfile
+
+
+PART_SUFFIX = ".part"
+
+
+def fsync_dir(path):
+   #Make renames/removals in a directory durable
+   fd = os.open(path, os.O_RDONLY)
+   try:
+      os.fsync(fd)
+   finally:
+      os.close(fd)
+
+
+class Archiver(object):
+   def __init__(self, complete_dir, outfileext, maxsize=16, workers=1, on_ready=None):
+      self.complete_dir = complete_dir
+      #complete/ directories swept for uncompressed files
+      self.dirs = [complete_dir]
+      self.outfileext = outfileext
+      self.queue = queue.Queue(maxsize)
+      self.workers = workers
+      self.on_ready = on_ready
+      self.lock = threading.Lock()
+      #Set when a file could not be queued; the next idle worker sweeps complete/
+      self.backlog = False
+      #Files queued or being compressed
+      self.pending = set()
+      self.done = 0
+      self.failed = 0
+      self.overflow = 0
+      self.last_latency = 0.0
+      self.max_latency = 0.0
+      self.total_latency = 0.0
+
+   def submit(self, path):
+      #Queue a file in complete/ for compression. Never blocks.
+      with self.lock:
+         if path in self.pending:
+            return True
+         try:
+            self.queue.put_nowait((path, time.time()))
+            self.pending.add(path)
+            return True
+         except queue.Full:
+            self.overflow = self.overflow + 1
+            self.backlog = True
+      logging.info("Compression queue full, " + os.path.basename(path) + " left for later")
+      return False
+
+   def ready(self, path):
+      #An archive in complete/ that needs no compression (streamed codecs)
+      if self.on_ready is not None:
+         self.on_ready(path)
+
+   def depth(self):
+      return self.queue.qsize()
+
+   def stats(self):
+      #Queue depth and latency (seconds from hand-off to finished zip)
+      with self.lock:
+         avg = self.total_latency / self.done if self.done else 0.0
+         return {"depth": self.depth(), "done": self.done, "failed": self.failed,
+                 "overflow": self.overflow, "last_latency": self.last_latency,
+                 "max_latency": self.max_latency, "avg_latency": avg}
+
+   def add_dir(self, complete_dir):
+      #complete/ of another volume; swept by the next idle worker
+      with self.lock:
+         if complete_dir not in self.dirs:
+            self.dirs.append(complete_dir)
+         self.backlog = True
+
+   def run(self, should_stop):
+      #Worker loop. Returns once should_stop() is True and the queue is empty.
+      while True:
+         try:
+            path, queued = self.queue.get(timeout=1)
+         except queue.Empty:
+            if should_stop():
+               return
+            if self.backlog:
+               self.sweep()
+            continue
+         try:
+            self.compress(path)
+            latency = time.time() - queued
+            with self.lock:
+               self.done = self.done + 1
+               self.last_latency = latency
+               self.total_latency = self.total_latency + latency
+               if latency > self.max_latency:
+                  self.max_latency = latency
+            logging.info("File zipped " + os.path.basename(path) + " (" + str(round(latency, 2)) + " s after rollover, " + str(self.depth()) + " queued)")
+         except Exception as e:
+            with self.lock:
+               self.failed = self.failed + 1
+            logging.info("Compression of " + path + " failed: " + str(e))
+         finally:
+            with self.lock:
+               self.pending.discard(path)
+            self.queue.task_done()
+
+   def recover(self):
+      #Startup: remove half-written zips and queue every uncompressed file in
+      #complete/. The originals of half-written zips are still there.
+      for complete_dir in list(self.dirs):
+         for filename in os.listdir(complete_dir):
+            if filename.endswith(PART_SUFFIX):
+               os.remove(os.path.join(complete_dir, filename))
+               logging.info("Removed incomplete " + filename)
+      with self.lock:
+         self.backlog = True
+
+   def sweep(self):
+      #Queue uncompressed files left in complete/ after an overflow
+      with self.lock:
+         self.backlog = False
+      for complete_dir in list(self.dirs):
+         try:
+            filenames = sorted(os.listdir(complete_dir))
+         except OSError as e:
+            #A flash drive that was unplugged
+            logging.info("Cannot sweep " + complete_dir + ": " + str(e))
+            continue
+         for filename in filenames:
+            if filename.endswith("." + self.outfileext):
+               if not self.submit(os.path.join(complete_dir, filename)):
+                  return
+
+   def compress(self, path):
+      #Zip path in one read pass into a temporary file, fsync it, rename it
+      #into place and only then delete path
+      filename = os.path.basename(path)
+      zn = path[:-len(self.outfileext)] + "zip"
+      tmp = zn + PART_SUFFIX
+      with open(tmp, "wb") as f:
+         with zipfile.ZipFile(f, 'w') as zipObj:
+            zipObj.write(path, compress_type=zipfile.ZIP_DEFLATED, arcname=filename)
+         f.flush()
+         os.fsync(f.fileno())
+      os.replace(tmp, zn)
+      fsync_dir(os.path.dirname(zn))
+      os.remove(path)
+      self.ready(zn)
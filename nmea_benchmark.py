@@ -0,0 +1,574 @@
+#******************
+# NMEA Logger
+# Micro-benchmarks for the logger hot paths. Runs off the Pi, no GPIO or
+# serial hardware needed.
+#******************
+# Command line parameters:
+# All benchmarks:             nmea_benchmark.py
+# Selected benchmarks:        nmea_benchmark.py filter ...
+# Sentences per run:          nmea_benchmark.py --count 100000
+# Recorded log as input:      nmea_benchmark.py --input 20200101-000000-COM1.zip
+#******************
+
+
+import argparse
+import gzip
+import lzma
+import math
+import os
+import random
+import tempfile
+import time
+import zipfile
+import zlib
+from functools import reduce
+from nmea_filter import SentenceFilter
+from nmea_codec import compressor, zstandard
+from nmea_geofence import load_ports
+from nmea_position import parse_position, checksum_ok, ChecksumError
+from nmea_ais import AisDecoder
+from nmea_filter import sentence_address
+import nmea_binlog
+from nmea_dedup import AisThrottle
+from nmea_writer import BatchWriter
+from nmea_timestamp import Timestamper
+from datetime import datetime
+
+
+#Typical mix of a vessel feed: mostly AIS, GPS fixes and satellite status
+SAMPLE_SENTENCES = [
+   "!AIVDM,1,1,,A,13aGmP0P00PD;88MD5MTDww@2<0L,0*23",
+   "!AIVDM,1,1,,B,15MvqR0P00PD;88MD5MTDww@2<0L,0*4D",
+   "!AIVDM,2,1,3,B,55P5TL01VIaAL@7WKO@mBplU@<PDhh000000001S;AJ::4A80?4i@E53,0*3E",
+   "!AIVDM,2,2,3,B,1@0000000000000,2*55",
+   "!AIVDO,1,1,,,B5NJ;PP005l4ot5Isbl03wsUkP06,0*76",
+   "$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47",
+   "$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A",
+   "$GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,010,00,13,06,292,00*74",
+   "$GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1*39",
+   "$HEHDT,274.07,T*03",
+   "$RATTM,11,11.4,13.6,T,10.0,20.0,T,0.8,1.5,N,,Q,,123519,A*2D",
+   "$SDDPT,17.8,0.0*6B",
+]
+
+
+def sample(count):
+   #count sentences cycling through the sample mix
+   n = len(SAMPLE_SENTENCES)
+   return [SAMPLE_SENTENCES[i % n] for i in range(count)]
+
+
+def checksum(body):
+   #NMEA checksum of the text between $/! and *
+   return "%02X" % reduce(lambda a, c: a ^ ord(c), body, 0)
+
+
+def armor(bits):
+   #AIS 6-bit ASCII armoring of a bit string, padded to whole characters
+   fill = -len(bits) % 6
+   bits = bits + "0" * fill
+   out = []
+   for i in range(0, len(bits), 6):
+      v = int(bits[i:i + 6], 2)
+      out.append(chr(v + 48 if v < 40 else v + 56))
+   return "".join(out), fill
+
+
+def uint(value, width):
+   return format(value & ((1 << width) - 1), "0" + str(width) + "b")
+
+
+def position_report(mmsi, lat, lon, sog, cog, second):
+   #Payload of an AIS class A position report (message type 1)
+   bits = (uint(1, 6) + uint(0, 2) + uint(mmsi, 30) + uint(0, 4) + uint(-128, 8) +
+      uint(int(sog * 10), 10) + uint(0, 1) + uint(int(round(lon * 600000)), 28) +
+      uint(int(round(lat * 600000)), 27) + uint(int(cog * 10), 12) + uint(511, 9) +
+      uint(second, 6) + uint(0, 2) + uint(0, 3) + uint(0, 1) + uint(0, 19))
+   return armor(bits)
+
+
+def text6(text, chars):
+   #AIS 6-bit text field, padded with @
+   bits = ""
+   for c in text.upper()[:chars].ljust(chars, "@"):
+      v = ord(c)
+      bits = bits + uint(v - 64 if v >= 64 else v, 6)
+   return bits
+
+
+def static_report(mmsi, name, callsign, ship_type, destination):
+   #Payload of an AIS static and voyage report (message type 5), 424 bits
+   bits = (uint(5, 6) + uint(0, 2) + uint(mmsi, 30) + uint(0, 2) + uint(9000000 + mmsi % 999999, 30) +
+      text6(callsign, 7) + text6(name, 20) + uint(ship_type, 8) + uint(100, 9) + uint(20, 9) +
+      uint(10, 6) + uint(10, 6) + uint(1, 4) + uint(0, 20) + uint(80, 8) + text6(destination, 20) +
+      uint(0, 1) + uint(0, 1))
+   return armor(bits)
+
+
+def synthetic_sentences(count, vessels=200, seed=1):
+   #Feed of a busy port: position reports of a fixed fleet moving slowly,
+   #two-part static reports, GPS fixes and heading. Checksums are valid.
+   rnd = random.Random(seed)
+   fleet = [[rnd.randint(201000000, 775999999), -33.8 + rnd.random(), 151.2 + rnd.random(),
+      rnd.random() * 15, rnd.random() * 360] for v in range(vessels)]
+   out = []
+   t = 0.0
+   lat = -33.85
+   lon = 151.25
+   for i in range(count):
+      t = t + 0.05
+      sec = int(t) % 60
+      if i % 20 == 0:
+         lat = lat + 0.00001
+         hms = "%02d%02d%05.2f" % (int(t / 3600) % 24, int(t / 60) % 60, t % 60)
+         body = "GPGGA,%s,%02d%07.4f,S,%03d%07.4f,E,1,09,0.9,12.0,M,21.0,M,," % (hms, int(-lat), (-lat % 1) * 60, int(lon), (lon % 1) * 60)
+         out.append("$" + body + "*" + checksum(body))
+      elif i % 20 == 10:
+         body = "HEHDT,%.1f,T" % (rnd.random() * 360)
+         out.append("$" + body + "*" + checksum(body))
+      elif i % 50 == 25:
+         v = fleet[rnd.randrange(vessels)]
+         payload, fill = static_report(v[0], "VESSEL %d" % (v[0] % 1000), "V%d" % (v[0] % 10000), 70, "SYDNEY")
+         seq = i % 10
+         for part, chunk in ((1, payload[:60]), (2, payload[60:])):
+            body = "AIVDM,2,%d,%d,A,%s,%d" % (part, seq, chunk, fill if part == 2 else 0)
+            out.append("!" + body + "*" + checksum(body))
+      else:
+         v = fleet[rnd.randrange(vessels)]
+         v[1] = v[1] + rnd.uniform(-0.0001, 0.0001)
+         v[2] = v[2] + rnd.uniform(-0.0001, 0.0001)
+         payload, fill = position_report(v[0], v[1], v[2], v[3], v[4], sec)
+         body = "AIVDM,1,1,,%s,%s,%d" % ("AB"[i % 2], payload, fill)
+         out.append("!" + body + "*" + checksum(body))
+   return out
+
+
+def load_log(path):
+   #Sentences of a recorded .dat log (plain, zipped or compressed by the logger)
+   #with the timestamp prefix removed
+   if path.endswith(".zip"):
+      z = zipfile.ZipFile(path)
+      data = b"".join(z.read(n) for n in z.namelist())
+   elif path.endswith(".gz"):
+      data = gzip.open(path).read()
+   elif path.endswith(".xz"):
+      data = lzma.open(path).read()
+   elif path.endswith(".zst"):
+      data = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True).read()
+   else:
+      data = open(path, "rb").read()
+   out = []
+   for line in data.decode("utf-8", "ignore").splitlines():
+      p = line.find(" UTC,")
+      if p >= 0:
+         line = line[p + 5:]
+      elif line[:1].isdigit():
+         #timestamp_format=epoch
+         line = line[line.find(",") + 1:]
+      out.append(line)
+   return [l for l in out if l]
+
+
+def log_text(sentences):
+   #Sentences as the logger writes them, one timestamp per 50 ms
+   t0 = time.mktime((2020, 1, 1, 0, 0, 0, 0, 1, 0))
+   out = []
+   for i, s in enumerate(sentences):
+      t = t0 + i * 0.05
+      out.append(time.strftime("%Y%m%d-%H%M%S", time.gmtime(t)) + ".%03d UTC," % (int(t * 1000) % 1000) + s + "\n")
+   return out
+
+
+def timed(fn, repeat=3):
+   #Best of repeat runs, in seconds
+   best = None
+   for r in range(repeat):
+      t0 = time.perf_counter()
+      fn()
+      dt = time.perf_counter() - t0
+      if best is None or dt < best:
+         best = dt
+   return best
+
+
+def report(label, seconds, count):
+   #Per-sentence cost and the share of one CPU needed at 1k and 10k sentences/s
+   per = seconds / count
+   print("   %-34s %8.3f us/sentence %10.0f sentences/s   cpu@1k %5.2f%%  cpu@10k %6.2f%%" %
+      (label, per * 1e6, 1 / per, per * 1000 * 100, per * 10000 * 100))
+
+
+def bench_filter(lines):
+   print("Sentence type filter")
+   count = len(lines)
+
+   def lookup(sf):
+      #As SourceLog.write: the address is read once, then filtered
+      for outdec in lines:
+         addr = sentence_address(outdec)
+         addr and sf.accepts_address(addr)
+   for types in ("GGA,VDM", "GGA,VDM,TTM,HDT,DPT,RMC,GSA,VTG,ZDA,MWV"):
+      nmea_sentence_types = types.split(",")
+      sf = SentenceFilter(nmea_sentence_types)
+
+      def scan():
+         for outdec in lines:
+            any(nst in outdec for nst in nmea_sentence_types)
+
+      print("  nmea_sentence_types=" + types)
+      report("substring scan (current)", timed(scan), count)
+      report("address lookup", timed(lambda: lookup(sf)), count)
+   sf = SentenceFilter("*VDM,GP*,-GPGSV")
+   report("address lookup *VDM,GP*,-GPGSV", timed(lambda: lookup(sf)), count)
+
+
+def bench_codec(lines, flush_lines=3000):
+   #CPU and ratio of each output codec. The compressor is finished every
+   #flush_lines lines as CompressedWriter does every codec_flush_sec.
+   print("Output codecs (compressor finished every %d lines)" % flush_lines)
+   text = log_text(lines)
+   raw = sum(len(l) for l in text)
+   chunks = ["".join(text[i:i + flush_lines]).encode("utf-8") for i in range(0, len(text), flush_lines)]
+   runs = [("gzip", 1), ("gzip", 6), ("gzip", 9), ("xz", 0), ("xz", 6)]
+   if zstandard is not None:
+      runs[3:3] = [("zstd", 1), ("zstd", 3), ("zstd", 9), ("zstd", 19)]
+   else:
+      print("   zstandard not installed, skipping zstd")
+
+   def zip_whole():
+      #Current mode: plain file zipped after rollover
+      return len(zlib.compress(b"".join(chunks), 6))
+
+   def streamed(codec, level):
+      size = 0
+      for c in chunks:
+         comp = compressor(codec, level)
+         size = size + len(comp.compress(c)) + len(comp.flush())
+      return size
+
+   print("   %-14s %10s %8s %10s %9s" % ("codec", "bytes", "ratio", "MB/s", "cpu@1k"))
+   for label, fn in [("zip (current)", zip_whole)] + [("%s %d" % r, (lambda r=r: streamed(*r))) for r in runs]:
+      size = fn()
+      dt = timed(fn, repeat=1)
+      print("   %-14s %10d %8.2f %10.2f %8.2f%%" % (label, size, raw / size, raw / dt / 1e6, dt / len(lines) * 1000 * 100))
+
+
+def synthetic_ports(path, count, seed=1):
+   #Ports file with count ports around the world: boxes of a few km and
+   #polygons with 5-12 vertices
+   rnd = random.Random(seed)
+   centres = []
+   with open(path, "w") as f:
+      f.write("[ports]\n")
+      for i in range(count):
+         lat = rnd.uniform(-60, 70)
+         lon = rnd.uniform(-180, 180)
+         size = rnd.uniform(0.02, 0.3)
+         centres.append((lat, lon))
+         if i % 3:
+            f.write("port%d (%.5f,%.5f) (%.5f,%.5f)\n" % (i, lat + size, lon - size, lat - size, lon + size))
+         else:
+            n = rnd.randint(5, 12)
+            pts = ["(%.5f,%.5f)" % (lat + size * math.sin(2 * math.pi * k / n) * rnd.uniform(0.6, 1),
+               lon + size * math.cos(2 * math.pi * k / n) * rnd.uniform(0.6, 1)) for k in range(n)]
+            f.write("port%d %s\n" % (i, " ".join(pts)))
+   return centres
+
+
+def bench_geofence(lines, count=10000, queries=20000):
+   print("Port geofence, %d ports" % count)
+   path = os.path.join(tempfile.mkdtemp(), "ports.txt")
+   centres = synthetic_ports(path, count)
+   t0 = time.perf_counter()
+   index = load_ports(path)
+   print("   load and index %.1f ms" % ((time.perf_counter() - t0) * 1000))
+   rnd = random.Random(2)
+   #Half of the positions at sea, half at a port
+   points = [(rnd.uniform(-60, 70), rnd.uniform(-180, 180)) if i % 2 else centres[rnd.randrange(count)] for i in range(queries)]
+
+   #Boxes only, as the old linear loop over the port list
+   boxes = []
+   with open(path) as f:
+      for line in f:
+         pts = line.split(" ")[1:]
+         if len(pts) == 2:
+            tl = pts[0].strip("()\n").split(",")
+            br = pts[1].strip("()\n").split(",")
+            boxes.append([line.split(" ")[0], float(tl[0]), float(tl[1]), float(br[0]), float(br[1])])
+
+   n = min(queries, 500)
+   few = points[:n]
+
+   def scan():
+      for cl in few:
+         for ple in boxes:
+            if cl[0] < ple[1] and cl[0] > ple[3] and cl[1] > ple[2] and cl[1] < ple[4]:
+               break
+
+   def lookup():
+      for lat, lon in points:
+         index.lookup(lat, lon)
+
+   hits = sum(1 for lat, lon in points if index.lookup(lat, lon))
+   dt = timed(lookup)
+   print("   grid lookup          %8.2f us/lookup (%d of %d positions in a port)" % (dt / queries * 1e6, hits, queries))
+   dt = timed(scan, repeat=1)
+   print("   linear box scan      %8.2f us/lookup (boxes only, as before)" % (dt / n * 1e6))
+   os.remove(path)
+
+
+def old_gga(outdec):
+   #GGA handling of the logger threads before nmea_position, for comparison
+   lpt = outdec.split("GGA,")[1]
+   lpt_lat = float(lpt.split(",")[1])/100
+   if lpt.split(",")[2] == 'S':
+      lpt_lat = lpt_lat * -1
+   tup1 = (math.modf(lpt_lat)[1], math.modf(lpt_lat)[0] * 100, 0)
+   lpt_lat = float(tup1[0]) + float(tup1[1])/60 + float(tup1[2])/(60*60)
+   lpt_lon = float(lpt.split(",")[3])/100
+   if lpt.split(",")[4] == 'W':
+      lpt_lon = lpt_lon * -1
+   tup1 = (math.modf(lpt_lon)[1], math.modf(lpt_lon)[0] * 100, 0)
+   lpt_lon = float(tup1[0]) + float(tup1[1])/60 + float(tup1[2])/(60*60)
+   return (lpt_lat, lpt_lon)
+
+
+def bench_position(lines):
+   print("Position parsing")
+   fixes = [l for l in lines if l[3:6] in ("GGA", "RMC", "GLL")]
+   if not fixes:
+      fixes = [l for l in SAMPLE_SENTENCES if l[3:6] in ("GGA", "RMC")]
+   gga = [l for l in fixes if l[3:6] == "GGA"] or fixes
+   n = 20000
+   gga = (gga * (n // len(gga) + 1))[:n]
+   fixes = (fixes * (n // len(fixes) + 1))[:n]
+
+   def old():
+      for l in gga:
+         try:
+            old_gga(l)
+         except Exception:
+            pass
+
+   def new(sentences):
+      for l in sentences:
+         try:
+            parse_position(l)
+         except ChecksumError:
+            pass
+
+   report("GGA, old split/modf (no checksum)", timed(old), n)
+   report("GGA, parse_position with checksum", timed(lambda: new(gga)), n)
+   report("GGA/RMC/GLL mix, parse_position", timed(lambda: new(fixes)), n)
+   report("of which checksum_ok", timed(lambda: [checksum_ok(l) for l in gga]), n)
+
+
+def bench_ais(lines, target=5000):
+   #Decode rate of the on-device AIS stage; target is messages/s on a Pi 4
+   print("AIS decoding (target %d messages/s)" % target)
+   ais = [l for l in lines if l[3:6] in ("VDM", "VDO")]
+   if not ais:
+      print("   no AIS sentences in input")
+      return
+
+   for check in (True, False):
+      def run():
+         d = AisDecoder(check=check)
+         for i, l in enumerate(ais):
+            d.feed(l, i * 0.01)
+         return d
+      d = run()
+      dt = timed(run)
+      print("   checksum %-5s %8.2f us/sentence %9.0f sentences/s  cpu@target %6.2f%%   decoded %d, errors %d, expired %d, unsupported %d" %
+         (check, dt / len(ais) * 1e6, len(ais) / dt, dt / len(ais) * target * 100, d.decoded, d.errors, d.expired, d.unsupported))
+
+
+def bench_binary(lines):
+   #Text .dat versus columnar .nmb: size, logger write cost and the time to
+   #load a file on shore (text re-parsing versus nmea_binlog.load)
+   print("Binary output")
+   text = log_text(lines)
+   t0 = time.mktime((2020, 1, 1, 0, 0, 0, 0, 1, 0))
+   stamps = [int((t0 + i * 0.05) * 1000) for i in range(len(lines))]
+   addrs = [sentence_address(l) or "" for l in lines]
+   tmp = tempfile.mkdtemp()
+   dat = os.path.join(tmp, "bench.dat")
+   nmb = os.path.join(tmp, "bench.nmb")
+
+   def write_text():
+      with open(dat, "w") as f:
+         for l in text:
+            f.write(l)
+
+   def write_binary():
+      if os.path.exists(nmb):
+         os.remove(nmb)
+      w = nmea_binlog.BinaryWriter(nmb, 1, "bench")
+      for i in range(len(lines)):
+         w.append(stamps[i], addrs[i], lines[i])
+      w.close()
+
+   def parse_text():
+      out = []
+      with open(dat) as f:
+         for line in f:
+            p = line.find(" UTC,")
+            t = time.strptime(line[:p - 4], "%Y%m%d-%H%M%S")
+            out.append((t, int(line[p - 3:p]), line[p + 5:-1]))
+      return out
+
+   n = len(lines)
+   dt = timed(write_text)
+   size = os.path.getsize(dat)
+   print("   %-24s %9.2f us/sentence %10d bytes" % ("write text", dt / n * 1e6, size))
+   print("   %-24s %9s %10d bytes" % ("zip of text", "", len(zlib.compress(open(dat, "rb").read(), 6))))
+   dt = timed(write_binary)
+   print("   %-24s %9.2f us/sentence %10d bytes" % ("write binary", dt / n * 1e6, os.path.getsize(nmb)))
+   dt = timed(parse_text, repeat=1)
+   print("   %-24s %9.2f us/sentence %10.0f sentences/s" % ("load text (strptime)", dt / n * 1e6, n / dt))
+   if nmea_binlog.numpy is None:
+      print("   numpy not installed, skipping binary load")
+   else:
+      dt = timed(lambda: nmea_binlog.load(nmb))
+      print("   %-24s %9.2f us/sentence %10.0f sentences/s" % ("load binary (numpy)", dt / n * 1e6, n / dt))
+   for p in (dat, nmb):
+      os.remove(p)
+   os.rmdir(tmp)
+
+
+def bench_dedup(lines, receivers=2, seed=1):
+   #AIS dedup/throttle stage on a feed heard by several receivers: each AIS
+   #sentence also arrives from the other receivers with probability 0.7
+   print("AIS dedup (%d receivers, one sentence per 50 ms)" % receivers)
+   rnd = random.Random(seed)
+   feed = []
+   for i, l in enumerate(lines):
+      if l[3:6] in ("VDM", "VDO"):
+         for r in range(receivers):
+            if r == 0 or rnd.random() < 0.7:
+               feed.append((l, i * 0.05, "rx%d" % r))
+   if not feed:
+      print("   no AIS sentences in input")
+      return
+   for interval in (0, 10, 30):
+      def run():
+         t = AisThrottle(interval)
+         for l, now, src in feed:
+            t.accept(l, now, src)
+         return t
+      st = run().stats()
+      dt = timed(run)
+      print("   min_interval %3d s  %6.2f us/sentence  logged %6.2f%%  duplicates %d  throttled %d  vessels %d" %
+         (interval, dt / len(feed) * 1e6, st["passed"] * 100.0 / len(feed), st["duplicates"], st["throttled"], st["vessels"]))
+
+
+def write_syscalls():
+   #write() calls made by this process so far (Linux only)
+   try:
+      with open("/proc/self/io") as f:
+         for line in f:
+            if line.startswith("syscw:"):
+               return int(line.split()[1])
+   except OSError:
+      pass
+   return None
+
+
+def bench_writer(lines):
+   #Line buffered text file (previous mode) versus BatchWriter; counts write
+   #syscalls through /proc/self/io
+   print("Output writer")
+   text = log_text(lines)
+   tmp = tempfile.mkdtemp()
+   path = os.path.join(tmp, "bench.dat")
+
+   def line_buffered():
+      with open(path, "a+", 1) as f:
+         for l in text:
+            f.write(l)
+
+   def batched(buffer_bytes, fsync_sec):
+      def run():
+         w = BatchWriter(path, buffer_bytes, 1.0, fsync_sec)
+         for l in text:
+            w.write(l)
+         w.close()
+      return run
+
+   runs = [("line buffered (old)", line_buffered), ("batch 4 KB", batched(4096, 0)),
+           ("batch 64 KB", batched(65536, 0)), ("batch 64 KB, fsync 1 s", batched(65536, 1))]
+   print("   %-24s %10s %14s %12s" % ("mode", "us/line", "lines/s", "writes"))
+   for label, fn in runs:
+      if os.path.exists(path):
+         os.remove(path)
+      before = write_syscalls()
+      t0 = time.perf_counter()
+      fn()
+      dt = time.perf_counter() - t0
+      after = write_syscalls()
+      calls = str(after - before) if before is not None else "n/a"
+      print("   %-24s %10.2f %14.0f %12s" % (label, dt / len(text) * 1e6, len(text) / dt, calls))
+   os.remove(path)
+   os.rmdir(tmp)
+
+
+def bench_timestamp(lines):
+   #Cost of one line timestamp: the old per-line datetime formatting versus
+   #Timestamper (one strftime per second, milliseconds from a table)
+   print("Timestamps")
+   n = len(lines)
+
+   def old():
+      for i in range(n):
+         dtstmp = datetime.utcnow().strftime("%Y%m%d-%H%M%S.%f")[:-3] + " UTC,"
+
+   def cached(fmt):
+      def run():
+         clock = Timestamper(fmt)
+         for i in range(n):
+            ms, dtstmp = clock.stamp()
+      return run
+
+   def wall_ms():
+      for i in range(n):
+         ms = int(time.time() * 1000)
+
+   clock = Timestamper()
+   print("   sample: %s  %s" % (clock.stamp()[1], Timestamper("epoch").stamp()[1]))
+   for label, fn in (("datetime.strftime (old)", old), ("Timestamper utc", cached("utc")),
+                     ("Timestamper epoch", cached("epoch")), ("time.time() only", wall_ms)):
+      report(label, timed(fn), n)
+
+
+BENCHMARKS = {
+   "filter": bench_filter,
+   "codec": bench_codec,
+   "ais": bench_ais,
+   "binary": bench_binary,
+   "dedup": bench_dedup,
+   "writer": bench_writer,
+   "timestamp": bench_timestamp,
+   "geofence": bench_geofence,
+   "position": bench_position,
+}
+
+
+def main():
+   ap = argparse.ArgumentParser(description="NMEA Logger hot path benchmarks")
+   ap.add_argument("names", nargs="*", help="benchmarks to run: " + ", ".join(sorted(BENCHMARKS)) + " (default all)")
+   ap.add_argument("--count", type=int, default=100000, help="sentences per run")
+   ap.add_argument("--input", help="recorded log to use instead of synthetic sentences")
+   args = ap.parse_args()
+   for name in args.names:
+      if name not in BENCHMARKS:
+         ap.error("unknown benchmark " + name)
+   if args.input:
+      lines = load_log(args.input)[:args.count]
+   else:
+      lines = synthetic_sentences(args.count)
+   for name in args.names or sorted(BENCHMARKS):
+      BENCHMARKS[name](lines)
+
+
+if __name__ == "__main__":
+   main()
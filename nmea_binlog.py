@@ -0,0 +1,295 @@
+#******************
+# NMEA Logger
+# Columnar binary log (.nmb) and a NumPy reader for it
+#******************
+# Written instead of, or next to, the text .dat file ([General] output_format).
+# Every sentence is stored as an int64 epoch-ms timestamp, a source id, a
+# sentence type code and the raw sentence, kept in one array per column and
+# written in blocks. File layout, all little endian:
+#   header  "NMB1", version uint16, source id uint16, name length uint16,
+#           source name (utf-8)
+#   block   "NMBK", flags uint16, rows uint32, types length uint32,
+#           body length uint32, types, body
+#           types: the sentence addresses of the block separated by \n; the
+#           type code of a row is an index into this list
+#           body (zlib deflated if flags & 1):
+#              time    int64[rows]    epoch milliseconds, UTC
+#              source  uint16[rows]
+#              type    uint16[rows]
+#              end     uint32[rows]   end offset of each sentence in payload
+#              payload the sentences (utf-8), without terminators
+# Blocks are self-contained, so a file cut short by a power loss can be read
+# up to its last complete block and a reader can skip blocks it does not need.
+#******************
+
+
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from nmea_writer import BatchWriter
+
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
+
+BINARY_SUFFIX = ".nmb"
+MAGIC = b"NMB1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHH")
+BLOCK_MAGIC = b"NMBK"
+BLOCK = struct.Struct("<4sHIII")
+FLAG_ZLIB = 1
+#Type codes are uint16
+MAX_BLOCK_ROWS = 65535
+
+
+def _bytes(a):
+   #Column array as little endian bytes
+   if sys.byteorder == "big":
+      a = array(a.typecode, a)
+      a.byteswap()
+   return a.tobytes()
+
+
+class BinaryWriter(object):
+   #Same interface as a text file / CompressedWriter for SourceLog, plus
+   #append() for one sentence. A block is written when it has block_rows
+   #sentences or is flush_sec seconds old. The file is written through a
+   #BatchWriter with the given settings.
+   def __init__(self, path, source_id=0, source_name="", block_rows=4096, flush_sec=60, level=6, buffer_bytes=65536, write_flush_sec=1.0, fsync_sec=0):
+      self.path = path
+      self.source_id = source_id
+      self.block_rows = min(block_rows, MAX_BLOCK_ROWS)
+      self.flush_sec = flush_sec
+      #zlib level for the block body, 0 to store it uncompressed
+      self.level = level
+      self.f = BatchWriter(path, buffer_bytes, write_flush_sec, fsync_sec)
+      if self.f.tell() == 0:
+         name = source_name.encode("utf-8")
+         self.f.write(HEADER.pack(MAGIC, VERSION, source_id, len(name)) + name)
+      self.blocks = 0
+      #on_block(start, end) is called with the byte range of every block written
+      self.on_block = None
+      self.new_block()
+
+   def new_block(self):
+      self.times = array("q")
+      self.types = array("H")
+      self.ends = array("I")
+      self.payload = bytearray()
+      self.codes = {}
+      self.started = time.monotonic()
+
+   def append(self, ms, address, sentence):
+      #Add one sentence; returns the number of bytes it adds before compression
+      code = self.codes.get(address)
+      if code is None:
+         code = len(self.codes)
+         self.codes[address] = code
+      data = sentence.encode("utf-8")
+      self.times.append(ms)
+      self.types.append(code)
+      self.payload += data
+      self.ends.append(len(self.payload))
+      if len(self.times) >= self.block_rows or time.monotonic() - self.started >= self.flush_sec:
+         self.write_block()
+      return 16 + len(data)
+
+   def write_block(self):
+      rows = len(self.times)
+      if rows == 0:
+         return
+      types = "\n".join(sorted(self.codes, key=self.codes.get)).encode("utf-8")
+      body = b"".join((_bytes(self.times), _bytes(array("H", [self.source_id]) * rows),
+                       _bytes(self.types), _bytes(self.ends), bytes(self.payload)))
+      flags = 0
+      if self.level > 0:
+         body = zlib.compress(body, self.level)
+         flags = FLAG_ZLIB
+      start = self.f.tell()
+      self.f.write(BLOCK.pack(BLOCK_MAGIC, flags, rows, len(types), len(body)) + types + body)
+      self.blocks = self.blocks + 1
+      if self.on_block is not None:
+         self.on_block(start, self.f.tell())
+      self.new_block()
+
+   def flush(self):
+      self.write_block()
+      self.f.flush()
+
+   def poll(self):
+      #Time based flushes for when no sentences arrive
+      if self.times and time.monotonic() - self.started >= self.flush_sec:
+         self.write_block()
+      self.f.poll()
+
+   def fileno(self):
+      return self.f.fileno()
+
+   def close(self):
+      if self.f.closed:
+         return
+      self.write_block()
+      self.f.close()
+
+
+def read_header(f):
+   #(source id, source name) of an open .nmb file
+   raw = f.read(HEADER.size)
+   if len(raw) < HEADER.size:
+      raise ValueError("not an NMEA binary log")
+   magic, version, source_id, name_len = HEADER.unpack(raw)
+   if magic != MAGIC or version != VERSION:
+      raise ValueError("not an NMEA binary log")
+   return source_id, f.read(name_len).decode("utf-8")
+
+
+def read_blocks(f):
+   #Yields (offset, rows, types, body) for every complete block of an open
+   #file positioned after the header. A truncated last block is ignored.
+   while True:
+      offset = f.tell()
+      raw = f.read(BLOCK.size)
+      if len(raw) < BLOCK.size:
+         return
+      magic, flags, rows, types_len, body_len = BLOCK.unpack(raw)
+      if magic != BLOCK_MAGIC:
+         return
+      types = f.read(types_len)
+      body = f.read(body_len)
+      if len(types) < types_len or len(body) < body_len:
+         return
+      if flags & FLAG_ZLIB:
+         body = zlib.decompress(body)
+      yield offset, rows, types.decode("utf-8").split("\n"), body
+
+
+def complete_length(path):
+   #Bytes at the start of a file left open by a crash that hold the header
+   #and complete blocks, 0 if not even the header is complete. Only the
+   #block headers are read, and the body of the last block is checked.
+   size = os.path.getsize(path)
+   with open(path, "rb") as f:
+      try:
+         read_header(f)
+      except (ValueError, UnicodeDecodeError):
+         return 0
+      good = f.tell()
+      if good > size:
+         return 0
+      last = None
+      while True:
+         raw = f.read(BLOCK.size)
+         if len(raw) < BLOCK.size:
+            break
+         magic, flags, rows, types_len, body_len = BLOCK.unpack(raw)
+         end = f.tell() + types_len + body_len
+         if magic != BLOCK_MAGIC or end > size:
+            break
+         last = (good, flags, types_len, body_len)
+         good = end
+         f.seek(end)
+      if last is not None and last[1] & FLAG_ZLIB:
+         f.seek(last[0] + BLOCK.size + last[2])
+         try:
+            zlib.decompress(f.read(last[3]))
+         except zlib.error:
+            good = last[0]
+   return good
+
+
+def block_rows(rows, types, body):
+   #(ms, source id, address, sentence) of every row of a block from
+   #read_blocks(), without numpy
+   cols = []
+   pos = 0
+   for typecode, size in (("q", 8), ("H", 2), ("H", 2), ("I", 4)):
+      a = array(typecode)
+      a.frombytes(body[pos:pos + size * rows])
+      if sys.byteorder == "big":
+         a.byteswap()
+      cols.append(a)
+      pos = pos + size * rows
+   times, srcs, kinds, ends = cols
+   payload = body[pos:]
+   prev = 0
+   for i in range(rows):
+      yield times[i], srcs[i], types[kinds[i]], payload[prev:ends[i]].decode("utf-8")
+      prev = ends[i]
+
+
+def load(paths):
+   #Load one or more .nmb files into NumPy arrays:
+   #   time     int64 epoch ms          source  uint16 source id
+   #   type     uint16 index into types offsets int64[n + 1] into payload
+   #   payload  uint8, all sentences back to back
+   #   types    list of sentence addresses  sources {source id: name}
+   if numpy is None:
+      raise ImportError("numpy is needed to load NMEA binary logs")
+   if isinstance(paths, str):
+      paths = [paths]
+   types = []
+   codes = {}
+   sources = {}
+   times = []
+   srcs = []
+   kinds = []
+   ends = []
+   payloads = []
+   base = 0
+   for path in paths:
+      with open(path, "rb") as f:
+         source_id, name = read_header(f)
+         sources[source_id] = name
+         for offset, rows, block_types, body in read_blocks(f):
+            #Block type codes -> codes of the combined type list
+            remap = numpy.empty(len(block_types), numpy.uint16)
+            for i, address in enumerate(block_types):
+               if address not in codes:
+                  codes[address] = len(types)
+                  types.append(address)
+               remap[i] = codes[address]
+            pos = 0
+            times.append(numpy.frombuffer(body, "<i8", rows, pos))
+            pos = pos + 8 * rows
+            srcs.append(numpy.frombuffer(body, "<u2", rows, pos))
+            pos = pos + 2 * rows
+            kinds.append(remap[numpy.frombuffer(body, "<u2", rows, pos)])
+            pos = pos + 2 * rows
+            block_ends = numpy.frombuffer(body, "<u4", rows, pos).astype(numpy.int64)
+            pos = pos + 4 * rows
+            ends.append(block_ends + base)
+            payloads.append(numpy.frombuffer(body, numpy.uint8, -1, pos))
+            base = base + (int(block_ends[-1]) if rows else 0)
+
+   def cat(parts, dtype):
+      return numpy.concatenate(parts) if parts else numpy.empty(0, dtype)
+
+   return {"time": cat(times, numpy.int64), "source": cat(srcs, numpy.uint16),
+           "type": cat(kinds, numpy.uint16),
+           "offsets": numpy.concatenate([numpy.zeros(1, numpy.int64)] + ends),
+           "payload": cat(payloads, numpy.uint8), "types": types, "sources": sources}
+
+
+def sentence(data, i):
+   #Text of row i of the arrays returned by load()
+   return data["payload"][data["offsets"][i]:data["offsets"][i + 1]].tobytes().decode("utf-8")
+
+
+if __name__ == "__main__":
+   #Summary of .nmb files: python nmea_binlog.py file.nmb ...
+   data = load(sys.argv[1:])
+   n = len(data["time"])
+   print(str(n) + " sentences from " + ", ".join(data["sources"].values()))
+   if n:
+      t = data["time"]
+      print("first " + time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t.min() / 1000.0)) +
+            " UTC, last " + time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t.max() / 1000.0)) + " UTC")
+      counts = numpy.bincount(data["type"], minlength=len(data["types"]))
+      for code in numpy.argsort(-counts):
+         print("   %-8s %d" % (data["types"][code], counts[code]))
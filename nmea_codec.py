@@ -0,0 +1,175 @@
+#******************
+# NMEA Logger
+# Streaming compression of the output files
+#******************
+# [General] codec selects how data files are written:
+#   none   plain text, zipped by the archiver after rollover (default)
+#   gzip   deflate, written as gzip members          (.gz)
+#   zstd   zstandard frames, needs python zstandard  (.zst)
+#   xz     lzma, written as xz streams               (.xz)
+# codec_level is the compression level (default 6 for gzip/xz, 3 for zstd).
+# The compressor is finished every codec_flush_sec seconds, closing the
+# current member/frame/stream, and the file is then synced to the drive
+# whatever fsync_sec is. Concatenated members are valid files for gunzip,
+# zstd -d and xz -d, so after a power loss everything up to the last flush
+# can be recovered.
+#******************
+
+
+import gzip
+import io
+import logging
+import lzma
+import time
+import zlib
+from nmea_writer import BatchWriter
+
+try:
+   import zstandard
+except ImportError:
+   zstandard = None
+
+
+CODEC_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst", "xz": ".xz"}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3, "xz": 6}
+#Files the transfer thread uploads, including binary logs (nmea_binlog.py)
+#and index sidecars (nmea_index.py)
+ARCHIVE_SUFFIXES = (".zip", ".gz", ".zst", ".xz", ".nmb", ".idx")
+
+
+def check_codec(codec):
+   #Return a usable codec name; an unknown or unavailable codec falls back so
+   #logging never stops because of a config mistake
+   if codec not in CODEC_SUFFIXES:
+      logging.info("Unknown codec " + codec + ", writing plain text")
+      return "none"
+   if codec == "zstd" and zstandard is None:
+      logging.info("zstandard module not installed, using gzip instead of zstd")
+      return "gzip"
+   return codec
+
+
+def codec_of(filename):
+   #Codec of a file written by CompressedWriter, "none" for plain files
+   for codec, suffix in CODEC_SUFFIXES.items():
+      if suffix and filename.endswith(suffix):
+         return codec
+   return "none"
+
+
+def decompress(codec, data):
+   #Data of one or more complete members/frames/streams
+   if codec == "gzip":
+      return gzip.decompress(data)
+   if codec == "zstd":
+      return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+   if codec == "xz":
+      return lzma.decompress(data)
+   return data
+
+
+def complete_length(path, codec, chunk=1 << 20):
+   #Bytes at the start of a file left open by a crash that form complete
+   #members/frames/streams; whatever follows is a torn last one
+   if codec == "gzip":
+      new = lambda: zlib.decompressobj(31)
+   elif codec == "zstd":
+      if zstandard is None:
+         raise ValueError("zstandard module not installed")
+      new = lambda: zstandard.ZstdDecompressor().decompressobj()
+   elif codec == "xz":
+      new = lzma.LZMADecompressor
+   else:
+      raise ValueError("not a compressed codec: " + codec)
+   errors = (zlib.error, lzma.LZMAError, EOFError)
+   if zstandard is not None:
+      errors = errors + (zstandard.ZstdError,)
+   good = 0
+   pos = 0
+   d = new()
+   with open(path, "rb") as f:
+      while True:
+         data = f.read(chunk)
+         if not data:
+            return good
+         while data:
+            try:
+               d.decompress(data)
+            except errors:
+               return good
+            if not d.eof:
+               pos = pos + len(data)
+               break
+            #End of a member; the rest of the chunk starts the next one
+            rest = d.unused_data
+            pos = pos + len(data) - len(rest)
+            good = pos
+            data = rest
+            d = new()
+
+
+def compressor(codec, level=None):
+   #A new compressor object; compress(data) adds data, flush() finishes the
+   #member/frame/stream and returns the remaining bytes
+   if level is None:
+      level = DEFAULT_LEVELS[codec]
+   if codec == "gzip":
+      return zlib.compressobj(level, zlib.DEFLATED, 31)
+   if codec == "zstd":
+      return zstandard.ZstdCompressor(level=level).compressobj()
+   if codec == "xz":
+      return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+   raise ValueError("no compressor for codec " + codec)
+
+
+class CompressedWriter(object):
+   #Text file object that compresses as data arrives. Used by SourceLog in
+   #place of a plain BatchWriter when a codec is configured; the compressed
+   #output goes through a BatchWriter with the given settings.
+   def __init__(self, path, codec, level=None, flush_sec=60, buffer_bytes=65536, write_flush_sec=1.0, fsync_sec=0):
+      self.raw = BatchWriter(path, buffer_bytes, write_flush_sec, fsync_sec)
+      self.codec = codec
+      self.level = level
+      self.flush_sec = flush_sec
+      self.comp = None
+      self.last_flush = time.monotonic()
+      #on_block(start, end) is called with the byte range of every finished member
+      self.on_block = None
+      self.start = 0
+
+   def write(self, text):
+      if self.comp is None:
+         self.comp = compressor(self.codec, self.level)
+         self.start = self.raw.tell()
+      out = self.comp.compress(text.encode("utf-8"))
+      if out:
+         self.raw.write(out)
+      if time.monotonic() - self.last_flush >= self.flush_sec:
+         self.flush()
+
+   def flush(self):
+      #Finish the current member so everything written so far is decodable,
+      #and sync it so it survives a power loss
+      finished = self.comp is not None
+      if finished:
+         self.raw.write(self.comp.flush())
+         self.comp = None
+         if self.on_block is not None:
+            self.on_block(self.start, self.raw.tell())
+      self.raw.flush()
+      if finished:
+         self.raw.sync()
+      self.last_flush = time.monotonic()
+
+   def poll(self):
+      #Time based flushes for when no data arrives
+      if self.comp is not None and time.monotonic() - self.last_flush >= self.flush_sec:
+         self.flush()
+      self.raw.poll()
+
+   def fileno(self):
+      return self.raw.fileno()
+
+   def close(self):
+      self.flush()
+      self.raw.close()
@@ -0,0 +1,129 @@
+#******************
+# NMEA Logger
+# AIS deduplication and per-vessel downsampling, shared by all sources
+#******************
+# A VDM/VDO sentence is dropped when
+#   - the same payload was already logged within dup_window seconds, from
+#     any source (the same transmission heard by several receivers), or
+#   - a message of the same type from the same MMSI was logged less than
+#     min_interval seconds ago (0 disables this limit).
+# The MMSI and message type are taken straight from the armored payload, no
+# full decode is needed. Vessels are kept in an LRU of max_vessels entries.
+# Multi-fragment messages are only checked for duplicates, on their first
+# fragment; the decision is applied to the remaining fragments of that
+# source so a message is never logged in part.
+#******************
+
+
+import threading
+from collections import OrderedDict
+
+
+def _sixbit(c):
+   v = ord(c) - 48
+   if v > 40:
+      v = v - 8
+   return v
+
+
+def payload_key(payload):
+   #(mmsi, message type) from the first 7 characters of a payload: type in
+   #bits 0-5, repeat indicator 6-7, MMSI 8-37
+   v = [_sixbit(c) for c in payload[:7]]
+   mmsi = ((v[1] & 0xF) << 26) | (v[2] << 20) | (v[3] << 14) | (v[4] << 8) | (v[5] << 2) | (v[6] >> 4)
+   return mmsi, v[0]
+
+
+class AisThrottle(object):
+   def __init__(self, min_interval=0.0, dup_window=10.0, max_vessels=4096, max_recent=8192):
+      self.min_interval = min_interval
+      self.dup_window = dup_window
+      self.max_vessels = max_vessels
+      self.max_recent = max_recent
+      self.lock = threading.Lock()
+      #(mmsi, type) -> time of the last logged message, least recent first
+      self.vessels = OrderedDict()
+      #payload -> time it was logged, oldest first
+      self.recent = OrderedDict()
+      #(source, sequence id, channel) -> decision for the following fragments
+      self.fragments = {}
+      self.passed = 0
+      self.duplicates = 0
+      self.throttled = 0
+      self.evicted = 0
+      self.errors = 0
+
+   def accept(self, sentence, now, source=""):
+      #True if the sentence should be logged; now is the receipt time in seconds
+      start = 0
+      if sentence[0] == "\\":
+         start = sentence.find("\\", 1) + 1
+      f = sentence[start:].split(",", 6)
+      if len(f) < 6 or len(f[5]) < 7:
+         self.errors = self.errors + 1
+         return True
+      with self.lock:
+         if f[1] != "1":
+            return self._fragment(f, now, source)
+         payload = f[5]
+         if self._duplicate(payload, now):
+            self.duplicates = self.duplicates + 1
+            return False
+         if self.min_interval > 0:
+            try:
+               key = payload_key(payload)
+            except IndexError:
+               key = None
+            if key is not None:
+               last = self.vessels.get(key)
+               if last is not None and now - last < self.min_interval:
+                  self.throttled = self.throttled + 1
+                  return False
+               self.vessels[key] = now
+               self.vessels.move_to_end(key)
+               if len(self.vessels) > self.max_vessels:
+                  self.vessels.popitem(last=False)
+                  self.evicted = self.evicted + 1
+         self._remember(payload, now)
+         self.passed = self.passed + 1
+         return True
+
+   def _fragment(self, f, now, source):
+      key = (source, f[3], f[4])
+      if f[2] == "1":
+         keep = not self._duplicate(f[5], now)
+         if keep:
+            self._remember(f[5], now)
+         if len(self.fragments) > 256:
+            self.fragments.clear()
+         self.fragments[key] = keep
+      else:
+         keep = self.fragments.get(key, True)
+         if f[1] == f[2]:
+            self.fragments.pop(key, None)
+      if keep:
+         self.passed = self.passed + 1
+      else:
+         self.duplicates = self.duplicates + 1
+      return keep
+
+   def _duplicate(self, payload, now):
+      seen = self.recent.get(payload)
+      return seen is not None and now - seen <= self.dup_window
+
+   def _remember(self, payload, now):
+      self.recent[payload] = now
+      self.recent.move_to_end(payload)
+      while len(self.recent) > self.max_recent:
+         self.recent.popitem(last=False)
+      #Drop payloads that are out of the window
+      while self.recent:
+         oldest = next(iter(self.recent.values()))
+         if now - oldest <= self.dup_window:
+            break
+         self.recent.popitem(last=False)
+
+   def stats(self):
+      with self.lock:
+         return {"passed": self.passed, "duplicates": self.duplicates, "throttled": self.throttled,
+                 "vessels": len(self.vessels), "evicted": self.evicted, "errors": self.errors}
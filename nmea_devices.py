@@ -0,0 +1,147 @@
+#******************
+# NMEA Logger
+# Hot detection of USB serial adapters
+#******************
+# The serial workers are started for every configured port, present or not,
+# and wait in wait_for() until their device exists. DeviceWatcher follows
+# /dev with inotify (from libc through ctypes, no extra package) and wakes
+# the waiting workers as soon as udev creates a ttyUSB/ttyACM node, so an
+# adapter plugged in after startup, or re-plugged after a failure, is logged
+# without a restart of the logger. Where inotify is not available /dev is
+# rescanned every poll_sec seconds instead.
+#******************
+
+
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+
+PATTERNS = ("ttyUSB*", "ttyACM*")
+IN_ATTRIB = 0x004
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+#struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT = struct.Struct("iIII")
+
+
+def _libc():
+   #libc with the inotify calls, None where they do not exist
+   try:
+      libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+      libc.inotify_init1
+      libc.inotify_add_watch
+      return libc
+   except (OSError, AttributeError):
+      return None
+
+
+class DeviceWatcher(object):
+   def __init__(self, directory="/dev", patterns=PATTERNS, poll_sec=5):
+      self.directory = directory
+      self.patterns = patterns
+      self.poll_sec = poll_sec
+      self.cond = threading.Condition()
+      self.present = set(self.scan())
+
+   def scan(self):
+      found = []
+      for pattern in self.patterns:
+         found.extend(glob.glob(os.path.join(self.directory, pattern)))
+      return sorted(found)
+
+   def matches(self, name):
+      return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+   def open_inotify(self):
+      #inotify descriptor watching the directory, or None
+      libc = _libc()
+      if libc is None:
+         return None
+      fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+      if fd < 0:
+         return None
+      mask = IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_ATTRIB
+      if libc.inotify_add_watch(fd, self.directory.encode(), mask) < 0:
+         logging.info("Devices: cannot watch " + self.directory + ": " + os.strerror(ctypes.get_errno()))
+         os.close(fd)
+         return None
+      return fd
+
+   def changed(self, fd):
+      #Read the pending events; True if one is about a watched device
+      hit = False
+      try:
+         buf = os.read(fd, 65536)
+      except BlockingIOError:
+         return False
+      i = 0
+      while i + EVENT.size <= len(buf):
+         wd, mask, cookie, length = EVENT.unpack_from(buf, i)
+         name = buf[i + EVENT.size:i + EVENT.size + length].rstrip(b"\0").decode("utf-8", "replace")
+         i = i + EVENT.size + length
+         if self.matches(name):
+            hit = True
+      return hit
+
+   def update(self, found):
+      found = set(found)
+      added = found - self.present
+      for path in sorted(added):
+         logging.info("Devices: " + path + " added")
+      for path in sorted(self.present - found):
+         logging.info("Devices: " + path + " removed")
+      with self.cond:
+         self.present = found
+         if added:
+            self.cond.notify_all()
+
+   def run(self, should_stop):
+      fd = self.open_inotify()
+      if fd is None:
+         logging.info("Devices: inotify not available, scanning " + self.directory + " every " + str(self.poll_sec) + " s")
+      else:
+         logging.info("Devices: watching " + self.directory + " for " + ", ".join(self.patterns))
+      #Devices that came or went before the watch was set up
+      self.update(self.scan())
+      last_scan = time.monotonic()
+      try:
+         while not should_stop():
+            if fd is not None:
+               ready = select.select([fd], [], [], 1)[0]
+               if ready and self.changed(fd):
+                  self.update(self.scan())
+            else:
+               time.sleep(1)
+               if time.monotonic() - last_scan >= self.poll_sec:
+                  last_scan = time.monotonic()
+                  self.update(self.scan())
+      finally:
+         if fd is not None:
+            os.close(fd)
+
+   def wait_for(self, path, should_stop):
+      #Block until path exists; False if should_stop() came first. Also
+      #checks once a second, for ports outside the watched patterns.
+      waiting = False
+      with self.cond:
+         while not os.path.exists(path):
+            if should_stop():
+               return False
+            if not waiting:
+               logging.info("Waiting for device " + path)
+               waiting = True
+            self.cond.wait(1)
+      if waiting:
+         logging.info("Device " + path + " present")
+      return True
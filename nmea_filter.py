@@ -0,0 +1,121 @@
+#******************
+# NMEA Logger
+# Sentence filter on the NMEA address field (talker + sentence type)
+#******************
+# nmea_sentence_types is a comma separated list of patterns:
+#   GGA      sentence type from any talker (same as *GGA)
+#   *VDM     sentence type from any talker
+#   GP*      any sentence from talker GP
+#   AIVDM    exact address
+#   G?GSV    other shell style wildcards (* ? [..]) on the full address
+#   *        everything
+# A pattern prefixed with '-' is a deny entry, e.g. GP*,-GPGSV. If there are
+# no allow entries everything not denied is accepted.
+# A leading $ or ! in a pattern is ignored.
+#******************
+
+
+import fnmatch
+import re
+
+
+#Distinct addresses are few (a couple of dozen per vessel); the cache limit
+#only guards against line noise producing arbitrary "addresses".
+CACHE_LIMIT = 1024
+
+
+def sentence_address(sentence):
+   #Return the address field of a sentence ("GPGGA" for "$GPGGA,...") or None
+   #if the line is not an NMEA sentence. An NMEA 4 tag block (\...\) in front
+   #of the sentence is skipped.
+   c = sentence[:1]
+   if c == "$" or c == "!":
+      end = sentence.find(",", 1)
+      if end > 0:
+         return sentence[1:end]
+      start = 0
+   elif c == "\\":
+      start = sentence.find("\\", 1) + 1
+      if start == 0 or sentence[start:start + 1] not in ("$", "!"):
+         return None
+      end = sentence.find(",", start)
+      if end > 0:
+         return sentence[start + 1:end]
+   else:
+      return None
+   end = sentence.find("*", start)
+   if end < 0:
+      end = len(sentence)
+   return sentence[start + 1:end]
+
+
+class _PatternSet(object):
+   #Patterns compiled into set lookups, with one regex for the rest
+   def __init__(self, patterns):
+      self.match_all = False
+      self.exact = set()
+      self.types = set()
+      self.talkers = {}
+      wild = []
+      for p in patterns:
+         if p == "*":
+            self.match_all = True
+         elif not any(c in p for c in "*?["):
+            if len(p) == 3:
+               self.types.add(p)
+            else:
+               self.exact.add(p)
+         elif p.startswith("*") and not any(c in p[1:] for c in "*?["):
+            self.types.add(p[1:])
+         elif p.endswith("*") and not any(c in p[:-1] for c in "*?["):
+            self.talkers.setdefault(len(p) - 1, set()).add(p[:-1])
+         else:
+            wild.append(fnmatch.translate(p))
+      self.regex = re.compile("|".join(wild)) if wild else None
+      self.empty = not (self.match_all or self.exact or self.types or self.talkers or wild)
+
+   def match(self, addr):
+      if self.match_all or addr in self.exact:
+         return True
+      for t in self.types:
+         if addr.endswith(t):
+            return True
+      for n, prefixes in self.talkers.items():
+         if addr[:n] in prefixes:
+            return True
+      return self.regex is not None and self.regex.match(addr) is not None
+
+
+class SentenceFilter(object):
+   def __init__(self, nmea_sentence_types):
+      if isinstance(nmea_sentence_types, str):
+         nmea_sentence_types = nmea_sentence_types.split(",")
+      allow = []
+      deny = []
+      for p in nmea_sentence_types:
+         p = p.strip()
+         if not p:
+            continue
+         if p[0] == "-":
+            deny.append(p[1:].lstrip("$!"))
+         else:
+            allow.append(p.lstrip("$!"))
+      self.allow = _PatternSet(allow)
+      self.deny = _PatternSet(deny)
+      self.cache = {}
+
+   def accepts_address(self, addr):
+      #Decisions are cached per address, so after the first sentence of a kind
+      #the check is a single dict lookup
+      ok = self.cache.get(addr)
+      if ok is None:
+         ok = (self.allow.empty or self.allow.match(addr)) and not self.deny.match(addr)
+         if len(self.cache) < CACHE_LIMIT:
+            self.cache[addr] = ok
+      return ok
+
+   def accepts(self, sentence):
+      addr = sentence_address(sentence)
+      if addr is None:
+         return False
+      return self.accepts_address(addr)
@@ -0,0 +1,42 @@
+#******************
+# NMEA Logger
+# Line framing for streamed NMEA input (TCP and other byte streams)
+#******************
+
+
+class LineFramer(object):
+   #Splits a byte stream into NMEA sentences as data arrives. A single buffer is
+   #reused for the lifetime of the framer. Bytes after the last line terminator
+   #are kept and completed by the next feed, so sentences split across reads
+   #are never cut in two.
+   #Sentences are terminated by CRLF; a bare LF is accepted as well since some
+   #multiplexers strip the CR.
+   def __init__(self, max_line=4096):
+      self.buf = bytearray()
+      self.max_line = max_line
+      #Bytes discarded because no terminator was seen within max_line
+      self.dropped = 0
+
+   def feed(self, data):
+      #Append data and return the list of complete sentences (bytes, without
+      #terminator). Empty lines are skipped.
+      buf = self.buf
+      buf += data
+      end = buf.rfind(b"\n")
+      if end < 0:
+         if len(buf) > self.max_line:
+            #Line noise without any terminator, do not let the buffer grow forever
+            self.dropped = self.dropped + len(buf)
+            del buf[:]
+         return []
+      lines = bytes(buf[:end]).split(b"\n")
+      del buf[:end + 1]
+      return [s for s in (l.rstrip(b"\r") for l in lines) if s]
+
+   def pending(self):
+      #Number of tail bytes waiting for their terminator
+      return len(self.buf)
+
+   def reset(self):
+      #Drop any partial sentence, e.g. after a reconnect
+      del self.buf[:]
@@ -0,0 +1,165 @@
+#******************
+# NMEA Logger
+# Resumable FTP uploader used by the transfer thread
+#******************
+# Sessions stay open between transfer cycles (kept alive with NOOP) and are
+# only reopened when the server or the link drops them. A file that was
+# partly uploaded is resumed with REST from the size the server reports, and
+# the result is checked with SIZE only. The backlog can be spread over
+# several parallel connections, all sharing one rate limit.
+# When should_stop() becomes true an upload is cut after the current block;
+# the part already on the server is resumed at the next start.
+#******************
+
+
+import ftplib
+import logging
+import os
+import queue
+import threading
+import time
+
+
+class Interrupted(Exception):
+   #Raised from the transfer callback to cut an upload at shutdown
+   pass
+
+
+class FtpUploader(object):
+   def __init__(self, server, user, password, remote_dir, connections=1, timeout=20, port=21, blocksize=8192, bucket=None):
+      self.server = server
+      self.user = user
+      self.password = password
+      self.remote_dir = remote_dir
+      self.connections = connections
+      self.timeout = timeout
+      self.port = port
+      self.blocksize = blocksize
+      #Optional nmea_schedule.TokenBucket limiting the upload rate
+      self.bucket = bucket
+      #One slot per connection; None when not connected
+      self.sessions = [None] * connections
+
+   def connect(self):
+      session = ftplib.FTP(timeout=self.timeout)
+      session.connect(self.server, self.port)
+      session.login(self.user, self.password)
+      session.cwd(self.remote_dir)
+      #SIZE is only reliable in binary mode
+      session.voidcmd("TYPE I")
+      return session
+
+   def session(self, slot):
+      #Connected session for a slot, reusing the open one if it still answers
+      session = self.sessions[slot]
+      if session is not None:
+         try:
+            session.voidcmd("NOOP")
+            return session
+         except ftplib.all_errors:
+            self.drop(slot)
+      session = self.connect()
+      self.sessions[slot] = session
+      logging.info("FTP: connected to " + self.server + " (connection " + str(slot + 1) + ")")
+      return session
+
+   def drop(self, slot):
+      session = self.sessions[slot]
+      self.sessions[slot] = None
+      if session is not None:
+         try:
+            session.close()
+         except ftplib.all_errors:
+            pass
+
+   def keepalive(self):
+      #Keep idle control connections open between transfer cycles
+      for slot in range(self.connections):
+         if self.sessions[slot] is not None:
+            try:
+               self.sessions[slot].voidcmd("NOOP")
+            except ftplib.all_errors:
+               self.drop(slot)
+
+   def close(self):
+      for slot in range(self.connections):
+         session = self.sessions[slot]
+         if session is not None:
+            try:
+               session.quit()
+            except ftplib.all_errors:
+               pass
+         self.drop(slot)
+
+   def remote_size(self, session, name):
+      #Size of the remote file, or None if it does not exist
+      try:
+         return session.size(name)
+      except ftplib.error_perm:
+         return None
+
+   def upload_file(self, session, path, should_stop=lambda: False):
+      #Upload one file, resuming a partial upload. Returns the number of bytes
+      #sent, or None if the remote size does not match the local size afterwards.
+      #Raises Interrupted if should_stop() becomes true during the upload.
+      name = os.path.basename(path)
+      local_size = os.path.getsize(path)
+      rest = self.remote_size(session, name)
+      if rest is None or rest > local_size:
+         rest = 0
+      if rest < local_size:
+         if rest > 0:
+            logging.info("FTP: resuming " + name + " at " + str(rest) + " of " + str(local_size) + " bytes")
+         def callback(block):
+            if self.bucket is not None:
+               self.bucket.consume(len(block))
+            if should_stop():
+               raise Interrupted()
+         with open(path, "rb") as f:
+            f.seek(rest)
+            session.storbinary("STOR " + name, f, self.blocksize, callback, rest=rest if rest > 0 else None)
+      if self.remote_size(session, name) != local_size:
+         return None
+      return local_size - rest
+
+   def upload(self, files, on_done, should_stop=lambda: False):
+      #Upload files (local paths, in the order given) over up to 'connections'
+      #parallel sessions. on_done(path, nbytes, seconds) is called for each
+      #verified file with the bytes sent and the time taken.
+      #Files not reached because of errors stay for the next cycle.
+      work = queue.Queue()
+      for path in files:
+         work.put(path)
+      n = min(self.connections, len(files))
+      workers = [threading.Thread(target=self._worker, args=(slot, work, on_done, should_stop)) for slot in range(n)]
+      for w in workers:
+         w.start()
+      for w in workers:
+         w.join()
+
+   def _worker(self, slot, work, on_done, should_stop):
+      while not should_stop():
+         try:
+            path = work.get_nowait()
+         except queue.Empty:
+            return
+         if not os.path.isfile(path):
+            continue
+         try:
+            session = self.session(slot)
+            t0 = time.monotonic()
+            nbytes = self.upload_file(session, path, should_stop)
+            if nbytes is not None:
+               on_done(path, nbytes, time.monotonic() - t0)
+            else:
+               logging.info("FTP: size mismatch after upload of " + os.path.basename(path))
+         except Interrupted:
+            #The control connection is left mid-transfer, so it is not reused
+            logging.info("FTP: upload of " + os.path.basename(path) + " stopped for shutdown, resumed at the next start")
+            self.drop(slot)
+            return
+         except ftplib.all_errors as e:
+            #Leave the rest of the backlog to the other connections or the next cycle
+            logging.info("FTP error: " + str(e))
+            self.drop(slot)
+            return
@@ -0,0 +1,127 @@
+#******************
+# NMEA Logger
+# Port geofence: which port (if any) a position is in
+#******************
+# Ports file format, one port per line:
+#   Name (top_left_lat,top_left_lon) (bottom_right_lat,bottom_right_lon)
+#   Name (lat,lon) (lat,lon) (lat,lon) ...      three or more points: polygon
+# Empty lines, lines starting with # and the [ports] header are ignored.
+# A box whose left longitude is greater than its right one crosses the
+# antimeridian.
+# Shapes are registered in a grid of cell_deg degree cells, so a lookup only
+# tests the few shapes overlapping the cell of the position.
+#******************
+
+
+import logging
+import math
+import re
+
+
+_POINT = re.compile(r"\(\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)\s*\)")
+
+
+class Box(object):
+   def __init__(self, name, top, left, bottom, right):
+      self.name = name
+      self.top = top
+      self.left = left
+      self.bottom = bottom
+      self.right = right
+
+   def bounds(self):
+      #Lon ranges (one or two when crossing the antimeridian) and lat range
+      if self.left <= self.right:
+         return [(self.left, self.right)], (self.bottom, self.top)
+      return [(self.left, 180.0), (-180.0, self.right)], (self.bottom, self.top)
+
+   def contains(self, lat, lon):
+      if not (self.bottom < lat < self.top):
+         return False
+      if self.left <= self.right:
+         return self.left < lon < self.right
+      return lon > self.left or lon < self.right
+
+
+class Polygon(object):
+   def __init__(self, name, points):
+      self.name = name
+      self.lats = [p[0] for p in points]
+      self.lons = [p[1] for p in points]
+
+   def bounds(self):
+      return [(min(self.lons), max(self.lons))], (min(self.lats), max(self.lats))
+
+   def contains(self, lat, lon):
+      #Ray casting
+      inside = False
+      lats = self.lats
+      lons = self.lons
+      j = len(lats) - 1
+      for i in range(len(lats)):
+         if (lats[i] > lat) != (lats[j] > lat):
+            x = lons[i] + (lat - lats[i]) * (lons[j] - lons[i]) / (lats[j] - lats[i])
+            if lon < x:
+               inside = not inside
+         j = i
+      return inside
+
+
+class PortIndex(object):
+   def __init__(self, cell_deg=1.0):
+      self.cell_deg = cell_deg
+      self.cells = {}
+      self.count = 0
+
+   def _cell(self, v):
+      return int(math.floor(v / self.cell_deg))
+
+   def add(self, shape):
+      lon_ranges, (lat0, lat1) = shape.bounds()
+      for lon0, lon1 in lon_ranges:
+         for ci in range(self._cell(lat0), self._cell(lat1) + 1):
+            for cj in range(self._cell(lon0), self._cell(lon1) + 1):
+               self.cells.setdefault((ci, cj), []).append(shape)
+      self.count = self.count + 1
+
+   def lookup(self, lat, lon):
+      #Name of the port containing the position, or None
+      shapes = self.cells.get((self._cell(lat), self._cell(lon)))
+      if shapes:
+         for shape in shapes:
+            if shape.contains(lat, lon):
+               return shape.name
+      return None
+
+
+def parse_port(line):
+   #Shape for one line of the ports file, or None for comments/headers
+   line = line.strip()
+   if not line or line[0] == "#" or line == "[ports]":
+      return None
+   first = line.find("(")
+   if first <= 0:
+      raise ValueError("no coordinates")
+   name = line[:first].strip()
+   points = [(float(a), float(b)) for a, b in _POINT.findall(line, first)]
+   if len(points) == 2:
+      (top, left), (bottom, right) = points
+      return Box(name, top, left, bottom, right)
+   if len(points) >= 3:
+      return Polygon(name, points)
+   raise ValueError("need 2 points for a box or 3 or more for a polygon")
+
+
+def load_ports(path, cell_deg=1.0):
+   index = PortIndex(cell_deg)
+   with open(path) as f:
+      for n, line in enumerate(f, 1):
+         try:
+            shape = parse_port(line)
+         except ValueError as e:
+            logging.info("Ports file line " + str(n) + " ignored: " + str(e))
+            continue
+         if shape is not None:
+            index.add(shape)
+   logging.info("Loaded " + str(index.count) + " ports from " + path)
+   return index
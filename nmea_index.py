@@ -0,0 +1,103 @@
+#******************
+# NMEA Logger
+# Index sidecar written next to every rotated data file
+#******************
+# <timestr>-<name>.idx is a small JSON document:
+#   source, first, last     source name, first/last sentence time (epoch ms)
+#   rows, types             sentence count, total and per address ("GPGGA")
+#   mmsi                    AIS messages per MMSI
+#   files                   for every data file of the rollover (.dat, .dat.gz,
+#                           .nmb, ...) its blocks: [start, end, first, last,
+#                           rows, [addresses]], start/end being byte offsets
+# A block is a unit that can be read without the rest of the file: a gzip
+# member, zstd frame or xz stream (nmea_codec), a .nmb block (nmea_binlog), or
+# codec_flush_sec worth of lines of a plain .dat file (offsets into the
+# uncompressed file, which ends up zipped as <timestr>-<name>.zip).
+# nmea_query.py uses the indexes to read only the blocks a query needs. Only
+# the blocks of compressed and .nmb files can be read on their own: a zip
+# member cannot be entered in the middle, so a block of a zipped .dat file
+# is reached by decompressing the member from its start. With codec none
+# the index still skips files, but not the data before a block. Indexes are
+# only written with index_files=1 (off by default).
+#******************
+
+
+import json
+import os
+from nmea_dedup import payload_key
+
+
+INDEX_SUFFIX = ".idx"
+VERSION = 1
+
+
+class FileIndex(object):
+   def __init__(self, source):
+      self.source = source
+      self.first = None
+      self.last = None
+      self.rows = 0
+      self.types = {}
+      self.mmsi = {}
+      #file name -> [finished blocks, [first, last, rows, addresses] of the open block]
+      self.streams = {}
+
+   def stream(self, name):
+      #Register a data file; its writer reports blocks with block(name, ...)
+      self.streams[name] = [[], [None, None, 0, set()]]
+
+   def add(self, ms, address, sentence):
+      #One logged sentence; call before handing it to the writers
+      if self.first is None:
+         self.first = ms
+      self.last = ms
+      self.rows = self.rows + 1
+      self.types[address] = self.types.get(address, 0) + 1
+      if address.endswith(("VDM", "VDO")):
+         start = 0
+         if sentence[0] == "\\":
+            start = sentence.find("\\", 1) + 1
+         f = sentence[start:].split(",", 6)
+         #Only single sentences and first fragments carry the MMSI
+         if len(f) > 5 and f[2] == "1" and len(f[5]) >= 7:
+            try:
+               mmsi = payload_key(f[5])[0]
+               self.mmsi[mmsi] = self.mmsi.get(mmsi, 0) + 1
+            except IndexError:
+               pass
+      for blocks, cur in self.streams.values():
+         if cur[2] == 0:
+            cur[0] = ms
+         cur[1] = ms
+         cur[2] = cur[2] + 1
+         cur[3].add(address)
+
+   def block(self, name, start, end):
+      #The data added since the last block of name is in bytes start..end
+      blocks, cur = self.streams[name]
+      if cur[2] == 0 or end <= start:
+         return
+      blocks.append([start, end, cur[0], cur[1], cur[2], sorted(cur[3])])
+      self.streams[name][1] = [None, None, 0, set()]
+
+   def save(self, path):
+      #Written to a temporary file and renamed, like the archives
+      doc = {"version": VERSION, "source": self.source, "first": self.first, "last": self.last,
+             "rows": self.rows, "types": self.types, "mmsi": self.mmsi,
+             "files": dict((name, s[0]) for name, s in self.streams.items())}
+      tmp = path + ".tmp"
+      with open(tmp, "w") as f:
+         json.dump(doc, f, separators=(",", ":"))
+         f.flush()
+         os.fsync(f.fileno())
+      os.replace(tmp, path)
+
+
+def load_index(path):
+   with open(path) as f:
+      doc = json.load(f)
+   if doc.get("version") != VERSION:
+      raise ValueError("unsupported index version")
+   #JSON object keys are strings
+   doc["mmsi"] = dict((int(k), v) for k, v in doc["mmsi"].items())
+   return doc
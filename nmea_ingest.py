@@ -0,0 +1,186 @@
+#******************
+# NMEA Logger
+# asyncio ingest engine: runs all configured serial and TCP sources in one
+# event loop instead of one OS thread per port
+#******************
+# Sources are read from nmea_logging.config. Every section with a 'port' entry
+# is a serial source, every section with a 'tcp_sourceip' entry is a TCP source.
+# [General] data_source selects which kinds are used: com, tcp or com,tcp
+#******************
+
+
+import asyncio
+import logging
+import os
+import serial
+import time
+from nmea_framer import LineFramer
+from nmea_supervisor import Backoff
+
+
+SERIAL = "com"
+TCP = "tcp"
+
+
+class Source(object):
+   #One configured input. kind is SERIAL or TCP, settings holds the
+   #connection parameters from the config section.
+   def __init__(self, kind, name, section=None, **settings):
+      self.kind = kind
+      self.name = name
+      self.section = section
+      self.settings = settings
+
+   def available(self):
+      #Serial sources are only used if the device exists
+      if self.kind == SERIAL:
+         return os.path.exists(self.settings["port"])
+      return True
+
+
+def read_sources(parser, data_source):
+   kinds = [k.strip() for k in data_source.split(",")]
+   sources = []
+   for section in parser.sections():
+      if parser.has_option(section, 'port') and SERIAL in kinds:
+         sources.append(Source(SERIAL, parser.get(section, 'name', fallback=section), section,
+            port      = parser.get(section, 'port'),
+            baud_rate = int(parser.get(section, 'baud_rate')),
+            data_bits = int(parser.get(section, 'data_bits')),
+            parity    = parser.get(section, 'parity'),
+            stop_bits = int(parser.get(section, 'stop_bits')),
+            timeout   = int(parser.get(section, 'timeout'))))
+      elif parser.has_option(section, 'tcp_sourceip') and TCP in kinds:
+         sources.append(Source(TCP, parser.get(section, 'name', fallback=section), section,
+            host = parser.get(section, 'tcp_sourceip'),
+            port = int(parser.get(section, 'tcp_port'))))
+   return sources
+
+
+class IngestEngine(object):
+   #sink_factory(source) returns the object that receives the sentences of a
+   #source. It must provide feed(lines), called with the list of complete
+   #sentences (bytes) of each read, poll(), called about once a second so a
+   #quiet source can still rotate its file, error(), called for a failed read
+   #or a lost connection, and close().
+   #should_stop() is polled once a second; when it returns True all sources
+   #are cancelled and their sinks closed.
+   #A failed source is opened again, and a lost TCP connection reconnected,
+   #after reconnect_sec seconds, doubling up to reconnect_max_sec with jitter
+   #(see nmea_supervisor.Backoff). A missing serial device is waited for.
+   def __init__(self, sources, sink_factory, should_stop, reconnect_sec=2, reconnect_max_sec=60):
+      self.sources = sources
+      self.sink_factory = sink_factory
+      self.should_stop = should_stop
+      self.reconnect_sec = reconnect_sec
+      self.reconnect_max_sec = reconnect_max_sec
+      self.loop = None
+      self.sinks = []
+
+   def run(self):
+      asyncio.run(self._run())
+
+   async def _run(self):
+      self.loop = asyncio.get_running_loop()
+      tasks = [asyncio.ensure_future(self._source(src)) for src in self.sources]
+      while not self.should_stop():
+         await asyncio.sleep(1)
+         for sink in self.sinks:
+            sink.poll()
+      for t in tasks:
+         t.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+
+   async def _source(self, src):
+      logging.info("Ingest: starting " + src.kind + " source " + src.name)
+      sink = self.sink_factory(src)
+      self.sinks.append(sink)
+      backoff = Backoff(self.reconnect_sec, self.reconnect_max_sec)
+      try:
+         while True:
+            started = time.monotonic()
+            try:
+               if src.kind == SERIAL:
+                  await self._serial(src, sink)
+               else:
+                  await self._tcp(src, sink)
+            except asyncio.CancelledError:
+               raise
+            except Exception as e:
+               sink.error()
+               logging.info("Ingest: source " + src.name + " failed: " + str(e))
+            #A source that ran a while before failing starts again from the
+            #first delay
+            if time.monotonic() - started >= 60:
+               backoff.reset()
+            await asyncio.sleep(backoff.next())
+      except asyncio.CancelledError:
+         pass
+      finally:
+         self.sinks.remove(sink)
+         sink.close()
+         logging.info("Exit from " + src.name)
+
+   async def _serial(self, src, sink):
+      s = src.settings
+      waiting = False
+      while not os.path.exists(s["port"]):
+         if not waiting:
+            logging.info("Ingest: waiting for device " + s["port"])
+            waiting = True
+         await asyncio.sleep(1)
+      #timeout=0 makes reads non-blocking; the event loop wakes us when the
+      #device file descriptor becomes readable
+      ser = serial.Serial(port=s["port"],baudrate=s["baud_rate"],bytesize=s["data_bits"],parity=s["parity"],stopbits=s["stop_bits"],timeout=0)
+      ser.reset_input_buffer()
+      framer = LineFramer()
+      failed = self.loop.create_future()
+
+      def readable():
+         try:
+            data = ser.read(ser.in_waiting or 1)
+         except serial.SerialException as e:
+            if not failed.done():
+               failed.set_exception(e)
+            return
+         if data:
+            sink.feed(framer.feed(data))
+
+      fd = ser.fileno()
+      self.loop.add_reader(fd, readable)
+      logging.info("Ingest: reading from " + s["port"])
+      try:
+         await failed
+      finally:
+         self.loop.remove_reader(fd)
+         ser.close()
+
+   async def _tcp(self, src, sink):
+      s = src.settings
+      backoff = Backoff(self.reconnect_sec, self.reconnect_max_sec)
+      while True:
+         try:
+            reader, writer = await asyncio.open_connection(s["host"], s["port"])
+         except OSError:
+            await asyncio.sleep(backoff.next())
+            continue
+         backoff.reset()
+         logging.info("TCP: connected with " + s["host"] + " " + str(s["port"]))
+         framer = LineFramer()
+         try:
+            while True:
+               data = await reader.read(4096)
+               if not data:
+                  break
+               #Fed first, so a send that fails loses nothing received
+               sink.feed(framer.feed(data))
+               #This send is crucial. Without it some NMEA TCP sockets will fail, eventually
+               writer.write(b"csiro_nmea_logger")
+               await writer.drain()
+         except OSError:
+            pass
+         finally:
+            writer.close()
+         sink.error()
+         logging.info("TCP: connection lost. Attempting to reconnect")
+         await asyncio.sleep(backoff.next())
@@ -0,0 +1,162 @@
+#******************
+# NMEA Logger
+# Journal of the open data files, for a fast restart after a crash
+#******************
+# SourceLog records every data file it opens and closes in open_files.txt on
+# the flash drive, with its rotation state (time opened, rotation deadline)
+# and, for plain text, the size at the last fsync, which always ends on a
+# complete line. The journal is synced when a file is opened or closed, so it
+# never misses a file that may hold data.
+# At startup only the files still open in the journal need work: recover()
+# returns them without reading any data, ingest starts at once, and the
+# recovery thread cuts each one back to its last complete line, member or
+# block with repair() before it goes to complete/ and the archiver.
+# Records, one per line, tab separated:
+#   O  filename  source  opened  deadline
+#   S  filename  offset
+#   C  filename
+#******************
+
+
+import logging
+import os
+import threading
+from nmea_archiver import fsync_dir
+from nmea_binlog import BINARY_SUFFIX
+from nmea_binlog import complete_length as binary_length
+from nmea_codec import codec_of, complete_length
+
+
+JOURNAL_NAME = "open_files.txt"
+
+
+class OpenFile(object):
+   def __init__(self, filename, source, opened, deadline):
+      self.filename = filename
+      self.source = source
+      #Epoch seconds; deadline is 0 when the file rotates on size only
+      self.opened = opened
+      self.deadline = deadline
+      #File size at the last fsync
+      self.synced = 0
+
+
+class FileJournal(object):
+   def __init__(self, path, compact_lines=1000):
+      self.path = path
+      self.compact_lines = compact_lines
+      self.files = {}
+      self.lines = 0
+      self.f = None
+      self.lock = threading.Lock()
+
+   def recover(self):
+      #Read the journal and rewrite it with the files still open. Returns
+      #those files, oldest first; each must be closed() once it is repaired.
+      files = {}
+      if os.path.isfile(self.path):
+         with open(self.path) as f:
+            for line in f:
+               parts = line.rstrip("\n").split("\t")
+               try:
+                  if parts[0] == "O" and len(parts) == 5:
+                     files[parts[1]] = OpenFile(parts[1], parts[2], float(parts[3]), float(parts[4]))
+                  elif parts[0] == "S" and len(parts) == 3 and parts[1] in files:
+                     files[parts[1]].synced = int(parts[2])
+                  elif parts[0] == "C" and len(parts) == 2:
+                     files.pop(parts[1], None)
+               except ValueError:
+                  #A torn last record
+                  pass
+      with self.lock:
+         self.files = files
+         self.compact()
+      return sorted(files.values(), key=lambda of: of.opened)
+
+   def compact(self):
+      #Called with the lock held
+      if self.f is not None:
+         self.f.close()
+      tmp = self.path + ".tmp"
+      with open(tmp, "w") as f:
+         for of in self.files.values():
+            f.write("O\t%s\t%s\t%.3f\t%.3f\n" % (of.filename, of.source, of.opened, of.deadline))
+            if of.synced:
+               f.write("S\t%s\t%d\n" % (of.filename, of.synced))
+         f.flush()
+         os.fsync(f.fileno())
+      os.replace(tmp, self.path)
+      fsync_dir(os.path.dirname(self.path) or ".")
+      self.f = open(self.path, "a", 1)
+      self.lines = 0
+
+   def write(self, record, sync):
+      #Called with the lock held
+      self.f.write(record)
+      self.lines = self.lines + 1
+      if sync:
+         os.fsync(self.f.fileno())
+
+   def opened(self, filename, source, opened, deadline=None):
+      with self.lock:
+         of = OpenFile(filename, source, opened, deadline or 0)
+         self.files[filename] = of
+         self.write("O\t%s\t%s\t%.3f\t%.3f\n" % (filename, source, of.opened, of.deadline), True)
+
+   def synced(self, filename, offset):
+      #Not synced itself: a lost record only makes repair() read more
+      with self.lock:
+         of = self.files.get(filename)
+         if of is not None:
+            of.synced = offset
+            self.write("S\t%s\t%d\n" % (filename, offset), False)
+
+   def closed(self, filename):
+      with self.lock:
+         if self.files.pop(filename, None) is None:
+            return
+         self.write("C\t%s\n" % filename, True)
+         if self.lines >= self.compact_lines:
+            self.compact()
+
+   def close(self):
+      with self.lock:
+         if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def text_length(path, synced=0, chunk=65536):
+   #Bytes up to the end of the last complete line. synced is known to end on
+   #a line, so only the part written after it is searched, from the end.
+   size = os.path.getsize(path)
+   synced = min(synced, size)
+   end = size
+   with open(path, "rb") as f:
+      while end > synced:
+         start = max(synced, end - chunk)
+         f.seek(start)
+         p = f.read(end - start).rfind(b"\n")
+         if p >= 0:
+            return start + p + 1
+         end = start
+   return synced
+
+
+def repair(path, synced=0):
+   #Cut a file left open by a crash back to its last complete line (plain
+   #text), member (gzip, zstd, xz) or block (.nmb). Returns the bytes cut.
+   size = os.path.getsize(path)
+   codec = codec_of(path)
+   if path.endswith(BINARY_SUFFIX):
+      keep = binary_length(path)
+   elif codec != "none":
+      keep = complete_length(path, codec)
+   else:
+      keep = text_length(path, synced)
+   if keep < size:
+      with open(path, "r+b") as f:
+         f.truncate(keep)
+         os.fsync(f.fileno())
+      logging.info("Cut " + str(size - keep) + " torn bytes from " + os.path.basename(path))
+   return size - keep
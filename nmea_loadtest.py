@@ -0,0 +1,461 @@
+#******************
+# NMEA Logger
+# Load test: feeds the real logger pipeline at increasing sentence rates and
+# reports the highest rate it sustains. Runs off the Pi, no GPIO, serial
+# hardware or FTP server needed.
+#******************
+# Command line parameters:
+# TCP source, default rates:  nmea_loadtest.py
+# Fake serial port (pty):     nmea_loadtest.py --source serial
+# Selected rates:             nmea_loadtest.py --rates 1000,5000,20000
+# Recorded log as input:      nmea_loadtest.py --input 20200101-000000-COM1.zip
+# With FTP transfer:          nmea_loadtest.py --transfer
+# All sources of one run:     nmea_loadtest.py --engine asyncio
+# Flash drive stalls:         nmea_loadtest.py --stall-ms 300 --pipeline off
+#******************
+# Sentences are sent by a separate process, through a local TCP server or a
+# pseudo terminal standing in for a serial port, in 10 ms batches. Like a
+# live feed the sender does not wait for the logger: a batch that does not
+# fit into the socket or pty buffer is dropped and counted as overrun. The
+# logger side is the real ingest thread (or asyncio engine), SourceLog,
+# rotation, archiver, status controller (on FakeGPIO) and, with --transfer,
+# the transfer thread uploading to a minimal FTP server in a third process.
+# --pipeline sets pipeline_policy (off writes on the reader thread, see
+# nmea_pipeline.py); --stall-ms blocks one output write a second for that
+# long, like a flash drive busy erasing.
+# Files are written to a temp dir through nmea_logging.media_root.
+# Per rate the report shows the rate achieved by the sender, the overrun and
+# loss (sentences sent but not found in the output files) in percent, the CPU
+# used by the logger process, its peak RSS, the upload rate and the time the
+# coordinated shutdown took. A rate is sustained when the sender kept up and
+# overrun plus loss stay within --max-loss; the ladder stops at the first
+# rate that is not.
+#******************
+
+
+import argparse
+import logging
+import multiprocessing
+import os
+import pty
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import tty
+import types
+import psutil
+from nmea_benchmark import synthetic_sentences, load_log
+from nmea_ingest import IngestEngine, Source, SERIAL, TCP
+from nmea_archiver import Archiver
+from nmea_schedule import TransferQueue
+from nmea_rotation import RotationPolicy
+from nmea_metrics import Registry
+from nmea_status import StatusController, FakeGPIO
+from nmea_journal import FileJournal, JOURNAL_NAME
+from nmea_shutdown import INGEST, ARCHIVE, TRANSFER, SERVICE
+from nmea_supervisor import Supervisor
+from nmea_devices import DeviceWatcher
+from nmea_pipeline import StagedSink, POLICIES
+
+
+DEFAULT_RATES = "500,1000,2000,5000,10000,20000,50000"
+TICK = 0.01
+LOG_SUFFIXES = (".dat", ".zip", ".gz", ".zst", ".xz")
+
+
+def feeder(kind, endpoint, sentences, rate, duration, eol, go, stop, results):
+   #Sender process. endpoint is a listening socket (tcp) or the pty master fd.
+   if kind == "tcp":
+      endpoint.settimeout(30)
+      conn, addr = endpoint.accept()
+      conn.setblocking(False)
+      send = conn.send
+   else:
+      os.set_blocking(endpoint, False)
+      send = lambda data: os.write(endpoint, data)
+   go.wait(30)
+   time.sleep(0.5)
+   data = [(s + eol).encode("ascii", "replace") for s in sentences]
+   n = len(data)
+   offered = dropped = 0
+   pending = b""
+   t0 = time.monotonic()
+   wake = t0
+   while True:
+      elapsed = time.monotonic() - t0
+      if elapsed >= duration:
+         break
+      due = int(rate * elapsed) - offered
+      if due > 0:
+         first = offered
+         offered = offered + due
+         if pending:
+            #The rest of the previous batch goes first, keeping lines whole
+            try:
+               pending = pending[send(pending):]
+            except BlockingIOError:
+               pass
+         if pending:
+            dropped = dropped + due
+         else:
+            chunk = b"".join(data[(first + i) % n] for i in range(due))
+            try:
+               pending = chunk[send(chunk):]
+            except BlockingIOError:
+               dropped = dropped + due
+      if kind == "tcp":
+         #Discard what the logger sends back
+         try:
+            while conn.recv(65536):
+               pass
+         except OSError:
+            pass
+      wake = wake + TICK
+      delay = wake - time.monotonic()
+      if delay > 0:
+         time.sleep(delay)
+      else:
+         wake = time.monotonic()
+   seconds = time.monotonic() - t0
+   results.put({"offered": offered, "sent": offered - dropped, "dropped": dropped, "seconds": seconds})
+   #Keep the connection open until the logger has stopped reading
+   while not stop.wait(0.1):
+      if pending:
+         try:
+            pending = pending[send(pending):]
+         except BlockingIOError:
+            pass
+      if kind == "tcp":
+         try:
+            conn.recv(65536)
+         except OSError:
+            pass
+   if kind == "tcp":
+      conn.close()
+   else:
+      os.close(endpoint)
+
+
+class FtpHandler(socketserver.StreamRequestHandler):
+   #The commands FtpUploader uses: USER, PASS, CWD, TYPE, NOOP, SIZE, REST,
+   #PASV, STOR and QUIT. Any remote dir is accepted and created.
+   def reply(self, text):
+      self.wfile.write((text + "\r\n").encode("ascii"))
+
+   def handle(self):
+      cwd = self.server.root
+      rest = 0
+      pasv = None
+      self.reply("220 NMEA Logger load test")
+      for line in self.rfile:
+         cmd, _, arg = line.decode("ascii", "replace").strip().partition(" ")
+         cmd = cmd.upper()
+         if cmd == "USER":
+            self.reply("331 Password required")
+         elif cmd == "PASS":
+            self.reply("230 Logged in")
+         elif cmd == "CWD":
+            cwd = os.path.join(self.server.root, arg.strip("/"))
+            os.makedirs(cwd, exist_ok=True)
+            self.reply("250 OK")
+         elif cmd in ("TYPE", "NOOP"):
+            self.reply("200 OK")
+         elif cmd == "SIZE":
+            path = os.path.join(cwd, os.path.basename(arg))
+            if os.path.isfile(path):
+               self.reply("213 " + str(os.path.getsize(path)))
+            else:
+               self.reply("550 No such file")
+         elif cmd == "REST":
+            rest = int(arg)
+            self.reply("350 Restarting at " + arg)
+         elif cmd == "PASV":
+            if pasv is not None:
+               pasv.close()
+            pasv = socket.socket()
+            pasv.bind(("127.0.0.1", 0))
+            pasv.listen(1)
+            port = pasv.getsockname()[1]
+            self.reply("227 Entering Passive Mode (127,0,0,1,%d,%d)" % (port // 256, port % 256))
+         elif cmd == "STOR" and pasv is not None:
+            self.reply("150 Opening data connection")
+            data, addr = pasv.accept()
+            pasv.close()
+            pasv = None
+            path = os.path.join(cwd, os.path.basename(arg))
+            with open(path, "r+b" if rest and os.path.exists(path) else "wb") as f:
+               f.seek(rest)
+               f.truncate()
+               while True:
+                  block = data.recv(65536)
+                  if not block:
+                     break
+                  f.write(block)
+            data.close()
+            rest = 0
+            self.reply("226 Transfer complete")
+         elif cmd == "QUIT":
+            self.reply("221 Bye")
+            break
+         else:
+            self.reply("502 Not implemented")
+      if pasv is not None:
+         pasv.close()
+
+
+class FtpStandIn(socketserver.ThreadingTCPServer):
+   #FTP server on a free local port storing the uploads under root
+   daemon_threads = True
+   allow_reuse_address = True
+
+   def __init__(self, root):
+      self.root = root
+      socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), FtpHandler)
+
+
+def ftp_server(root, ports):
+   #FTP process; sends its port back, runs until terminated
+   server = FtpStandIn(root)
+   ports.put(server.server_address[1])
+   server.serve_forever()
+
+
+def load_logger():
+   #nmea_logging with the Pi-only parts replaced: the clock check (nmea_clock
+   #is installed on the logger only) and RPi.GPIO
+   try:
+      import nmea_clock
+   except ImportError:
+      clock = types.ModuleType("nmea_clock")
+      clock.check_clock = lambda: "OK"
+      sys.modules["nmea_clock"] = clock
+   import nmea_logging
+   nmea_logging.GPIO = FakeGPIO()
+   return nmea_logging
+
+
+def count_logged(flashdrive):
+   #(sentences, files) in the text output under the media dir
+   lines = 0
+   files = 0
+   for dirpath, dirnames, filenames in os.walk(flashdrive):
+      for name in filenames:
+         if name.endswith(LOG_SUFFIXES):
+            lines = lines + len(load_log(os.path.join(dirpath, name)))
+            files = files + 1
+   return lines, files
+
+
+def stalling_writer(base, stall_sec):
+   #BatchWriter whose writes block for stall_sec once a second
+   class StallingWriter(base):
+      last = [time.monotonic()]
+
+      def drain(self):
+         if time.monotonic() - StallingWriter.last[0] >= 1:
+            StallingWriter.last[0] = time.monotonic()
+            time.sleep(stall_sec)
+         base.drain(self)
+
+   return StallingWriter
+
+
+def run_step(nl, args, sentences, rate):
+   #One rate of the ladder, start to finish on a fresh media dir
+   ctx = multiprocessing.get_context("fork")
+   tmp = tempfile.mkdtemp(prefix="nmea_loadtest_")
+   media = "bench"
+   flashdrive = os.path.join(tmp, media) + "/"
+   os.makedirs(flashdrive + "complete")
+   os.makedirs(flashdrive + "transferred")
+   nl.media_root = tmp + "/"
+   supervisor = Supervisor()
+   nl.supervisor = supervisor
+
+   #Child processes are forked before any logger thread runs
+   ftp = None
+   if args.transfer:
+      ftp_root = tempfile.mkdtemp(prefix="nmea_ftp_")
+      ports = ctx.Queue()
+      ftp = ctx.Process(target=ftp_server, args=(ftp_root, ports))
+      ftp.start()
+      ftp_port = ports.get(timeout=10)
+   go = ctx.Event()
+   stop = ctx.Event()
+   results = ctx.Queue()
+   slave = None
+   if args.source == "tcp":
+      endpoint = socket.socket()
+      endpoint.bind(("127.0.0.1", 0))
+      endpoint.listen(1)
+      src = Source(TCP, "tcp", host="127.0.0.1", port=endpoint.getsockname()[1])
+   else:
+      endpoint, slave = pty.openpty()
+      tty.setraw(slave)
+      src = Source(SERIAL, "com", port=os.ttyname(slave), baud_rate=args.baud, data_bits=8, parity="N", stop_bits=1, timeout=1)
+   sender = ctx.Process(target=feeder, args=(args.source, endpoint, sentences, rate, args.duration, "\r\n", go, stop, results))
+   sender.start()
+   if args.source == "tcp":
+      endpoint.close()
+   else:
+      os.close(endpoint)
+
+   status = StatusController(FakeGPIO())
+   metrics = Registry()
+   transfer_queue = TransferQueue(flashdrive + "complete")
+   archiver = Archiver(flashdrive + "complete", "dat", 16, 1, transfer_queue.add if args.transfer else None)
+   journal = FileJournal(flashdrive + JOURNAL_NAME)
+   journal.recover()
+
+   def sink_factory(src):
+      eol = "\r\n" if src.kind == SERIAL else "\n"
+      sl = nl.SourceLog(src.name,media,RotationPolicy(args.file_size),"dat",1,[],archiver,eol=eol,codec=args.codec,
+         status=status.source(src.name),metrics=metrics,journal=journal)
+      go.set()
+      if args.pipeline == "off":
+         return sl
+      return StagedSink(sl, args.queue_lines, args.pipeline)
+
+   proc = psutil.Process()
+   peak = [proc.memory_info().rss]
+   sampled = threading.Event()
+
+   def sample_rss():
+      while not sampled.wait(0.2):
+         peak[0] = max(peak[0], proc.memory_info().rss)
+
+   sampler = threading.Thread(target=sample_rss)
+   sampler.start()
+   supervisor.start(ARCHIVE, "archive", nl.th_archive, archiver)
+   supervisor.start(SERVICE, "status", nl.th_status, status)
+   if args.engine == "asyncio":
+      supervisor.start(INGEST, "ingest", nl.th_ingest, IngestEngine([src], sink_factory, supervisor.flag(INGEST)))
+   elif src.kind == SERIAL:
+      supervisor.start(INGEST, src.name, nl.th_log_serial, src, sink_factory, DeviceWatcher())
+   else:
+      supervisor.start(INGEST, src.name, nl.th_log_tcp2, src, sink_factory)
+   if args.transfer:
+      supervisor.start(TRANSFER, "transfer", nl.th_transfer, media, "loadtest", 0, "127.0.0.1", ftp_port, "loadtest", "loadtest",
+         1, 0, 1, 0, transfer_queue, status, metrics)
+   go.wait(30)
+   cpu0 = proc.cpu_times()
+   t0 = time.monotonic()
+   fed = results.get(timeout=args.duration + 60)
+
+   #Let the logger catch up with what is still buffered, then finish uploads
+   seen = -1
+   deadline = time.monotonic() + 10
+   while time.monotonic() < deadline:
+      lines = sum(st.lines for st in status.sources)
+      if lines == seen:
+         break
+      seen = lines
+      time.sleep(1)
+   deadline = time.monotonic() + args.drain
+   while args.transfer and time.monotonic() < deadline and (archiver.depth() or transfer_queue.pending()):
+      time.sleep(0.5)
+   cpu1 = proc.cpu_times()
+   wall = time.monotonic() - t0
+
+   stopping = time.monotonic()
+   left = supervisor.drain(args.shutdown_timeout)
+   stopped = time.monotonic() - stopping
+   if left:
+      print("   still running after the shutdown timeout: " + ", ".join(left))
+   stop.set()
+   sender.join()
+   sampled.set()
+   sampler.join()
+   if slave is not None:
+      os.close(slave)
+   uploaded = 0
+   if ftp is not None:
+      ftp.terminate()
+      ftp.join()
+      for dirpath, dirnames, filenames in os.walk(ftp_root):
+         uploaded = uploaded + len(filenames)
+      shutil.rmtree(ftp_root)
+
+   logged, files = count_logged(flashdrive)
+   if args.keep:
+      print("   output kept in " + tmp)
+   else:
+      shutil.rmtree(tmp)
+   cpu = (cpu1.user - cpu0.user) + (cpu1.system - cpu0.system)
+   sent = fed["sent"]
+   return {
+      "rate": rate,
+      "achieved": sent / fed["seconds"],
+      "overrun": fed["dropped"] * 100.0 / max(fed["offered"], 1),
+      "loss": max(sent - logged, 0) * 100.0 / max(sent, 1),
+      "cpu": cpu * 100.0 / wall,
+      "us": cpu / max(logged, 1) * 1e6,
+      "rss": peak[0] / 1e6,
+      "files": files,
+      "uploaded": uploaded,
+      "upload_rate": transfer_queue.rate / 1000,
+      "shutdown": stopped,
+   }
+
+
+def main():
+   ap = argparse.ArgumentParser(description="NMEA Logger load test")
+   ap.add_argument("--source", choices=("tcp", "serial"), default="tcp", help="feed through a local TCP server or a pty")
+   ap.add_argument("--engine", choices=("threads", "asyncio"), default="threads", help="ingest_engine to use")
+   ap.add_argument("--rates", default=DEFAULT_RATES, help="sentences/s to try, comma separated")
+   ap.add_argument("--duration", type=float, default=10, help="seconds per rate")
+   ap.add_argument("--count", type=int, default=20000, help="distinct sentences, sent in a loop")
+   ap.add_argument("--input", help="recorded log to replay instead of synthetic sentences")
+   ap.add_argument("--codec", default="none", help="codec of the output files")
+   ap.add_argument("--file-size", type=int, default=200000, help="output_file_size")
+   ap.add_argument("--pipeline", choices=("off",) + POLICIES, default="block", help="pipeline_policy, off to write on the reader thread")
+   ap.add_argument("--queue-lines", type=int, default=20000, help="pipeline_queue_lines")
+   ap.add_argument("--stall-ms", type=int, default=0, help="block one output write a second for this long")
+   ap.add_argument("--baud", type=int, default=38400, help="baud rate set on the pty")
+   ap.add_argument("--transfer", action="store_true", help="upload rotated files to a local FTP server")
+   ap.add_argument("--drain", type=float, default=30, help="seconds to wait for uploads after each rate")
+   ap.add_argument("--shutdown-timeout", type=float, default=20, help="shutdown_timeout_sec")
+   ap.add_argument("--max-loss", type=float, default=0.1, help="overrun plus loss in percent still counted as sustained")
+   ap.add_argument("--all", action="store_true", help="keep going after the first rate that is not sustained")
+   ap.add_argument("--keep", action="store_true", help="keep the output files")
+   ap.add_argument("--log", default="nmea_loadtest.log", help="log file of the logger")
+   args = ap.parse_args()
+   rates = [int(r) for r in args.rates.split(",")]
+
+   #Before nmea_logging is imported, which would log to /home/pi/nmea_logger
+   logging.basicConfig(filename=args.log, level=logging.INFO, format='%(asctime)s %(message)s')
+   nl = load_logger()
+   if args.stall_ms > 0:
+      nl.BatchWriter = stalling_writer(nl.BatchWriter, args.stall_ms / 1000.0)
+   if args.input:
+      sentences = load_log(args.input)[:args.count]
+   else:
+      sentences = synthetic_sentences(args.count)
+
+   print("Load test: " + args.source + " source, " + args.engine + " engine, pipeline " + args.pipeline + ", codec " + args.codec +
+      (", " + str(args.stall_ms) + " ms write stalls" if args.stall_ms else "") +
+      (", FTP transfer" if args.transfer else "") + ", " + str(args.duration) + " s per rate")
+   print("   %8s %10s %9s %7s %6s %9s %7s %6s %9s %7s" % ("rate/s", "achieved/s", "overrun%", "loss%", "cpu%", "us/line", "rss MB", "files", "ftp kB/s", "stop s"))
+   best = None
+   for rate in rates:
+      r = run_step(nl, args, sentences, rate)
+      print("   %8d %10.0f %9.2f %7.2f %6.1f %9.2f %7.1f %6d %9s %7.2f" % (r["rate"], r["achieved"], r["overrun"], r["loss"], r["cpu"], r["us"], r["rss"],
+         r["files"], "%.1f" % r["upload_rate"] if args.transfer else "-", r["shutdown"]))
+      sys.stdout.flush()
+      sustained = r["achieved"] >= 0.99 * rate and r["overrun"] + r["loss"] <= args.max_loss
+      if sustained:
+         best = rate
+      elif not args.all:
+         break
+   if best is None:
+      print("No rate sustained")
+   else:
+      print("Max sustained rate: " + str(best) + " sentences/s")
+
+
+if __name__ == "__main__":
+   main()
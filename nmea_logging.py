@@ -11,44 +11,59 @@
 #******************
 
 
-import threading
 import time
 import serial
-import string
 import serial.tools.list_ports
-import glob
 import sys
-import RPi.GPIO as GPIO
 import os
-import psutil
 import logging
-import shutil
-import zipfile
-import math
-import ftplib
-import argparse
-import subprocess
 import socket
-from datetime import datetime
+import signal
 from nmea_clock import check_clock
+from nmea_framer import LineFramer
+from nmea_ingest import IngestEngine, read_sources, SERIAL
+from nmea_filter import SentenceFilter, sentence_address
+from nmea_archiver import Archiver
+from nmea_codec import CompressedWriter, check_codec, CODEC_SUFFIXES
+from nmea_ftp import FtpUploader
+from nmea_schedule import TokenBucket, TransferQueue
+from nmea_geofence import load_ports
+from nmea_position import parse_position, ChecksumError, POSITION_TYPES
+from nmea_ais import AisDecoder, AIS_TYPES
+from nmea_binlog import BinaryWriter, BINARY_SUFFIX
+from nmea_dedup import AisThrottle
+from nmea_index import FileIndex, INDEX_SUFFIX
+from nmea_rotation import read_policy
+from nmea_writer import BatchWriter
+from nmea_timestamp import Timestamper, FORMATS
+from nmea_status import StatusController, SourceStatus, load_gpio
+from nmea_metrics import Registry, start_http, write_snapshot
+from nmea_journal import FileJournal, JOURNAL_NAME, repair
+from nmea_shutdown import INGEST, ARCHIVE, TRANSFER, SERVICE
+from nmea_supervisor import Supervisor, Backoff
+from nmea_devices import DeviceWatcher
+from nmea_storage import StorageManager, find_volumes
+from nmea_pipeline import StagedSink, POLICIES
 from configparser import ConfigParser
-from pathlib import Path
 
 
-time_to_exit = False
 current_location = (0,0)
+#Mount point of the flash drives; the load test points it at a temp dir
+media_root = "/media/pi/"
 transfer_on = False
-#Counts the threads that have been started and need to be closed
-#before the program can be user-terminated. This is primarily necessary to ensure
-#the script is not terminated during an FTP file transfer.
-threads_to_close = 0
+#Threads are started, restarted and stopped through this, see
+#nmea_supervisor.py and nmea_shutdown.py. The program is only terminated
+#once the threads have drained, so it is not stopped in the middle of
+#writing a file or an FTP transfer.
+supervisor = Supervisor()
 
 logging.basicConfig(filename="/home/pi/nmea_logger/nmea_logging.log", level=logging.INFO, format='%(asctime)s %(message)s' )
 logging.info("\n")
 logging.info("*** Program start")
+#RPi.GPIO, or a stand-in when not running on a Pi
+GPIO = load_gpio()
 
 def main():
-   global threads_to_close
    
    #Redirect STDOUT to logging
    stdout_logger = logging.getLogger('STDOUT')
@@ -110,7 +125,6 @@ def main():
    parser.read('/home/pi/nmea_logger/nmea_logging.config')
    
    data_source  = parser.get('General', 'data_source')
-   outfilesiz  = int(parser.get('General', 'output_file_size'))
    outfileext  = parser.get('General', 'output_file_name_extension')
    vessel_name = parser.get('General', 'vessel')
    transfer_enabled = int(parser.get('General', 'ftp_transfer_enabled'))
@@ -119,535 +133,795 @@ def main():
    nmea_sentence_types = parser.get('General', 'nmea_sentence_types')
    nmea_sentence_types = nmea_sentence_types.split(",")
    ftp_server = parser.get('General', 'ftp_server')
+   ftp_port = int(parser.get('General', 'ftp_port', fallback='21'))
    ftp_user = parser.get('General', 'ftp_user')
    ftp_password = parser.get('General', 'ftp_password')
    ftp_wait_sec = int(parser.get('General', 'ftp_wait_sec'))
    ftp_use_ports_file = int(parser.get('General', 'ftp_use_ports_file'))
-   tcp_sourceip = parser.get('tcp', 'tcp_sourceip')
-   tcp_port = int(parser.get('tcp', 'tcp_port'))
+   ftp_connections = int(parser.get('General', 'ftp_connections', fallback='1'))
+   ftp_rate_limit_kbps = int(parser.get('General', 'ftp_rate_limit_kbps', fallback='0'))
+   ftp_order = parser.get('General', 'ftp_order', fallback='oldest')
+   ingest_engine = parser.get('General', 'ingest_engine', fallback='threads')
+   compress_queue_size = int(parser.get('General', 'compress_queue_size', fallback='16'))
+   compress_workers = int(parser.get('General', 'compress_workers', fallback='1'))
+   codec = check_codec(parser.get('General', 'codec', fallback='none'))
+   codec_level = parser.get('General', 'codec_level', fallback='')
+   codec_level = int(codec_level) if codec_level else None
+   codec_flush_sec = int(parser.get('General', 'codec_flush_sec', fallback='60'))
+   ais_decode = int(parser.get('General', 'ais_decode', fallback='0'))
+   ais_dedup = int(parser.get('General', 'ais_dedup', fallback='0'))
+   ais_min_interval = float(parser.get('General', 'ais_min_interval', fallback='0'))
+   index_files = int(parser.get('General', 'index_files', fallback='0'))
+   write_buffer = int(parser.get('General', 'write_buffer_kb', fallback='64')) * 1024
+   write_flush_sec = float(parser.get('General', 'write_flush_sec', fallback='1'))
+   fsync_sec = float(parser.get('General', 'fsync_sec', fallback='0'))
+   timestamp_format = parser.get('General', 'timestamp_format', fallback='utc')
+   if timestamp_format not in FORMATS:
+      logging.info("Unknown timestamp_format " + timestamp_format + ", using utc")
+      timestamp_format = "utc"
+   shutdown_timeout = int(parser.get('General', 'shutdown_timeout_sec', fallback='20'))
+   restart_backoff_max = int(parser.get('General', 'restart_backoff_max_sec', fallback='60'))
+   supervisor.backoff_max = restart_backoff_max
+   output_format = parser.get('General', 'output_format', fallback='text')
+   if output_format not in ("text", "binary", "both"):
+      logging.info("Unknown output_format " + output_format + ", writing text")
+      output_format = "text"
+   metrics_port = int(parser.get('General', 'metrics_port', fallback='0'))
+   metrics_bind = parser.get('General', 'metrics_bind', fallback='127.0.0.1')
+   metrics_json_sec = int(parser.get('General', 'metrics_json_sec', fallback='60'))
+   storage_spill = int(parser.get('General', 'storage_spill', fallback='0'))
+   storage_low_free_pct = float(parser.get('General', 'storage_low_free_pct', fallback='10'))
+   storage_high_free_pct = float(parser.get('General', 'storage_high_free_pct', fallback='15'))
+   retention_days = float(parser.get('General', 'retention_days', fallback='0'))
+   storage_check_sec = int(parser.get('General', 'storage_check_sec', fallback='30'))
+   pipeline_queue_lines = int(parser.get('General', 'pipeline_queue_lines', fallback='20000'))
+   pipeline_policy = parser.get('General', 'pipeline_policy', fallback='block')
    
-   #Before starting processing move any stray data
-   #files that may be left in the media dir to the media/complete dir and zip
-   #them there. Stray files may be produced when the program crashes or shutdown
-   #did not complete orderly. Cannot cleanup these files when the logging is running
-   #since the current, open dat files that are being logged to would also be moved.
-   flashdrive = "/media/pi/" + cmedia + "/"
-   
-   try:
-      for root, dirs, files in os.walk(flashdrive):
-         for filename in files:
-            if filename.endswith("." + outfileext):
-               filename_woext = filename.replace("." + outfileext, "")
-               shutil.copyfile(flashdrive + filename, flashdrive + "complete/" + filename)
-               #if copy was successful and copied file exists, delete it
-               if os.path.isfile(flashdrive + "complete/" + filename):
-                  if os.path.isfile(flashdrive + filename):
-                     os.remove(flashdrive + filename)
-                  #zip copied file
-                  zipObj = zipfile.ZipFile(flashdrive + "complete/" + filename_woext + "." + "zip", 'w')
-                  zipObj.write(flashdrive + "complete/" + filename, compress_type=zipfile.ZIP_DEFLATED, arcname=filename)
-                  zipObj.close()
-                  #delete file if zip was succcessful
-               if os.path.isfile(flashdrive + "complete/" + filename):
-                  os.remove(flashdrive + "complete/" + filename)
-   except:
-       pass
-
-   if data_source == "com":
-      ports = ['ttyUSB0','ttyUSB1','ttyUSB2']
-      for po in ports:
-         name      = parser.get(po, 'name')
-         port      = parser.get(po, 'port')
-         baud_rate = int(parser.get(po, 'baud_rate'))
-         data_bits = int(parser.get(po, 'data_bits'))
-         parity    = parser.get(po, 'parity')
-         stop_bits = int(parser.get(po, 'stop_bits'))
-         timeout   = int(parser.get(po, 'timeout'))
-         if po == 'ttyUSB0':
-            led = 20
-         if po == 'ttyUSB1':
-            led = 20
-         if po == 'ttyUSB2':
-            led = 20
-
-         #check that USB port exists
-         pd = [] 
-         pd = os.listdir("/dev")
-         if po in pd:
-            thc = threading.Thread(target=th_log_serial,args=(name,port,baud_rate,data_bits,parity,stop_bits,timeout,led,outfilesiz,outfileext,cmedia,save_all_nmea,nmea_sentence_types))
-            thc.start()
-            threads_to_close = threads_to_close + 1
-
-   if data_source == "tcp":
-      name = "tcp"
-      led = 20
-      tht = threading.Thread(target=th_log_tcp2,args=(name,tcp_sourceip,tcp_port,led,outfilesiz,outfileext,cmedia,save_all_nmea,nmea_sentence_types))
-      tht.start()
-      threads_to_close = threads_to_close + 1
-
-   #Monitoring thread
-   the = threading.Thread(target=th_mon,args=(cmedia,))
-   the.start()
-   threads_to_close = threads_to_close + 1
+   #Finished files are compressed in the background so rollover never blocks ingest
+   flashdrive = media_root + cmedia + "/"
+   #Files waiting for upload; archives are added as they become ready
+   transfer_queue = TransferQueue(flashdrive + "complete", ftp_order)
+   on_ready = transfer_queue.add if transfer_enabled == 1 else None
+   archiver = Archiver(flashdrive + "complete", outfileext, compress_queue_size, compress_workers, on_ready)
+
+   #Free space of all flash drives; new files spill over to the next drive
+   #when one fills up, see nmea_storage.py
+   storage = StorageManager(media_root, cmedia, storage_spill == 1, storage_low_free_pct, storage_high_free_pct, retention_days, storage_check_sec)
+   for v in storage.volumes[1:]:
+      archiver.add_dir(v.complete)
+      transfer_queue.add_dir(v.complete)
+
+   def volume_added(v):
+      archiver.add_dir(v.complete)
+      transfer_queue.add_dir(v.complete)
+   storage.on_added = volume_added
+
+   #Files that were still open when the logger stopped, from the journal of
+   #open files (see nmea_journal.py). Only the journal is read here; the files
+   #are repaired by the recovery thread while ingest is already running.
+   journal = FileJournal(flashdrive + JOURNAL_NAME)
+   strays = journal.recover()
+   #Files on other volumes are journaled by full path
+   open_names = set(os.path.join(flashdrive, of.filename) for of in strays)
+
+   #Before starting processing move any other stray data files that may be
+   #left in the media dir to the media/complete dir, such as files older than
+   #the journal. Cannot cleanup these files when the logging is running since
+   #the current, open dat files that are being logged to would also be moved.
+   #The move is a rename on the same filesystem; the archiver then zips every
+   #uncompressed file in complete/ in the background.
+   stray_suffixes = tuple("." + outfileext + sfx for sfx in CODEC_SUFFIXES.values()) + (BINARY_SUFFIX, INDEX_SUFFIX)
+   for v in storage.volumes:
+      for filename in os.listdir(v.path):
+         if filename.endswith(stray_suffixes) and v.path + filename not in open_names and os.path.isfile(v.path + filename):
+            try:
+               os.replace(v.path + filename, v.path + "complete/" + filename)
+            except OSError as e:
+               logging.info("Could not move stray file " + filename + ": " + str(e))
+   archiver.recover()
+   for w in range(compress_workers):
+      supervisor.supervise(ARCHIVE, "archive-" + str(w + 1), th_archive, archiver)
+   if strays:
+      supervisor.start(ARCHIVE, "recover", th_recover, journal, strays, flashdrive, archiver, outfileext)
+
+   #Status LEDs are driven by their own thread from counters the sources update
+   status = StatusController(GPIO)
+
+   #Input sources come from the config sections, see nmea_ingest.read_sources.
+   #Serial ports that are not plugged in yet are waited for, see nmea_devices.py
+   sources = read_sources(parser, data_source)
+   for src in sources:
+      if not src.available():
+         logging.info("Device " + src.settings["port"] + " of " + src.name + " not present yet")
+
+   #One AIS dedup/throttle stage for all sources, so copies of a message heard
+   #by several receivers are logged once
+   throttle = AisThrottle(ais_min_interval) if ais_dedup == 1 else None
+
+   #Metrics read the counters the components already keep when collected
+   metrics = Registry()
+   metrics.counter("nmea_sentences_total", "Sentences received", ("source",), fn=lambda: dict(((st.name,), st.lines) for st in status.sources))
+   metrics.counter("nmea_errors_total", "Read errors and reconnects", ("source",), fn=lambda: dict(((st.name,), st.errors) for st in status.sources))
+   metrics.counter("nmea_ais_decoded_total", "AIS messages decoded", ("source",), fn=lambda: dict(((st.name,), st.ais_decoded) for st in status.sources))
+   metrics.gauge("nmea_archive_queue_depth", "Files waiting for compression", fn=lambda: archiver.queue.qsize())
+   metrics.counter("nmea_archived_files_total", "Files compressed", fn=lambda: archiver.done)
+   metrics.counter("nmea_archive_failures_total", "Files that could not be compressed", fn=lambda: archiver.failed)
+   metrics.gauge("nmea_archive_max_latency_seconds", "Longest time from rollover to archive ready", fn=lambda: archiver.max_latency)
+   metrics.gauge("nmea_transfer_backlog_bytes", "Bytes waiting for upload", fn=transfer_queue.backlog_bytes)
+   metrics.gauge("nmea_transfer_backlog_files", "Files waiting for upload", fn=lambda: len(transfer_queue.entries))
+   metrics.gauge("nmea_transfer_rate_bytes", "Smoothed upload rate in bytes/s", fn=lambda: transfer_queue.rate)
+   metrics.gauge("nmea_transfer_active", "1 while an upload is running", fn=lambda: int(status.transferring))
+   metrics.gauge("nmea_disk_full", "1 when no flash drive has free space left", fn=lambda: int(status.disk_full))
+   metrics.gauge("nmea_volume_free_bytes", "Free space per flash drive, as last read", ("volume",), fn=lambda: dict(((v.name,), v.free) for v in storage.volumes))
+   metrics.gauge("nmea_volume_active", "1 for the flash drive new files go to", ("volume",), fn=lambda: dict(((v.name,), int(v is storage.active)) for v in storage.volumes))
+   metrics.counter("nmea_evicted_files_total", "Transferred files removed for space or retention", fn=lambda: storage.evicted_files)
+   metrics.counter("nmea_evicted_bytes_total", "Bytes of transferred files removed", fn=lambda: storage.evicted_bytes)
+   metrics.gauge("nmea_worker_up", "1 while the worker runs, 0 while it waits to restart", ("worker",), fn=lambda: dict(((w.name,), int(w.up)) for w in supervisor.workers))
+   metrics.gauge("nmea_worker_uptime_seconds", "Seconds since the worker last (re)started", ("worker",), fn=lambda: dict(((w.name,), w.uptime()) for w in supervisor.workers))
+   metrics.counter("nmea_worker_restarts_total", "Worker restarts after a failure", ("worker",), fn=lambda: dict(((w.name,), w.restarts) for w in supervisor.workers))
+   #Reader and write stage of each source, see nmea_pipeline.py
+   staged = {}
+   def stage_stats(attr):
+      out = {}
+      for ss in list(staged.values()):
+         for stage, st in (("read", ss.read), ("write", ss.stage.stats)):
+            out[(ss.name, stage)] = getattr(st, attr)
+      return out
+   metrics.gauge("nmea_pipeline_queue_depth", "Sentences waiting for the write stage", ("source",), fn=lambda: dict(((ss.name,), ss.ring.items) for ss in list(staged.values())))
+   metrics.counter("nmea_pipeline_dropped_total", "Sentences dropped because the queue was full", ("source",), fn=lambda: dict(((st.name,), st.dropped) for st in status.sources))
+   metrics.counter("nmea_stage_busy_seconds_total", "Time spent in each stage", ("source", "stage"), fn=lambda: stage_stats("busy"))
+   metrics.counter("nmea_stage_batches_total", "Batches handled by each stage", ("source", "stage"), fn=lambda: stage_stats("batches"))
+   metrics.counter("nmea_stage_sentences_total", "Sentences handled by each stage", ("source", "stage"), fn=lambda: stage_stats("items"))
+   metrics.gauge("nmea_stage_max_wait_seconds", "Longest wait of a batch: for the write stage in the queue, for the reader for room", ("source", "stage"), fn=lambda: stage_stats("max_wait"))
+   if throttle is not None:
+      metrics.counter("nmea_ais_dropped_total", "AIS sentences dropped by the dedup stage", ("reason",),
+         fn=lambda: dict((((k,), v) for k, v in throttle.stats().items() if k in ("duplicates", "throttled"))))
+
+   def sink_factory(src):
+      #Output of one source. Serial files keep the CRLF terminator of the
+      #received sentences.
+      eol = "\r\n" if src.kind == SERIAL else "\n"
+      rotation = read_policy(parser, src.section)
+      logging.info("Rotating " + src.name + " files at " + str(rotation.max_bytes) + " bytes, " + str(rotation.max_age) + " s, aligned to " + rotation.align)
+      sl = SourceLog(src.name,cmedia,rotation,outfileext,save_all_nmea,nmea_sentence_types,archiver,eol=eol,codec=codec,codec_level=codec_level,codec_flush_sec=codec_flush_sec,ais_decode=ais_decode,
+         output_format=output_format,source_id=sources.index(src),throttle=throttle,index_files=index_files,
+         write_buffer=write_buffer,write_flush_sec=write_flush_sec,fsync_sec=fsync_sec,
+         timestamp_format=timestamp_format,status=status.source(src.name),metrics=metrics,journal=journal,storage=storage)
+      if pipeline_queue_lines <= 0:
+         return sl
+      #Filtering, parsing and writing on a stage thread behind a bounded
+      #queue, so the reader keeps reading while the flash drive stalls
+      policy = parser.get(src.section, 'pipeline_policy', fallback=pipeline_policy) if src.section else pipeline_policy
+      if policy not in POLICIES:
+         logging.info("Unknown pipeline_policy " + policy + " for " + src.name + ", using block")
+         policy = "block"
+      ss = StagedSink(sl, pipeline_queue_lines, policy)
+      staged[src.name] = ss
+      return ss
+
+   if ingest_engine == "asyncio":
+      #All sources in one event loop
+      engine = IngestEngine(sources, sink_factory, supervisor.flag(INGEST), reconnect_max_sec=restart_backoff_max)
+      supervisor.supervise(INGEST, "ingest", th_ingest, engine)
+   else:
+      #One thread per source; the device watcher wakes serial threads waiting
+      #for their adapter
+      devices = DeviceWatcher()
+      supervisor.supervise(SERVICE, "devices", th_devices, devices)
+      for src in sources:
+         if src.kind == SERIAL:
+            supervisor.supervise(INGEST, src.name, th_log_serial, src, sink_factory, devices)
+         else:
+            supervisor.supervise(INGEST, src.name, th_log_tcp2, src, sink_factory, restart_backoff_max)
+
+   #Status LED thread
+   supervisor.supervise(SERVICE, "status", th_status, status)
+
+   #Free space, spill-over and retention of the flash drives
+   supervisor.supervise(SERVICE, "monitor", th_storage, storage, status, storage_check_sec)
    
-   #Thread for stop detection
-   ths = threading.Thread(target=th_stop,args=())
-   ths.start()
-   threads_to_close = threads_to_close + 1
+   #Metrics endpoint and metrics.json on the media
+   server = start_http(metrics, metrics_port, metrics_bind) if metrics_port > 0 else None
+   supervisor.supervise(SERVICE, "metrics", th_metrics, metrics, flashdrive + "metrics.json", metrics_json_sec, server)
 
    #Thread for transferring data
    if transfer_enabled == 1:
-      tht = threading.Thread(target=th_transfer,args=(cmedia,vessel_name,delete_after_transfer,ftp_server,ftp_user,ftp_password,ftp_wait_sec,ftp_use_ports_file))
-      tht.start()
-      threads_to_close = threads_to_close + 1
+      supervisor.supervise(TRANSFER, "transfer", th_transfer, cmedia,vessel_name,delete_after_transfer,ftp_server,ftp_port,ftp_user,ftp_password,ftp_wait_sec,ftp_use_ports_file,ftp_connections,ftp_rate_limit_kbps,transfer_queue,status,metrics)
+
+   #Stop detection runs on the main thread, which also receives SIGTERM
+   #(systemctl stop, UPS signalling power loss); both stop the logger the same way
+   signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.request("SIGTERM"))
+   th_stop(shutdown_timeout)
 
    logging.info("End")
 
 #Includes reconnect after fail  
-def th_log_tcp2(name,tcp_sourceip,tcp_port,led,outfilesize,outfileext,media,save_all_nmea,nmea_sentence_types):
-   global current_location
-   global threads_to_close
-
-   time.sleep(3)
-   TEN_MINUTES = 10 * 60 * 1000
+def th_log_tcp2(src,sink_factory,backoff_max=60):
+   if supervisor.wait(3, INGEST):
+      return
+   name = src.name
+   tcp_sourceip = src.settings["host"]
+   tcp_port = src.settings["port"]
 
    logging.info("Thread runing to log from TCP")
-   logging.info("Using media " + media)
-
-   while media == "":
-      time.sleep(2)
-   #Use first listed entry
-   flashdrive = "/media/pi/" + media + "/"
-
-   timestr = time.strftime("%Y%m%d-%H%M%S")
-   outfile = open(flashdrive + timestr + "-" + name + "." + outfileext, "a+", 1)
-
-   clientSocket = socket.socket()
 
-   clientSocket.connect((tcp_sourceip, tcp_port))
-    # keep track of connection status  
-   connected = True  
-   logging.info("TCP: connected with " + tcp_sourceip + " " + str(tcp_port))
+   slog = sink_factory(src)
+   #Reconnects wait 2, 4, 8 ... up to backoff_max seconds, with jitter, and
+   #start from 2 s again after a successful connect
+   backoff = Backoff(2, backoff_max)
 
-   bytectr = 0
-   last_pos_time = 0
-   last_radar_time = 0
-   ser_err_amt = 0
-   capt_pos = 0 
-
-   tr = b""
-   while True:
-      try:
-         rec = clientSocket.recv(2048)
-         #This send is crucial. Without it some NMEA TCP sockets will fail, eventually
-         clientSocket.send( bytes("csiro_nmea_logger", "UTF-8"))  
-         tr = tr + rec
-         if len(rec) < 2048:
-            cf = tr.decode('utf8', 'ignore')
-            re = cf.split("\r\n")
-            for outdec in re:
-               if len(outdec) > 0:
-                  dtstmp = datetime.utcnow().strftime("%Y%m%d-%H%M%S.%f")[:-3] + " UTC,"
-                  if save_all_nmea == 1:
-                     bytectr = bytectr + len(dtstmp) + len(outdec)
-                     outfile.write(dtstmp + outdec + "\n")
-                  else:
-                     sen_in = any(nst in outdec for nst in nmea_sentence_types)
-                     if sen_in:
-                        bytectr = bytectr + len(dtstmp) + len(outdec)
-                        outfile.write(dtstmp + outdec + "\n")
-            tr = b""
-            time.sleep(5)
-
-         #Blink green if pos and radar sentences have been received in the last 10 minutes, blink blue if not
-         if "GGA" in outdec:
-            #Capture position for determing if ftp file transfer can take place. Only every 100ths record.
-            if capt_pos == 100:
-               last_pos_time = int(round(time.time() * 1000))
-               capt_pos = 0
+   #Reusable receive buffer; the framer keeps any partial sentence between reads
+   rbuf = bytearray(4096)
+   rview = memoryview(rbuf)
+   framer = LineFramer()
+   clientSocket = None
+   try:
+      while not supervisor.stopping(INGEST):
+         if clientSocket is None:
+            clientSocket = socket.socket()
+            #Wake up once a second without data so a quiet source still rotates
+            #its file; also bounds the connect
+            clientSocket.settimeout(1)
             try:
-               lpt = outdec.split("GGA,")[1]
-               lpt_lat = float(lpt.split(",")[1])/100
-               if lpt.split(",")[2] == 'S':
-                  lpt_lat = lpt_lat * -1
-               tup1 = (math.modf(lpt_lat)[1], math.modf(lpt_lat)[0] * 100, 0)
-               lpt_lat = dms2dd(tup1)
-               lpt_lon = float(lpt.split(",")[3])/100
-               if lpt.split(",")[4] == 'W':
-                  lpt_lon = lpt_lon * -1
-               tup1 = (math.modf(lpt_lon)[1], math.modf(lpt_lon)[0] * 100, 0)
-               lpt_lon = dms2dd(tup1)
-               current_location = (lpt_lat, lpt_lon)
-            except:
-               current_location = (0,0)
-               capt_pos = 0
-            capt_pos = capt_pos + 1
-         
-         if "TTM" in outdec:
-            last_radar_time = int(round(time.time() * 1000))
-
-         tenMinAgo = int(round(time.time() * 1000)) - TEN_MINUTES
-
-         if last_pos_time > tenMinAgo and last_radar_time > tenMinAgo:
-            GPIO.output(26,GPIO.HIGH)
-            time.sleep(0.001)
-            GPIO.output(26,GPIO.LOW)
-         else:
-            GPIO.output(20,GPIO.HIGH)
-            time.sleep(0.001)
-            GPIO.output(20,GPIO.LOW)
-
-         if bytectr > outfilesize:
-            if not os.path.exists(flashdrive + "complete"):
-               os.mkdir(flashdrive + "complete")
-            outfile.close()
-            logging.info("Done writing to file " + flashdrive + timestr + "-" + name + "." + outfileext)
-            #copy file to complete dir
-            shutil.copyfile(flashdrive + timestr + "-" + name + "." + outfileext, flashdrive + "complete/" + timestr + "-" + name + "." + outfileext)
-            #if copy was successful and copied file exists, delete it
-            if os.path.isfile(flashdrive + "complete/" + timestr + "-" + name + "." + outfileext):
-               if os.path.isfile(flashdrive + timestr + "-" + name + "." + outfileext):
-                  os.remove(flashdrive + timestr + "-" + name + "." + outfileext)
-               #zip copied file
-               zipObj = zipfile.ZipFile(flashdrive + "complete/" + timestr + "-" + name + "." + "zip", 'w')
-               an = timestr + "-" + name + "." + outfileext
-               zipObj.write(flashdrive + "complete/" + timestr + "-" + name + "." + outfileext, compress_type=zipfile.ZIP_DEFLATED, arcname=an)
-               zipObj.close()
-               logging.info("File zipped")
-               #delete file if zip was succcessful
-            if os.path.isfile(flashdrive + "complete/" + timestr + "-" + name + "." + "zip"):
-               os.remove(flashdrive + "complete/" + timestr + "-" + name + "." + outfileext)
-            timestr = time.strftime("%Y%m%d-%H%M%S")
-            outfile = open(flashdrive + timestr + "-" + name + "." + outfileext, "a+", 1)
-            bytectr = 0
-
-         if time_to_exit:
-            logging.info(str(ser_err_amt) + " serial errors from port " + port)
-            logging.info("Exit from " + port)
-            threads_to_close = threads_to_close - 1
-            return
-
-      except (socket.error, socket.timeout):
-         connected = False  
-         clientSocket = socket.socket()  
-         logging.info("TCP: connection lost. Attempting to reconnect")
-         while not connected:  
-            try:  
                clientSocket.connect((tcp_sourceip, tcp_port))
-               connected = True  
-               logging.info("TCP: Reconnection successful")
-            except socket.error:  
-               time.sleep( 2 )  
-   clientSocket.close();
-
-def th_log_serial(name,port,baud_rate,data_bits,parity,stop_bits,timeout,led,outfilesize,outfileext,media,save_all_nmea,nmea_sentence_types):
-   global current_location
-   global threads_to_close
+            except OSError as e:
+               clientSocket.close()
+               clientSocket = None
+               slog.poll()
+               delay = backoff.next()
+               logging.info("TCP: cannot connect to " + tcp_sourceip + " " + str(tcp_port) + ": " + str(e) + ", retrying in " + str(round(delay, 1)) + " s")
+               supervisor.wait(delay, INGEST)
+               continue
+            backoff.reset()
+            logging.info("TCP: connected with " + tcp_sourceip + " " + str(tcp_port))
 
-   time.sleep(3)
-   TEN_MINUTES = 10 * 60 * 1000
+         try:
+            nrec = clientSocket.recv_into(rbuf)
+            if nrec == 0:
+               raise socket.error("connection closed by peer")
+            #Fed first, so a send that times out or fails loses nothing received
+            slog.feed(framer.feed(rview[:nrec]))
+            #This send is crucial. Without it some NMEA TCP sockets will fail, eventually
+            clientSocket.send( bytes("csiro_nmea_logger", "UTF-8"))  
+
+         except socket.timeout:
+            slog.poll()
+
+         except socket.error:
+            clientSocket.close()
+            clientSocket = None
+            #A partial sentence cannot be completed by the new connection
+            framer.reset()
+            slog.error()
+            logging.info("TCP: connection lost. Attempting to reconnect")
+
+   finally:
+      #Writes what is buffered and rotates the file into complete/, also
+      #when the thread fails and is restarted by the supervisor
+      slog.close()
+      logging.info(str(framer.dropped) + " unframed bytes dropped from " + name)
+      logging.info("Exit from " + name)
+      if clientSocket is not None:
+         clientSocket.close()
+
+#A failed or unplugged adapter ends the thread; the supervisor starts it
+#again, and it waits here until the device is back
+def th_log_serial(src,sink_factory,devices):
+   if supervisor.wait(3, INGEST):
+      return
+   s = src.settings
+   port = s["port"]
+   if not devices.wait_for(port, supervisor.flag(INGEST)):
+      return
    
-   with serial.Serial(port=port,baudrate=baud_rate,bytesize=data_bits,parity=parity,stopbits=stop_bits,timeout=timeout) as ser:
+   #A read returns after at most a second without data, so the thread sees a
+   #shutdown and a quiet source still rotates its file, whatever the
+   #configured timeout
+   with serial.Serial(port=port,baudrate=s["baud_rate"],bytesize=s["data_bits"],parity=s["parity"],stopbits=s["stop_bits"],timeout=min(s["timeout"], 1)) as ser:
       logging.info("Thread runing to log from " + port)
-      logging.info("Using media " + media)
-
-      while media == "":
-         time.sleep(2)
-      #Use first listed entry
-      flashdrive = "/media/pi/" + media + "/"
 
+      slog = sink_factory(src)
+      try:
+         ser.flushInput()
+         #Whatever is waiting is read at once and split into sentences, instead
+         #of one readline() per sentence
+         framer = LineFramer()
+         
+         while not supervisor.stopping(INGEST):
+            try:
+               output = ser.read(ser.in_waiting or 1)
+            except serial.SerialException:
+               slog.error()
+               if not os.path.exists(port):
+                  raise
+               output = b""
+               supervisor.wait(1, INGEST)
+            if output:
+               slog.feed(framer.feed(output))
+            else:
+               slog.poll()
+
+      finally:
+         #Writes what is buffered and rotates the file into complete/
+         slog.close()
+         logging.info(str(slog.err_amt) + " serial errors from port " + port)
+         logging.info("Exit from " + port)
+
+def th_ingest(engine):
+   #Runs the asyncio ingest engine; all sources share this one thread
+   if supervisor.wait(3, INGEST):
+      return
+   logging.info("Ingest engine running " + str(len(engine.sources)) + " sources")
+   engine.run()
+
+def th_archive(archiver):
+   #Compression worker; drains the queue before exiting
+   logging.info("Compression worker started")
+   archiver.run(supervisor.flag(ARCHIVE))
+   logging.info("Compression worker stopped " + str(archiver.stats()))
+
+class SourceLog(object):
+   #Output files and per-sentence handling of one data source: filtering,
+   #timestamping, position tracking, status counters and file rollover.
+   #output_format text writes the .dat file, binary a columnar .nmb file
+   #(see nmea_binlog.py), both writes the two side by side.
+   #Shared by the logger threads and the asyncio ingest engine.
+
+   def __init__(self,name,media,rotation,outfileext,save_all_nmea,nmea_sentence_types,archiver,eol="\n",codec="none",codec_level=None,codec_flush_sec=60,ais_decode=0,output_format="text",source_id=0,throttle=None,index_files=0,write_buffer=65536,write_flush_sec=1.0,fsync_sec=0,timestamp_format="utc",status=None,metrics=None,journal=None,storage=None):
+      self.name = name
+      self.home = media_root + media + "/"
+      #Changes at a rotation when the storage manager spills over to another
+      #flash drive, see nmea_storage.py
+      self.flashdrive = self.home
+      self.storage = storage
+      #nmea_rotation.RotationPolicy of this source
+      self.rotation = rotation
+      self.outfileext = outfileext
+      self.save_all_nmea = save_all_nmea
+      self.sentence_filter = SentenceFilter(nmea_sentence_types)
+      self.eol = eol
+      self.archiver = archiver
+      self.codec = codec
+      self.codec_level = codec_level
+      self.codec_flush_sec = codec_flush_sec
+      self.output_format = output_format
+      self.source_id = source_id
+      #Optional on-device AIS decoding, counted per file and source
+      self.ais = AisDecoder() if ais_decode == 1 else None
+      #Optional nmea_dedup.AisThrottle shared with the other sources
+      self.throttle = throttle
+      #Index sidecar per rotated file, see nmea_index.py
+      self.index_files = index_files
+      #Output batching, see nmea_writer.py
+      self.write_buffer = write_buffer
+      self.write_flush_sec = write_flush_sec
+      self.fsync_sec = fsync_sec
+      self.clock = Timestamper(timestamp_format)
+      #Records the open files for recovery after a crash, see nmea_journal.py
+      self.journal = journal
+      #Time taken by each rollover, see nmea_metrics.py
+      self.rollover_time = None
+      if metrics is not None:
+         self.rollover_time = metrics.histogram("nmea_rollover_seconds", "Time to rotate a file", ("source",))
+      self.timestr = ""
+      self.seq = 0
+      self.bytectr = 0
+      #Read by the status LED controller
+      self.status = status if status is not None else SourceStatus(name)
+      self.err_amt = 0
+      self.open()
+
+   def filename(self):
+      return self.timestr + "-" + self.name + "." + self.outfileext + CODEC_SUFFIXES[self.codec]
+
+   def binname(self):
+      return self.timestr + "-" + self.name + BINARY_SUFFIX
+
+   def idxname(self):
+      return self.timestr + "-" + self.name + INDEX_SUFFIX
+
+   def jname(self, fn):
+      #Name in the journal of open files: full path off the first flash drive
+      return fn if self.flashdrive == self.home else self.flashdrive + fn
+
+   def open(self):
+      if self.storage is not None:
+         self.flashdrive = self.storage.select()
       timestr = time.strftime("%Y%m%d-%H%M%S")
-      outfile = open(flashdrive + timestr + "-" + name + "." + outfileext, "a+", 1)
-      ser.flushInput()
-      
-      bytectr = 0
-      last_pos_time = 0
-      last_radar_time = 0
-      ser_err_amt = 0
-      capt_pos = 0 
-      
-      while True:
+      #A busy source can roll over more than once per second; keep names unique
+      if timestr == self.timestr.split("_")[0]:
+         self.seq = self.seq + 1
+         timestr = timestr + "_" + str(self.seq)
+      else:
+         self.seq = 0
+      self.timestr = timestr
+      self.outfile = None
+      self.binfile = None
+      if self.output_format != "binary":
+         if self.codec == "none":
+            self.outfile = BatchWriter(self.flashdrive + self.filename(), self.write_buffer, self.write_flush_sec, self.fsync_sec)
+         else:
+            #Compressed as data arrives, no zipping after rollover
+            self.outfile = CompressedWriter(self.flashdrive + self.filename(), self.codec, self.codec_level, self.codec_flush_sec,
+               self.write_buffer, self.write_flush_sec, self.fsync_sec)
+      if self.output_format != "text":
+         #Blocks are deflated as they are written, no zipping after rollover
+         self.binfile = BinaryWriter(self.flashdrive + self.binname(), self.source_id, self.name, flush_sec=self.codec_flush_sec,
+            buffer_bytes=self.write_buffer, write_flush_sec=self.write_flush_sec, fsync_sec=self.fsync_sec)
+      self.index = None
+      if self.index_files == 1:
+         index = FileIndex(self.name)
+         if self.outfile is not None:
+            index.stream(self.filename())
+            if self.codec != "none":
+               self.outfile.on_block = lambda start, end, fn=self.filename(): index.block(fn, start, end)
+         if self.binfile is not None:
+            index.stream(self.binname())
+            self.binfile.on_block = lambda start, end, fn=self.binname(): index.block(fn, start, end)
+         self.index = index
+         #Plain text is cut into blocks of codec_flush_sec by poll()
+         self.text_start = 0
+         self.last_cut = time.monotonic()
+      self.bytectr = 0
+      now = time.time()
+      self.rotation.opened(now)
+      if self.journal is not None:
+         if self.outfile is not None:
+            self.journal.opened(self.jname(self.filename()), self.name, now, self.rotation.deadline)
+            if self.codec == "none":
+               #Plain text can be cut back to the size at the last fsync
+               self.outfile.on_sync = lambda offset, fn=self.jname(self.filename()): self.journal.synced(fn, offset)
+         if self.binfile is not None:
+            self.journal.opened(self.jname(self.binname()), self.name, now, self.rotation.deadline)
+      #AIS messages decoded and vessels seen in this file
+      self.ais_count = 0
+      self.ais_vessels = set()
+
+   def close(self):
+      #Writes and syncs everything still buffered and rotates the files into
+      #complete/ without opening new ones, so they are archived during the
+      #shutdown drain
+      if self.outfile is None and self.binfile is None:
+         return
+      self.rollover(reopen=False)
+      self.outfile = None
+      self.binfile = None
+
+   def cut_text(self):
+      #End the current block of the plain text file
+      pos = self.outfile.tell()
+      self.index.block(self.filename(), self.text_start, pos)
+      self.text_start = pos
+      self.last_cut = time.monotonic()
+
+   def error(self):
+      self.err_amt = self.err_amt + 1
+      self.status.errors = self.status.errors + 1
+      if self.err_amt % 100 == 0:
+         logging.info("100 errors from " + self.name)
+
+   def feed(self, lines):
+      #Handle the sentences (bytes) of one read. All of them are stamped with
+      #the time of that read.
+      self.handle(self.clock.stamp(), lines)
+
+   def handle(self, stamp, lines):
+      #stamp is (epoch ms, line prefix) from self.clock; called by the write
+      #stage of nmea_pipeline.StagedSink with the stamp taken by the reader
+      stamp_ms, dtstmp = stamp
+      n = 0
+      for line in lines:
+         try:
+            outdec = line.rstrip(b"\r\n").decode("utf-8")
+         except UnicodeDecodeError:
+            self.error()
+            continue
+         if outdec:
+            self.write(outdec, dtstmp, stamp_ms)
+            n = n + 1
+      self.status.lines = self.status.lines + n
+      self.poll()
+
+   def write(self, outdec, dtstmp, stamp_ms=0):
+      global current_location
+      #The address field ("GPGGA", "AIVDM") is read once and used for
+      #filtering and for the position/radar checks
+      addr = sentence_address(outdec) or ""
+      if self.throttle is not None and addr.endswith(AIS_TYPES) and not self.throttle.accept(outdec, stamp_ms / 1000.0, self.name):
+         return
+      if self.save_all_nmea == 1 or (addr and self.sentence_filter.accepts_address(addr)):
+         if self.index is not None:
+            self.index.add(stamp_ms, addr, outdec)
+         if self.outfile is not None:
+            #Bytes, not characters; NMEA is almost always ASCII
+            n = len(outdec) if outdec.isascii() else len(outdec.encode("utf-8"))
+            self.bytectr = self.bytectr + len(dtstmp) + n + len(self.eol)
+            self.outfile.write(dtstmp + outdec + self.eol)
+         if self.binfile is not None:
+            n = self.binfile.append(stamp_ms, addr, outdec)
+            if self.outfile is None:
+               self.bytectr = self.bytectr + n
+
+      if addr.endswith(POSITION_TYPES):
+         #Position for determing if ftp file transfer can take place.
+         #Corrupted sentences are ignored, no fix means no known position.
          try:
-            output = ser.readline()
-            outdec = output.decode("utf-8")
-            dtstmp = datetime.utcnow().strftime("%Y%m%d-%H%M%S.%f")[:-3] + " UTC,"
-            if save_all_nmea == 1:
-               bytectr = bytectr + len(dtstmp) + len(outdec)
-               outfile.write(dtstmp + outdec)
+            pos = parse_position(outdec)
+            if pos is not None:
+               current_location = pos
+               self.status.last_position = stamp_ms
             else:
-               sen_in = any(nst in outdec for nst in nmea_sentence_types)
-               if sen_in:
-                  bytectr = bytectr + len(dtstmp) + len(outdec)
-                  outfile.write(dtstmp + outdec)
-         except:
-            outdec = ""
-            ser_err_amt = ser_err_amt + 1
-            if ser_err_amt % 100 == 0:
-               logging.info("100 serial errors from port " + port)
-         
-         #Blink green if pos and radar sentences have been received in the last 10 minutes,
-         #blink blue if not
-         if "GGA" in outdec:
-            #Capture position for determing if ftp file transfer can take place
-            #only every 100ths record.
-            if capt_pos == 100:
-               last_pos_time = int(round(time.time() * 1000))
-               capt_pos = 0
-            try:
-               lpt = outdec.split("GGA,")[1]
-               lpt_lat = float(lpt.split(",")[1])/100
-               if lpt.split(",")[2] == 'S':
-                  lpt_lat = lpt_lat * -1
-               tup1 = (math.modf(lpt_lat)[1], math.modf(lpt_lat)[0] * 100, 0)
-               lpt_lat = dms2dd(tup1)
-               lpt_lon = float(lpt.split(",")[3])/100
-               if lpt.split(",")[4] == 'W':
-                  lpt_lon = lpt_lon * -1
-               tup1 = (math.modf(lpt_lon)[1], math.modf(lpt_lon)[0] * 100, 0)
-               lpt_lon = dms2dd(tup1)
-               current_location = (lpt_lat, lpt_lon)
-            except:
                current_location = (0,0)
-               capt_pos = 0
-            capt_pos = capt_pos + 1
-         
-         if "TTM" in outdec:
-            last_radar_time = int(round(time.time() * 1000))
-
-         tenMinAgo = int(round(time.time() * 1000)) - TEN_MINUTES
-
-         if last_pos_time > tenMinAgo and last_radar_time > tenMinAgo:
-            GPIO.output(26,GPIO.HIGH)
-            time.sleep(0.001)
-            GPIO.output(26,GPIO.LOW)
-         else:
-            GPIO.output(20,GPIO.HIGH)
-            time.sleep(0.001)
-            GPIO.output(20,GPIO.LOW)
-
-         if bytectr > outfilesize:
-            if not os.path.exists(flashdrive + "complete"):
-               os.mkdir(flashdrive + "complete")
+         except ChecksumError:
+            self.error()
+
+      if addr.endswith("TTM"):
+         self.status.last_target = stamp_ms
+
+      if addr.endswith(AIS_TYPES):
+         self.status.last_target = stamp_ms
+
+      if self.ais is not None and addr.endswith(AIS_TYPES):
+         rec = self.ais.feed(outdec, time.time())
+         if rec is not None:
+            self.ais_count = self.ais_count + 1
+            self.status.ais_decoded = self.status.ais_decoded + 1
+            self.ais_vessels.add(rec.mmsi)
+
+   def poll(self):
+      #Rotation and index checks. Also called when the source is quiet, so
+      #time limits apply without data arriving.
+      if self.index is not None and self.codec == "none" and self.outfile is not None and time.monotonic() - self.last_cut >= self.codec_flush_sec:
+         self.cut_text()
+      for outfile in (self.outfile, self.binfile):
+         if outfile is not None:
+            outfile.poll()
+
+      if self.rotation.due(self.bytectr, time.time()):
+         started = time.monotonic()
+         self.rollover()
+         if self.rollover_time is not None:
+            self.rollover_time.observe(time.monotonic() - started, self.name)
+
+   def rollover(self, reopen=True):
+      #Only swaps file handles: the finished files are renamed into complete/
+      #(atomic on the same filesystem); plain text is compressed by the archiver
+      flashdrive = self.flashdrive
+      done = []
+      if self.outfile is not None:
+         done.append((self.outfile, self.filename()))
+      if self.binfile is not None:
+         done.append((self.binfile, self.binname()))
+      if self.bytectr == 0:
+         #Time is up but nothing was logged: start a new file, keep no empty ones
+         for outfile, fn in done:
             outfile.close()
-            logging.info("Done writing to file " + flashdrive + timestr + "-" + name + "." + outfileext)
-            #copy file to complete dir
-            shutil.copyfile(flashdrive + timestr + "-" + name + "." + outfileext, flashdrive + "complete/" + timestr + "-" + name + "." + outfileext)
-            #if copy was successful and copied file exists, delete it
-            if os.path.isfile(flashdrive + "complete/" + timestr + "-" + name + "." + outfileext):
-               if os.path.isfile(flashdrive + timestr + "-" + name + "." + outfileext):
-                  os.remove(flashdrive + timestr + "-" + name + "." + outfileext)
-               #zip copied file
-               zipObj = zipfile.ZipFile(flashdrive + "complete/" + timestr + "-" + name + "." + "zip", 'w')
-               an = timestr + "-" + name + "." + outfileext
-               zipObj.write(flashdrive + "complete/" + timestr + "-" + name + "." + outfileext, compress_type=zipfile.ZIP_DEFLATED, arcname=an)
-               zipObj.close()
-               logging.info("File zipped")
-               #delete file if zip was succcessful
-            if os.path.isfile(flashdrive + "complete/" + timestr + "-" + name + "." + "zip"):
-               os.remove(flashdrive + "complete/" + timestr + "-" + name + "." + outfileext)
-            timestr = time.strftime("%Y%m%d-%H%M%S")
-            outfile = open(flashdrive + timestr + "-" + name + "." + outfileext, "a+", 1)
-            bytectr = 0
-
-         if time_to_exit:
-            logging.info(str(ser_err_amt) + " serial errors from port " + port)
-            logging.info("Exit from " + port)
-            threads_to_close = threads_to_close - 1
-            return
-
-def th_mon(media):
-   global threads_to_close
+            os.remove(flashdrive + fn)
+            if self.journal is not None:
+               self.journal.closed(self.jname(fn))
+         if reopen:
+            self.open()
+         return
+      if not os.path.exists(flashdrive + "complete"):
+         os.mkdir(flashdrive + "complete")
+      #Commit the data before the file becomes visible in complete/;
+      #close() writes and syncs everything still buffered
+      if self.index is not None and self.outfile is not None and self.codec == "none":
+         self.cut_text()
+      for outfile, fn in done:
+         outfile.close()
+         logging.info("Done writing to file " + flashdrive + fn)
+         os.replace(flashdrive + fn, flashdrive + "complete/" + fn)
+         if self.journal is not None:
+            self.journal.closed(self.jname(fn))
+      index = self.index
+      idxname = self.idxname()
+      if index is not None:
+         index.save(flashdrive + "complete/" + idxname)
+      if self.ais is not None:
+         logging.info(str(self.ais_count) + " AIS messages from " + str(len(self.ais_vessels)) + " vessels decoded, " +
+            str(self.ais.errors) + " errors, " + str(self.ais.expired) + " incomplete so far")
+      if self.throttle is not None:
+         st = self.throttle.stats()
+         logging.info("AIS dedup: " + str(st["passed"]) + " logged, " + str(st["duplicates"]) + " duplicates and " +
+            str(st["throttled"]) + " over the rate limit dropped, " + str(st["vessels"]) + " vessels tracked")
+      if reopen:
+         self.open()
+      for outfile, fn in done:
+         if fn.endswith("." + self.outfileext):
+            self.archiver.submit(flashdrive + "complete/" + fn)
+         else:
+            self.archiver.ready(flashdrive + "complete/" + fn)
+      if index is not None:
+         self.archiver.ready(flashdrive + "complete/" + idxname)
+
+def th_recover(journal,strays,flashdrive,archiver,outfileext):
+   #Finishes the files that were open when the logger stopped: cuts a torn
+   #end, then hands them on like a rollover would
+   logging.info("Recovering " + str(len(strays)) + " files left open")
+   for of in strays:
+      if supervisor.stopping(ARCHIVE):
+         break
+      #A full path for files on another flash drive
+      path = os.path.join(flashdrive, of.filename)
+      fn = os.path.basename(path)
+      done = os.path.join(os.path.dirname(path), "complete", fn)
+      if os.path.isfile(path):
+         try:
+            repair(path, of.synced)
+            if os.path.getsize(path) == 0:
+               os.remove(path)
+               logging.info("Removed empty " + fn)
+            else:
+               os.replace(path, done)
+               if fn.endswith("." + outfileext):
+                  archiver.submit(done)
+               else:
+                  archiver.ready(done)
+               logging.info("Recovered " + fn)
+         except (OSError, ValueError) as e:
+            #Left in place; moved as a stray file at the next startup
+            logging.info("Could not recover " + fn + ": " + str(e))
+      journal.closed(of.filename)
+
+def th_status(status):
+   #Drives the LEDs at a fixed cadence, see nmea_status.py
+   logging.info("Status thread started")
+   status.run(supervisor.flag(SERVICE))
+
+def th_devices(devices):
+   #Follows USB serial adapters being plugged in and out, see nmea_devices.py
+   devices.run(supervisor.flag(SERVICE))
+
+def th_storage(storage,status,interval):
    # **************************************
-   # ERROR CODES:
-   # two short blinks - disk 90% full
+   # ERROR CODES (shown by the status thread):
+   # two short red blinks - no flash drive with free space left
    # **************************************
-   logging.info("Monitor thread started")
-   #Test LEDs
-   led_list = [21,20,26]
-   for l in led_list:
-      GPIO.output(l,GPIO.HIGH)
-      time.sleep(0.3)
-      GPIO.output(l,GPIO.LOW)
-      time.sleep(0.1)
-      GPIO.output(l,GPIO.HIGH)
-      time.sleep(0.3)
-      GPIO.output(l,GPIO.LOW)
-      time.sleep(0.2)
-
-   time.sleep(1)
-
-   while not time_to_exit:
-      flashdrive = "/media/pi/" + media + "/"
-      hdd = psutil.disk_usage(flashdrive)
-      percent_free = hdd.free / hdd.total
-      if percent_free < 0.1:
-         logging.info("90% flash drive usage reached")
-         GPIO.output(21,GPIO.HIGH)
-         time.sleep(0.2)
-         GPIO.output(21,GPIO.LOW)
-         time.sleep(0.2)
-         GPIO.output(21,GPIO.HIGH)
-         time.sleep(0.2)
-         GPIO.output(21,GPIO.LOW)
-      time.sleep(2)
-   threads_to_close = threads_to_close - 1
-
-def th_stop():
-   global threads_to_close
-   logging.info("Stop thread started")
+   logging.info("Storage thread started")
+
+   while not supervisor.stopping(SERVICE):
+      storage.check()
+      full = storage.disk_full()
+      if full and not status.disk_full:
+         logging.info("No flash drive with free space left")
+      status.disk_full = full
+      supervisor.wait(interval, SERVICE)
+
+def th_metrics(metrics,path,interval,server):
+   #Writes metrics.json every interval seconds and once more at exit
+   logging.info("Metrics thread started")
+   previous = None
+   waited = 0
+   while not supervisor.wait(1, SERVICE):
+      waited = waited + 1
+      if interval > 0 and waited >= interval:
+         waited = 0
+         try:
+            previous = write_snapshot(metrics, path, previous)
+         except OSError as e:
+            logging.info("Could not write " + path + ": " + str(e))
+   if interval > 0:
+      try:
+         write_snapshot(metrics, path, previous)
+      except OSError as e:
+         logging.info("Could not write " + path + ": " + str(e))
+   if server is not None:
+      server.shutdown()
+
+def th_stop(shutdown_timeout):
+   #Waits for the OFF button or another shutdown request, then stops the
+   #other threads in order within shutdown_timeout seconds
+   logging.info("Stop detection started")
    off_pressed = 0
-   while True:
+   while not supervisor.wait(1):
       if GPIO.input(13) == GPIO.LOW:
          off_pressed = off_pressed + 1
          if off_pressed == 5: #OFF pressed for 5 seconds
             logging.info("OFF pressed")
-            global time_to_exit
-            time_to_exit = True
-            threads_to_close = threads_to_close - 1
-            while threads_to_close > 0:
-               pass
-
-            #Blink green, blue red when ending program 
-            GPIO.output(26,GPIO.HIGH)
-            time.sleep(0.5)
-            GPIO.output(26,GPIO.LOW)
-            GPIO.output(20,GPIO.HIGH)
-            time.sleep(0.5)
-            GPIO.output(20,GPIO.LOW)
-            GPIO.output(21,GPIO.HIGH)
-            time.sleep(0.5)
-            GPIO.output(21,GPIO.LOW)
-                  
-            #time.sleep(3)
-            #subprocess.call(["sudo shutdown", "-h", "now"])
-            #os.system("shutdown now -h")
+            supervisor.request("OFF pressed")
       if GPIO.input(13) == GPIO.HIGH:
          off_pressed = 0
 
-      time.sleep(1)
+   supervisor.drain(shutdown_timeout)
+
+   #Blink green, blue red when ending program 
+   GPIO.output(26,GPIO.HIGH)
+   time.sleep(0.5)
+   GPIO.output(26,GPIO.LOW)
+   GPIO.output(20,GPIO.HIGH)
+   time.sleep(0.5)
+   GPIO.output(20,GPIO.LOW)
+   GPIO.output(21,GPIO.HIGH)
+   time.sleep(0.5)
+   GPIO.output(21,GPIO.LOW)
+         
+   #time.sleep(3)
+   #subprocess.call(["sudo shutdown", "-h", "now"])
+   #os.system("shutdown now -h")
    
-def th_transfer(media,vessel_name,delete_after_transfer,ftp_server,ftp_user,ftp_password,ftp_wait_sec,ftp_use_ports_file):
-   global threads_to_close
+def th_transfer(media,vessel_name,delete_after_transfer,ftp_server,ftp_port,ftp_user,ftp_password,ftp_wait_sec,ftp_use_ports_file,ftp_connections,ftp_rate_limit_kbps,transfer_queue,status,metrics):
    global current_location
 
    logging.info("Transfer thread started")
-   cl = current_location
-   portlist = []
+   #Loading the queue stats every archive in complete/, so it runs here
+   #rather than before ingest starts
+   transfer_queue.load()
+   ports = None
+   current_port = None
    can_transmit = False
-   flashdrive = "/media/pi/" + media + "/"
 
    if ftp_use_ports_file == 1:
-      #Read ports (where data transfer can take place) into list for later use
-      ports = open('/home/pi/nmea_logger/ports_v1.txt', 'r')
-      pl = ports.readlines()
-      for line in pl:
-         if line != "\n" and line[0] != "#" and line != "[ports]\n": 
-            elem = line.split(" ")
-            location = elem[0].strip()
-
-            top_left = elem[1].strip().replace("(","")
-            top_left = top_left.replace(")","")
-            tl = top_left.split(",")
-            tla = float(tl[0])
-            tlo = float(tl[1])
-
-            bottom_right = elem[2].strip().replace(")","")
-            bottom_right = bottom_right.replace("(","")
-            br = bottom_right.split(",")
-            bla = float(br[0])
-            blo = float(br[1])
-            
-            portentry = [location,tla,tlo,bla,blo]
-            portlist.append(portentry)
+      #Ports (where data transfer can take place), indexed for fast lookup
+      ports = load_ports('/home/pi/nmea_logger/ports_v1.txt')
    else:
       can_transmit = True
+
+   #Upload rate shared by all connections, kbit/s to bytes/s
+   bucket = TokenBucket(ftp_rate_limit_kbps * 1000 // 8)
+   uploader = FtpUploader(ftp_server, ftp_user, ftp_password, "/" + vessel_name, ftp_connections, port=ftp_port, bucket=bucket)
+   sent_files = metrics.counter("nmea_transfer_files_total", "Files uploaded")
+   sent_bytes = metrics.counter("nmea_transfer_bytes_total", "Bytes uploaded")
+   throughput = metrics.histogram("nmea_transfer_file_rate_kbps", "Upload rate per file in kB/s", buckets=(1, 5, 10, 50, 100, 500, 1000, 5000))
+
+   def transferred(path, nbytes, seconds):
+      #Called by the uploader for every file whose remote size matched
+      ftt = os.path.basename(path)
+      transfer_queue.remove(path)
+      rate, eta = transfer_queue.record(nbytes, seconds)
+      sent_files.inc()
+      sent_bytes.inc(nbytes)
+      throughput.observe(nbytes / max(seconds, 0.001) / 1000)
+      logging.info("File " + ftt + " sucessfully transferred, " + str(nbytes) + " bytes in " + str(round(seconds, 1)) + " s (" +
+         str(round(nbytes / max(seconds, 0.001) / 1000, 1)) + " kB/s), backlog " + str(transfer_queue.backlog_bytes()) + " bytes, ETA " + str(int(eta)) + " s")
+      if delete_after_transfer == 1:
+         if os.path.exists(path):
+            os.remove(path)
+            logging.info("local file  " + ftt + " deleted")
+      else:
+         #Move file to transferred dir
+         #transferred/ next to the complete/ the file is in
+         os.replace(path, os.path.join(os.path.dirname(os.path.dirname(path)), "transferred", ftt))
+         logging.info("file " + ftt + " moved to transferred dir")
        
-   while not time_to_exit:
-      if ftp_use_ports_file == 1:
-         cl = current_location
-         for ple in portlist:
-            if cl[0] < ple[1] and cl[0] > ple[3] and cl[1] > ple[2] and cl[1] < ple[4]:
-               can_transmit = True
-               break
-            else:
-               can_transmit = False
-
-      if can_transmit:
-         files_to_transfer = []
-         for root, dirs, files in os.walk(flashdrive + "complete/"):
-            for filename in files:
-               if filename.endswith(".zip"):
-                  files_to_transfer.append(filename)
-         if files_to_transfer:
-            try:
-               session = ftplib.FTP(ftp_server, ftp_user, ftp_password, timeout=20)
-               session.set_debuglevel(1)
-               session.cwd("/" + vessel_name)
-               for ftt in files_to_transfer:
-                  file = open(flashdrive + "complete/" + ftt,'rb')
-                  session.storbinary('STOR ' + ftt, file)
-                  file.close()
-                  #Delete local file if transfer was successful and file size equal
-                  if ftt in session.nlst():
-                     remote_file_size = session.size(ftt)
-                     local_file_size = Path(flashdrive + "complete/" + ftt).stat().st_size
-                     if remote_file_size == local_file_size:
-                        logging.info("File " + ftt + " sucessfully transferred")
-                        if delete_after_transfer == 1:
-                           if os.path.exists(flashdrive + "complete/" + ftt):
-                              os.remove(flashdrive + "complete/" + ftt)
-                              logging.info("local file  " + ftt + " deleted")
-                        else:
-                        #Move file to transferred dir
-                           shutil.move(flashdrive + "complete/" + ftt, flashdrive + "transferred/" + ftt)
-                           logging.info("file " + ftt + " moved to transferred dir")
-               session.quit()
-            except ftplib.all_errors as e:
-               try:
-                  logging.info("FTP error: " + str(e))
-                  session.close()
-               except:
-                  pass
-            finally:
+   try:
+      while not supervisor.stopping(TRANSFER):
+         if ports is not None:
+            cl = current_location
+            port = ports.lookup(cl[0], cl[1])
+            if port != current_port:
+               logging.info("In port " + port if port else "Left port " + str(current_port))
+               current_port = port
+            can_transmit = port is not None
+
+         if can_transmit:
+            #Oldest or newest first, see ftp_order
+            files_to_transfer = transfer_queue.pending()
+            if files_to_transfer:
+               status.transferring = True
                try:
-                  logging.info("FTP error")
-                  session.close()
-               except:
-                  pass
-
-      time.sleep(ftp_wait_sec)
-   threads_to_close = threads_to_close - 1
+                  uploader.upload(files_to_transfer, transferred, supervisor.flag(TRANSFER))
+               finally:
+                  status.transferring = False
+
+         #Wait for the next cycle, keeping open FTP sessions alive
+         waited = 0
+         while waited < ftp_wait_sec and not supervisor.wait(1, TRANSFER):
+            waited = waited + 1
+            if waited % 60 == 0:
+               uploader.keepalive()
+   finally:
+      uploader.close()
+      transfer_queue.close()
 
 def media_path():
-   ld = []
-   ld = os.listdir("/media/pi")
-   for en in ld:
-      ofil = "/media/pi/" + en + "/testnmeaout.txt"
-      try:
-         tfil = open(ofil,"w")
-         tfil.write("test")
-         tfil.close()
-         f = open(ofil)
-         rd = f.read()
-         if rd == "test":
-            f.close()
-            os.remove(ofil)
-            #Check that complete dir exists. If not create it
-            if not os.path.exists("/media/pi/" + en + "/complete"):
-                os.makedirs("/media/pi/" + en + "/complete")
-            #Check that transferred dir exists. If not create it
-            if not os.path.exists("/media/pi/" + en + "/transferred"):
-                os.makedirs("/media/pi/" + en + "/transferred")
-            return en
-      except:
-         logging.info(en + " is not writable")
+   #First writable flash drive, see nmea_storage.find_volumes
+   volumes = find_volumes(media_root, 1)
+   if volumes:
+      return volumes[0]
    logging.info("No_writeable_media")
    return "no_writeable_media"
 
-def dms2dd(tup1):
-   dd = float(tup1[0]) + float(tup1[1])/60 + float(tup1[2])/(60*60)
-   return dd
-
 class StreamToLogger(object):
       #Fake file-like stream object that redirects writes to a logger instance.
       def __init__(self, logger, log_level=logging.INFO):
@@ -659,6 +933,10 @@ class StreamToLogger(object):
             for line in buf.rstrip().splitlines():
                   self.logger.log(self.log_level, line.rstrip())
 
+      def flush(self):
+            #Called at interpreter exit; lines are logged as they are written
+            pass
+
 logging.basicConfig(
 level=logging.DEBUG,
 format='%(asctime)s:%(levelname)s:%(name)s:%(message)s',
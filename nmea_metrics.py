@@ -0,0 +1,213 @@
+#******************
+# NMEA Logger
+# Metrics registry, Prometheus text endpoint and JSON snapshots
+#******************
+# Counters, gauges and histograms are registered once by name. Values that
+# other objects already keep (sentences per source, archiver and transfer
+# queue state, ...) are read by callbacks when the metrics are collected, so
+# the ingest path does no extra work. Histograms take a lock per observation
+# and are meant for rare events (a rollover, an uploaded file).
+# [General] metrics_port > 0 serves http://metrics_bind:metrics_port/metrics
+# in the Prometheus text format; metrics_json_sec > 0 writes metrics.json to
+# the media every metrics_json_sec seconds, with per-second rates of the
+# counters since the previous snapshot.
+#******************
+
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Metric(object):
+   #One metric with zero or more label names. Values are kept per tuple of
+   #label values; fn, if given, returns {label values: value} on collection.
+   def __init__(self, kind, name, help, labels=(), fn=None):
+      self.kind = kind
+      self.name = name
+      self.help = help
+      self.labels = tuple(labels)
+      self.fn = fn
+      self.values = {}
+      if kind != "histogram" and not self.labels:
+         #Metrics without labels are exported as 0 before the first update
+         self.values[()] = 0
+      self.lock = threading.Lock()
+
+   def series(self):
+      if self.fn is not None:
+         values = self.fn()
+         if not isinstance(values, dict):
+            values = {(): values}
+         return sorted(values.items())
+      with self.lock:
+         return sorted(self.values.items())
+
+   def inc(self, n=1, *labels):
+      with self.lock:
+         self.values[labels] = self.values.get(labels, 0) + n
+
+   def set(self, value, *labels):
+      with self.lock:
+         self.values[labels] = value
+
+
+class Histogram(Metric):
+   def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+      Metric.__init__(self, "histogram", name, help, labels)
+      self.buckets = tuple(buckets)
+
+   def observe(self, value, *labels):
+      with self.lock:
+         h = self.values.get(labels)
+         if h is None:
+            h = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            self.values[labels] = h
+         for i, bound in enumerate(self.buckets):
+            if value <= bound:
+               h["counts"][i] = h["counts"][i] + 1
+         h["sum"] = h["sum"] + value
+         h["count"] = h["count"] + 1
+
+   def series(self):
+      with self.lock:
+         return sorted((k, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]}) for k, v in self.values.items())
+
+
+class Registry(object):
+   def __init__(self):
+      self.metrics = {}
+      self.lock = threading.Lock()
+      self.started = time.time()
+      self.gauge("nmea_uptime_seconds", "Seconds since the logger started", fn=lambda: time.time() - self.started)
+
+   def _add(self, metric):
+      #Registering the same name again returns the existing metric
+      with self.lock:
+         return self.metrics.setdefault(metric.name, metric)
+
+   def counter(self, name, help, labels=(), fn=None):
+      return self._add(Metric("counter", name, help, labels, fn))
+
+   def gauge(self, name, help, labels=(), fn=None):
+      return self._add(Metric("gauge", name, help, labels, fn))
+
+   def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+      return self._add(Histogram(name, help, labels, buckets))
+
+   def collect(self):
+      #[(metric, [(label values, value)])]; a failing callback is skipped
+      with self.lock:
+         metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+      out = []
+      for m in metrics:
+         try:
+            out.append((m, m.series()))
+         except Exception as e:
+            logging.info("Metric " + m.name + " failed: " + str(e))
+      return out
+
+   def prometheus(self):
+      lines = []
+      for m, series in self.collect():
+         lines.append("# HELP " + m.name + " " + m.help)
+         lines.append("# TYPE " + m.name + " " + m.kind)
+         for labels, value in series:
+            names = list(zip(m.labels, labels))
+            if m.kind == "histogram":
+               for bound, count in zip(m.buckets, value["counts"]):
+                  lines.append(m.name + "_bucket" + _labels(names + [("le", _number(bound))]) + " " + str(count))
+               lines.append(m.name + "_bucket" + _labels(names + [("le", "+Inf")]) + " " + str(value["count"]))
+               lines.append(m.name + "_sum" + _labels(names) + " " + _number(value["sum"]))
+               lines.append(m.name + "_count" + _labels(names) + " " + str(value["count"]))
+            else:
+               lines.append(m.name + _labels(names) + " " + _number(value))
+      return "\n".join(lines) + "\n"
+
+   def snapshot(self, previous=None):
+      #Plain dict for JSON. With the previous snapshot, counters also get
+      #their per-second rate since then.
+      now = time.time()
+      doc = {"time": now, "metrics": {}}
+      for m, series in self.collect():
+         entries = []
+         for labels, value in series:
+            entry = {"labels": dict(zip(m.labels, labels)), "value": value}
+            if m.kind == "histogram":
+               entry["value"] = {"count": value["count"], "sum": value["sum"],
+                                 "buckets": dict(zip([_number(b) for b in m.buckets], value["counts"]))}
+            elif m.kind == "counter" and previous is not None:
+               old = _find(previous, m.name, entry["labels"])
+               dt = now - previous["time"]
+               if old is not None and dt > 0:
+                  entry["rate"] = (value - old) / dt
+            entries.append(entry)
+         doc["metrics"][m.name] = {"type": m.kind, "help": m.help, "series": entries}
+      return doc
+
+
+def _number(v):
+   if isinstance(v, float):
+      if math.isinf(v):
+         return "+Inf" if v > 0 else "-Inf"
+      return repr(v)
+   return str(v)
+
+
+def _labels(pairs):
+   if not pairs:
+      return ""
+   return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+def _find(doc, name, labels):
+   metric = doc["metrics"].get(name)
+   if metric is None:
+      return None
+   for entry in metric["series"]:
+      if entry["labels"] == labels:
+         return entry["value"]
+   return None
+
+
+def write_snapshot(registry, path, previous=None):
+   #Write metrics.json atomically; returns the snapshot for the next rates
+   doc = registry.snapshot(previous)
+   tmp = path + ".tmp"
+   with open(tmp, "w") as f:
+      json.dump(doc, f, indent=1)
+   os.replace(tmp, path)
+   return doc
+
+
+def start_http(registry, port, bind="127.0.0.1"):
+   #Serve /metrics from a daemon thread; returns the server (call shutdown())
+   class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+         if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+         body = registry.prometheus().encode("utf-8")
+         self.send_response(200)
+         self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+         self.send_header("Content-Length", str(len(body)))
+         self.end_headers()
+         self.wfile.write(body)
+
+      def log_message(self, format, *args):
+         pass
+
+   server = ThreadingHTTPServer((bind, port), Handler)
+   server.daemon_threads = True
+   t = threading.Thread(target=server.serve_forever, name="metrics-http")
+   t.daemon = True
+   t.start()
+   logging.info("Metrics at http://" + bind + ":" + str(port) + "/metrics")
+   return server
@@ -0,0 +1,219 @@
+#******************
+# NMEA Logger
+# Staged ingest: bounded ring buffer between a reader and its file stage
+#******************
+# Without it a reader thread filters, parses and writes every read itself,
+# so a flash drive that stalls for a few hundred ms stops the reads and the
+# UART or socket buffer overruns. StagedSink puts a RingBuffer and a Stage
+# thread in between: the reader only stamps the sentences of a read with its
+# time and hands them over as one batch; the stage takes all the batches
+# waiting at once and runs the SourceLog on them (filter, parse, status,
+# write, rotate).
+# The ring holds up to capacity sentences. When it is full:
+#   block        the reader waits for room: nothing is dropped here, the
+#                source may overrun instead. With the asyncio engine this
+#                holds up every source.
+#   drop_oldest  the oldest batches are dropped to make room
+#   drop_newest  the new batch is dropped
+# [General] pipeline_queue_lines sets the capacity (0 turns staging off),
+# pipeline_policy the policy, which a source section can override.
+# Both sides keep StageStats (time busy, batches, sentences, longest wait)
+# for the metrics.
+#******************
+
+
+import collections
+import logging
+import threading
+import time
+
+
+POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class RingBuffer(object):
+   #Bounded FIFO of batches, counted in items (sentences)
+   def __init__(self, capacity=20000, policy="block"):
+      if policy not in POLICIES:
+         raise ValueError("policy must be one of " + ", ".join(POLICIES))
+      self.capacity = capacity
+      self.policy = policy
+      self.batches = collections.deque()
+      self.items = 0
+      self.dropped = 0
+      #Set by close(); get() no longer waits
+      self.closed = False
+      self.cond = threading.Condition()
+
+   def put(self, batch, n, should_stop=lambda: False):
+      #Queue batch of n items; False if it was dropped. A batch larger than
+      #the capacity still goes into an empty ring.
+      with self.cond:
+         if self.items + n > self.capacity and self.items:
+            if self.policy == "drop_newest":
+               self.dropped = self.dropped + n
+               return False
+            if self.policy == "drop_oldest":
+               while self.items + n > self.capacity and self.batches:
+                  old, m, queued = self.batches.popleft()
+                  self.items = self.items - m
+                  self.dropped = self.dropped + m
+            else:
+               while self.items + n > self.capacity and self.items and not should_stop():
+                  self.cond.wait(0.1)
+         self.batches.append((batch, n, time.monotonic()))
+         self.items = self.items + n
+         self.cond.notify_all()
+         return True
+
+   def get(self, timeout):
+      #All waiting batches as [(batch, n, time queued)]; [] after timeout
+      with self.cond:
+         if not self.batches and not self.closed:
+            self.cond.wait(timeout)
+         out = list(self.batches)
+         self.batches.clear()
+         self.items = 0
+         self.cond.notify_all()
+         return out
+
+   def wake(self):
+      with self.cond:
+         self.cond.notify_all()
+
+   def close(self):
+      with self.cond:
+         self.closed = True
+         self.cond.notify_all()
+
+
+class StageStats(object):
+   def __init__(self, name):
+      self.name = name
+      self.busy = 0.0
+      self.batches = 0
+      self.items = 0
+      #Longest time a batch waited: in the ring for a stage, for room in
+      #the ring for the reader
+      self.max_wait = 0.0
+
+
+class Stage(object):
+   #Thread running handler(batch) on the batches of ring. idle() is called
+   #at least every idle_sec seconds, with or without data.
+   def __init__(self, name, ring, handler, idle=None, idle_sec=1.0):
+      self.name = name
+      self.ring = ring
+      self.handler = handler
+      self.idle = idle
+      self.idle_sec = idle_sec
+      self.stats = StageStats(name)
+      self.stopping = threading.Event()
+      #Exception that ended the thread
+      self.error = None
+      self.thread = None
+
+   def start(self):
+      self.thread = threading.Thread(target=self.run, name=self.name)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def dead(self):
+      return self.error is not None
+
+   def run(self):
+      st = self.stats
+      last_idle = time.monotonic()
+      try:
+         while True:
+            got = self.ring.get(self.idle_sec)
+            if got:
+               started = time.monotonic()
+               for batch, n, queued in got:
+                  if started - queued > st.max_wait:
+                     st.max_wait = started - queued
+                  self.handler(batch)
+                  st.items = st.items + n
+               st.batches = st.batches + len(got)
+               st.busy = st.busy + time.monotonic() - started
+            elif self.stopping.is_set():
+               return
+            if self.idle is not None and time.monotonic() - last_idle >= self.idle_sec:
+               self.idle()
+               last_idle = time.monotonic()
+      except Exception as e:
+         self.error = e
+         logging.exception("Stage " + self.name + " failed")
+         self.ring.wake()
+
+   def stop(self):
+      #Returns once the batches still queued are handled
+      self.stopping.set()
+      self.ring.close()
+      self.thread.join()
+
+
+class StagedSink(object):
+   #Sink of a reader (see nmea_ingest.IngestEngine) in front of a SourceLog,
+   #whose handle(stamp, lines) runs on the stage thread
+   def __init__(self, sink, capacity=20000, policy="block"):
+      self.sink = sink
+      self.ring = RingBuffer(capacity, policy)
+      self.stage = Stage(sink.name + "-write", self.ring, self.handle, sink.poll)
+      self.read = StageStats(sink.name + "-read")
+      self.dropping = False
+      self.stage.start()
+
+   def __getattr__(self, name):
+      #name, err_amt, status, ... of the SourceLog
+      return getattr(self.sink, name)
+
+   def handle(self, batch):
+      stamp, lines = batch
+      if lines is None:
+         self.sink.error()
+      else:
+         self.sink.handle(stamp, lines)
+
+   def check(self):
+      #A failed stage fails the reader, which the supervisor restarts
+      if self.stage.error is not None:
+         raise self.stage.error
+
+   def feed(self, lines):
+      self.check()
+      if not lines:
+         return
+      started = time.monotonic()
+      #Stamped here, with the time of the read, not when the stage gets to it
+      stamp = self.sink.clock.stamp()
+      dropped = self.ring.dropped
+      self.ring.put((stamp, lines), len(lines), self.stage.dead)
+      took = time.monotonic() - started
+      st = self.read
+      st.busy = st.busy + took
+      st.batches = st.batches + 1
+      st.items = st.items + len(lines)
+      if took > st.max_wait:
+         st.max_wait = took
+      if self.ring.dropped != dropped:
+         self.sink.status.dropped = self.sink.status.dropped + self.ring.dropped - dropped
+         if not self.dropping:
+            logging.info("Pipeline: " + self.sink.name + " queue full, dropping sentences (" + self.ring.policy + ")")
+         self.dropping = True
+      else:
+         self.dropping = False
+
+   def poll(self):
+      #Rotation is checked by the stage
+      self.check()
+
+   def error(self):
+      #Counted on the stage thread, in order with the sentences
+      self.ring.put((None, None), 0)
+
+   def close(self):
+      self.stage.stop()
+      if self.ring.dropped:
+         logging.info("Pipeline: " + str(self.ring.dropped) + " sentences from " + self.sink.name + " dropped")
+      self.sink.close()
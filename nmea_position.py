@@ -0,0 +1,88 @@
+#******************
+# NMEA Logger
+# Position from GGA, RMC and GLL sentences of any talker, with checksum check
+#******************
+
+
+from functools import reduce
+from operator import xor
+
+
+POSITION_TYPES = ("GGA", "RMC", "GLL")
+
+
+class ChecksumError(ValueError):
+   pass
+
+
+def _checksum(sentence, star):
+   #True if the two hex digits after the * match the XOR of the text between
+   #the $ or ! and the *. An NMEA 4 tag block in front is skipped.
+   if star < 1 or len(sentence) < star + 3:
+      return False
+   start = 1
+   if sentence[0] == "\\":
+      start = sentence.find("\\", 1) + 2
+      if start < 2:
+         return False
+   try:
+      want = int(sentence[star + 1:star + 3], 16)
+   except ValueError:
+      return False
+   return _xor(sentence[start:star].encode("latin-1")) == want
+
+
+def _xor(data):
+   #XOR of all bytes. Folding the bytes as one integer takes 7 shifts for up
+   #to 128 bytes (any NMEA 0183 sentence), instead of a step per byte.
+   if len(data) > 128:
+      return reduce(xor, data, 0)
+   x = int.from_bytes(data, "little")
+   x = x ^ (x >> 512)
+   x = x ^ (x >> 256)
+   x = x ^ (x >> 128)
+   x = x ^ (x >> 64)
+   x = x ^ (x >> 32)
+   x = x ^ (x >> 16)
+   x = x ^ (x >> 8)
+   return x & 0xFF
+
+
+def checksum_ok(sentence):
+   return _checksum(sentence, sentence.rfind("*"))
+
+
+def _coord(value, hemi):
+   #ddmm.mmmm / dddmm.mmmm and hemisphere to signed decimal degrees
+   v = float(value)
+   d = v // 100
+   c = d + (v - d * 100) / 60.0
+   if hemi == "S" or hemi == "W":
+      return -c
+   return c
+
+
+def parse_position(sentence):
+   #(lat, lon) of a GGA/RMC/GLL sentence, or None if it carries no valid fix.
+   #Raises ChecksumError for corrupted sentences, which must not be used at all.
+   star = sentence.rfind("*")
+   if not _checksum(sentence, star):
+      raise ChecksumError(sentence)
+   f = sentence[:star].split(",")
+   kind = f[0][-3:]
+   try:
+      if kind == "GGA":
+         if f[6] == "" or f[6] == "0":
+            return None
+         return (_coord(f[2], f[3]), _coord(f[4], f[5]))
+      if kind == "RMC":
+         if f[2] != "A":
+            return None
+         return (_coord(f[3], f[4]), _coord(f[5], f[6]))
+      if kind == "GLL":
+         if len(f) > 6 and f[6] != "A":
+            return None
+         return (_coord(f[1], f[2]), _coord(f[3], f[4]))
+   except (ValueError, IndexError):
+      return None
+   return None
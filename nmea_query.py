@@ -0,0 +1,227 @@
+#******************
+# NMEA Logger
+# Extract sentences by time, type and MMSI from an archive of logged files
+#******************
+# Uses the .idx sidecars (nmea_index.py) to skip files and blocks that cannot
+# match, so only the needed gzip members, zstd frames, xz streams or .nmb
+# blocks are read and decompressed. Plain .dat files (codec none) are zipped
+# after rollover; their blocks are found by decompressing the zip member
+# from its start, so for them only whole files are skipped. Output is in the
+# .dat text format.
+#   python nmea_query.py --start 2020-01-01T03:00 --end 2020-01-01T04:00 --types GGA /media/pi/usb/transferred
+#   python nmea_query.py --mmsi 503123456 --types *VDM --summary archive/
+#******************
+
+
+import argparse
+import calendar
+import io
+import os
+import sys
+import time
+import zipfile
+from nmea_binlog import BINARY_SUFFIX, block_rows, read_blocks
+from nmea_codec import codec_of, decompress
+from nmea_dedup import payload_key
+from nmea_filter import SentenceFilter, sentence_address
+from nmea_index import INDEX_SUFFIX, load_index
+
+
+TIME_FORMATS = ("%Y%m%d-%H%M%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+
+def parse_time(text):
+   #UTC time to epoch ms
+   for fmt in TIME_FORMATS:
+      try:
+         return calendar.timegm(time.strptime(text, fmt)) * 1000
+      except ValueError:
+         pass
+   raise argparse.ArgumentTypeError("unknown time format: " + text)
+
+
+def stamp(ms):
+   #Timestamp prefix of a .dat line
+   return time.strftime("%Y%m%d-%H%M%S", time.gmtime(ms // 1000)) + ".%03d UTC," % (ms % 1000)
+
+
+class Query(object):
+   def __init__(self, start=None, end=None, types=None, mmsi=None):
+      #start inclusive, end exclusive, both epoch ms or None
+      self.start = start
+      self.end = end
+      self.filter = SentenceFilter(types) if types else None
+      self.mmsi = set(mmsi) if mmsi else None
+      self.text_start = stamp(start)[:19] if start is not None else None
+      self.text_end = stamp(end)[:19] if end is not None else None
+      #(sequence id, channel) -> result of the first fragment
+      self.fragments = {}
+
+   def overlaps(self, first, last):
+      if first is None:
+         return False
+      return (self.start is None or last >= self.start) and (self.end is None or first < self.end)
+
+   def any_type(self, addresses):
+      return self.filter is None or any(self.filter.accepts_address(a) for a in addresses)
+
+   def wants_file(self, doc):
+      if not self.overlaps(doc["first"], doc["last"]) or not self.any_type(doc["types"]):
+         return False
+      return self.mmsi is None or not self.mmsi.isdisjoint(doc["mmsi"])
+
+   def wants_block(self, block):
+      start, end, first, last, rows, addresses = block
+      return self.overlaps(first, last) and self.any_type(addresses)
+
+   def wants_sentence(self, address, sentence):
+      if self.filter is not None and not self.filter.accepts_address(address):
+         return False
+      if self.mmsi is None:
+         return True
+      if not address.endswith(("VDM", "VDO")):
+         return False
+      start = 0
+      if sentence[0] == "\\":
+         start = sentence.find("\\", 1) + 1
+      f = sentence[start:].split(",", 6)
+      if len(f) < 6:
+         return False
+      if f[2] != "1":
+         #Later fragments follow the first one
+         return self.fragments.get((f[3], f[4]), False)
+      try:
+         ok = payload_key(f[5])[0] in self.mmsi
+      except IndexError:
+         ok = False
+      if f[1] != "1":
+         self.fragments[(f[3], f[4])] = ok
+      return ok
+
+
+def data_path(directory, name):
+   #The data file of an index entry; plain .dat files are zipped after rollover
+   path = os.path.join(directory, name)
+   if os.path.isfile(path):
+      return path
+   path = os.path.join(directory, os.path.splitext(name)[0] + ".zip")
+   if os.path.isfile(path):
+      return path
+   return None
+
+
+def block_data(path, blocks):
+   #Bytes of each block, in order. In a zip the offsets are into the member:
+   #seek() decompresses everything before the block, and the member is read
+   #forward only as far as the last block needed.
+   if path.endswith(".zip"):
+      with zipfile.ZipFile(path) as z:
+         with z.open(z.namelist()[0]) as member:
+            for start, end in blocks:
+               member.seek(start)
+               yield member.read(end - start)
+      return
+   codec = codec_of(path)
+   with open(path, "rb") as f:
+      for start, end in blocks:
+         f.seek(start)
+         yield decompress(codec, f.read(end - start))
+
+
+def text_rows(data):
+   #(time prefix, address, sentence) of the lines of a .dat block. Lines
+   #written with timestamp_format=epoch get the same prefix as utc ones.
+   for line in data.decode("utf-8", "replace").splitlines():
+      p = line.find(" UTC,")
+      if p >= 0:
+         sentence = line[p + 5:]
+         yield line[:p], sentence_address(sentence) or "", sentence
+         continue
+      p = line.find(",")
+      try:
+         ms = int(round(float(line[:p]) * 1000))
+      except ValueError:
+         continue
+      sentence = line[p + 1:]
+      yield stamp(ms)[:19], sentence_address(sentence) or "", sentence
+
+
+def query_file(query, directory, doc, out, counts):
+   #Write the matching sentences of one indexed rollover to out
+   names = [n for n in doc["files"] if data_path(directory, n) is not None]
+   if not names:
+      return
+   #The binary log is the cheapest to read when both were written
+   binary = [n for n in names if n.endswith(BINARY_SUFFIX)]
+   name = binary[0] if binary else names[0]
+   blocks = doc["files"][name]
+   wanted = [b for b in blocks if query.wants_block(b)]
+   counts["blocks"] = counts["blocks"] + len(blocks)
+   counts["read"] = counts["read"] + len(wanted)
+   path = data_path(directory, name)
+   for data in block_data(path, [(b[0], b[1]) for b in wanted]):
+      if name.endswith(BINARY_SUFFIX):
+         for offset, rows, types, body in read_blocks(io.BytesIO(data)):
+            for ms, source, address, sentence in block_rows(rows, types, body):
+               if query.overlaps(ms, ms) and query.wants_sentence(address, sentence):
+                  out.write(stamp(ms) + sentence + "\n")
+                  counts["rows"] = counts["rows"] + 1
+      else:
+         for prefix, address, sentence in text_rows(data):
+            if query.text_start is not None and prefix < query.text_start:
+               continue
+            if query.text_end is not None and prefix >= query.text_end:
+               continue
+            if query.wants_sentence(address, sentence):
+               out.write(prefix + " UTC," + sentence + "\n")
+               counts["rows"] = counts["rows"] + 1
+
+
+def index_files(paths):
+   #.idx files of the given files and directories, oldest first by name
+   out = []
+   for path in paths:
+      if os.path.isdir(path):
+         out.extend(os.path.join(path, n) for n in os.listdir(path) if n.endswith(INDEX_SUFFIX))
+      else:
+         out.append(path)
+   return sorted(out, key=os.path.basename)
+
+
+def main():
+   parser = argparse.ArgumentParser(description="Extract sentences from indexed NMEA logger files")
+   parser.add_argument("paths", nargs="+", help="directories or .idx files")
+   parser.add_argument("--start", type=parse_time, help="UTC start time, e.g. 2020-01-01T03:00")
+   parser.add_argument("--end", type=parse_time, help="UTC end time (exclusive)")
+   parser.add_argument("--types", help="address patterns as in nmea_sentence_types, e.g. GGA,*VDM")
+   parser.add_argument("--mmsi", help="comma separated MMSIs (AIS sentences only)")
+   parser.add_argument("--summary", action="store_true", help="list matching files from the indexes only")
+   args = parser.parse_args()
+
+   mmsi = [int(m) for m in args.mmsi.split(",")] if args.mmsi else None
+   query = Query(args.start, args.end, args.types, mmsi)
+   counts = {"files": 0, "matched": 0, "blocks": 0, "read": 0, "rows": 0}
+   for path in index_files(args.paths):
+      try:
+         doc = load_index(path)
+      except (OSError, ValueError) as e:
+         sys.stderr.write("Skipping " + path + ": " + str(e) + "\n")
+         continue
+      counts["files"] = counts["files"] + 1
+      if not query.wants_file(doc):
+         continue
+      counts["matched"] = counts["matched"] + 1
+      if args.summary:
+         print("%s  %s .. %s  %d sentences, %d vessels" % (os.path.basename(path), stamp(doc["first"])[:-5],
+            stamp(doc["last"])[:-5], doc["rows"], len(doc["mmsi"])))
+         continue
+      query_file(query, os.path.dirname(path), doc, sys.stdout, counts)
+   if args.summary:
+      sys.stderr.write("%d of %d files matched\n" % (counts["matched"], counts["files"]))
+   else:
+      sys.stderr.write("%d of %d files matched, %d of %d blocks read, %d sentences\n" %
+         (counts["matched"], counts["files"], counts["read"], counts["blocks"], counts["rows"]))
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,62 @@
+#******************
+# NMEA Logger
+# Output file rotation policy
+#******************
+# A file is rotated when any of the limits is reached:
+#   output_file_size     bytes of data logged to it (before compression)
+#   rotate_max_age_sec   seconds since it was opened, 0 for no limit
+#   rotate_align         none, hour or day: also rotate at every UTC hour or
+#                        day boundary, so files line up with clock time
+# The keys are read from [General] and can be overridden in the section of a
+# source. Files that are still empty when their time is up are discarded
+# instead of rotated.
+#******************
+
+
+import logging
+
+
+ALIGNMENTS = {"none": 0, "hour": 3600, "day": 86400}
+
+
+class RotationPolicy(object):
+   def __init__(self, max_bytes=200000, max_age=0, align="none"):
+      if align not in ALIGNMENTS:
+         raise ValueError("rotate_align must be none, hour or day")
+      self.max_bytes = max_bytes
+      self.max_age = max_age
+      self.align = align
+      self.deadline = None
+
+   def opened(self, now):
+      #Start timing a new file opened at now (epoch seconds)
+      deadline = None
+      if self.max_age > 0:
+         deadline = now + self.max_age
+      period = ALIGNMENTS[self.align]
+      if period:
+         boundary = (now // period + 1) * period
+         if deadline is None or boundary < deadline:
+            deadline = boundary
+      self.deadline = deadline
+
+   def due(self, nbytes, now):
+      #True if a file holding nbytes must be rotated at now
+      if self.max_bytes > 0 and nbytes > self.max_bytes:
+         return True
+      return self.deadline is not None and now >= self.deadline
+
+
+def read_policy(parser, section=None):
+   #Policy of a source; keys in its section override the [General] ones
+   def get(key, fallback):
+      value = parser.get('General', key, fallback=fallback)
+      if section is not None:
+         value = parser.get(section, key, fallback=value)
+      return value
+
+   align = get('rotate_align', 'none').strip().lower()
+   if align not in ALIGNMENTS:
+      logging.info("Unknown rotate_align " + align + ", not aligning files")
+      align = "none"
+   return RotationPolicy(int(get('output_file_size', '200000')), int(get('rotate_max_age_sec', '0')), align)
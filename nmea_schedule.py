@@ -0,0 +1,176 @@
+#******************
+# NMEA Logger
+# Transfer scheduling: upload queue, ordering and rate limiting
+#******************
+# TransferQueue keeps the files waiting for upload in a journal in complete/
+# (one "+" line per file added, one "-" line per file transferred), so the
+# transfer thread does not have to list the directory every cycle. The
+# journal is compacted when it is loaded at startup, which also picks up
+# files that were added while it was not being written (e.g. a crash).
+# Archives in the complete/ of other flash drives (see nmea_storage.py) are
+# kept by full path; add_dir() adds such a directory to the reconciliation.
+# TokenBucket limits the upload rate shared by all FTP connections.
+#******************
+
+
+import logging
+import os
+import threading
+import time
+from nmea_codec import ARCHIVE_SUFFIXES
+
+
+JOURNAL_NAME = "transfer_queue.txt"
+
+
+class TokenBucket(object):
+   #rate in bytes/s; 0 disables the limit. burst is the number of bytes that
+   #may be sent at once after an idle period.
+   def __init__(self, rate, burst=None):
+      self.rate = rate
+      self.burst = burst if burst is not None else max(rate, 8192)
+      self.tokens = self.burst
+      self.stamp = time.monotonic()
+      self.lock = threading.Lock()
+
+   def consume(self, n):
+      #Take n bytes worth of tokens, sleeping while the bucket is in debt
+      if self.rate <= 0:
+         return
+      with self.lock:
+         now = time.monotonic()
+         self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+         self.stamp = now
+         self.tokens = self.tokens - n
+         wait = -self.tokens / self.rate if self.tokens < 0 else 0
+      if wait > 0:
+         time.sleep(wait)
+
+
+class TransferQueue(object):
+   #order is "oldest" (default) or "newest" first
+   def __init__(self, complete_dir, order="oldest"):
+      self.complete_dir = complete_dir
+      self.order = order
+      self.journal_path = os.path.join(complete_dir, JOURNAL_NAME)
+      #Directories reconciled by load(); the first holds the journal
+      self.dirs = [complete_dir]
+      self.entries = {}
+      self.lock = threading.Lock()
+      self.journal = None
+      #Moving average of the upload throughput (bytes/s) for the ETA
+      self.rate = 0.0
+
+   def load(self):
+      #Read the journal, reconcile it with the directory once and compact it
+      entries = {}
+      if os.path.isfile(self.journal_path):
+         with open(self.journal_path) as f:
+            for line in f:
+               parts = line.rstrip("\n").split("\t")
+               if parts[0] == "+" and len(parts) == 4:
+                  entries[parts[1]] = (int(parts[2]), float(parts[3]))
+               elif parts[0] == "-" and len(parts) == 2:
+                  entries.pop(parts[1], None)
+      for complete_dir in list(self.dirs):
+         entries.update(self.scan(complete_dir, entries))
+      for filename in list(entries):
+         if not os.path.isfile(os.path.join(self.complete_dir, filename)):
+            del entries[filename]
+      with self.lock:
+         #Archives added while the directory was being read
+         entries.update(self.entries)
+         self.entries = entries
+         tmp = self.journal_path + ".tmp"
+         with open(tmp, "w") as f:
+            for filename, (size, mtime) in entries.items():
+               f.write("+\t%s\t%d\t%.3f\n" % (filename, size, mtime))
+         os.replace(tmp, self.journal_path)
+         #load() runs again when the transfer thread is restarted
+         if self.journal is not None:
+            self.journal.close()
+         self.journal = open(self.journal_path, "a", 1)
+      logging.info("Transfer queue: " + str(len(entries)) + " files, " + str(self.backlog_bytes()) + " bytes")
+
+   def key(self, path):
+      #File name in the journal directory, full path elsewhere
+      if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.complete_dir):
+         return os.path.basename(path)
+      return os.path.abspath(path)
+
+   def scan(self, complete_dir, known):
+      #Archives in complete_dir that are not in known
+      found = {}
+      try:
+         filenames = os.listdir(complete_dir)
+      except OSError as e:
+         logging.info("Transfer queue: cannot read " + complete_dir + ": " + str(e))
+         return found
+      for filename in filenames:
+         key = self.key(os.path.join(complete_dir, filename))
+         if filename.endswith(ARCHIVE_SUFFIXES) and key not in known:
+            st = os.stat(os.path.join(complete_dir, filename))
+            found[key] = (st.st_size, st.st_mtime)
+      return found
+
+   def add_dir(self, complete_dir):
+      #complete/ of another volume: its archives are queued now and at every load()
+      if complete_dir in self.dirs:
+         return
+      self.dirs.append(complete_dir)
+      with self.lock:
+         known = dict(self.entries)
+      for key, (size, mtime) in self.scan(complete_dir, known).items():
+         with self.lock:
+            self.entries[key] = (size, mtime)
+            if self.journal is not None:
+               self.journal.write("+\t%s\t%d\t%.3f\n" % (key, size, mtime))
+
+   def add(self, path):
+      #A finished archive ready for upload
+      filename = self.key(path)
+      st = os.stat(path)
+      with self.lock:
+         self.entries[filename] = (st.st_size, st.st_mtime)
+         if self.journal is not None:
+            self.journal.write("+\t%s\t%d\t%.3f\n" % (filename, st.st_size, st.st_mtime))
+
+   def remove(self, path):
+      filename = self.key(path)
+      with self.lock:
+         if self.entries.pop(filename, None) is not None and self.journal is not None:
+            self.journal.write("-\t%s\n" % filename)
+
+   def pending(self):
+      #Paths to upload in policy order
+      with self.lock:
+         items = list(self.entries.items())
+      items.sort(key=lambda e: e[1][1], reverse=(self.order == "newest"))
+      out = []
+      for filename, entry in items:
+         #A full path for the archives of other volumes
+         path = os.path.join(self.complete_dir, filename)
+         if os.path.isfile(path):
+            out.append(path)
+         else:
+            self.remove(path)
+      return out
+
+   def backlog_bytes(self):
+      with self.lock:
+         return sum(e[0] for e in self.entries.values())
+
+   def record(self, nbytes, seconds):
+      #Update the throughput average with one upload; returns (rate, eta)
+      if seconds > 0 and nbytes > 0:
+         r = nbytes / seconds
+         self.rate = r if self.rate == 0 else 0.7 * self.rate + 0.3 * r
+      backlog = self.backlog_bytes()
+      eta = backlog / self.rate if self.rate > 0 else 0
+      return self.rate, eta
+
+   def close(self):
+      with self.lock:
+         if self.journal is not None:
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,92 @@
+#******************
+# NMEA Logger
+# Coordinated shutdown of the logger threads
+#******************
+# Every thread is started through Shutdown.start() under one of the stages
+# below and waits on or polls the Event of its stage instead of sleeping.
+# drain() stops the stages in order, each after the threads of the previous
+# one have finished, so data flows out of the pipeline before its consumers
+# stop:
+#   ingest     sources: the last sentences are written, the open files
+#              rotated into complete/
+#   archive    compression workers: finish the queued files
+#   transfer   FTP: an upload in progress is cut at the next block and
+#              resumed from there (REST) at the next start
+#   service    status LEDs, monitor, metrics
+# The whole drain is bounded by one timeout. Threads are daemons, so one that
+# is still running when the time is up does not keep the process alive; its
+# files are picked up at the next start like after a power loss.
+#******************
+
+
+import logging
+import threading
+import time
+
+
+INGEST = "ingest"
+ARCHIVE = "archive"
+TRANSFER = "transfer"
+SERVICE = "service"
+STAGES = (INGEST, ARCHIVE, TRANSFER, SERVICE)
+
+
+class Shutdown(object):
+   def __init__(self, stages=STAGES):
+      self.stages = stages
+      self.events = dict((stage, threading.Event()) for stage in stages)
+      #Set by request(); the stages are only stopped by drain()
+      self.requested = threading.Event()
+      self.reason = None
+      self.threads = dict((stage, []) for stage in stages)
+      self.lock = threading.Lock()
+
+   def start(self, stage, name, target, *args):
+      t = threading.Thread(target=target, args=args, name=name)
+      t.daemon = True
+      with self.lock:
+         self.threads[stage].append(t)
+      t.start()
+      return t
+
+   def stopping(self, stage=None):
+      #True once the stage has been told to stop; without a stage, once a
+      #shutdown has been requested
+      if stage is None:
+         return self.requested.is_set()
+      return self.events[stage].is_set()
+
+   def flag(self, stage):
+      #should_stop() callable for the stage
+      return self.events[stage].is_set
+
+   def wait(self, seconds, stage=None):
+      #Sleep that ends early when the stage stops; returns stopping(stage)
+      event = self.requested if stage is None else self.events[stage]
+      return event.wait(seconds)
+
+   def request(self, reason):
+      if not self.requested.is_set():
+         self.reason = reason
+         logging.info("Shutdown requested: " + reason)
+         self.requested.set()
+
+   def drain(self, timeout):
+      #Stop the stages in order within timeout seconds. Returns the names of
+      #the threads still running.
+      self.request("drain")
+      t0 = time.monotonic()
+      deadline = t0 + timeout
+      left = []
+      for stage in self.stages:
+         self.events[stage].set()
+         with self.lock:
+            threads = list(self.threads[stage])
+         for t in threads:
+            t.join(max(deadline - time.monotonic(), 0))
+            if t.is_alive():
+               left.append(t.name)
+         logging.info("Shutdown: " + stage + " stage done after " + str(round(time.monotonic() - t0, 2)) + " s")
+      if left:
+         logging.info("Shutdown: still running after " + str(timeout) + " s: " + ", ".join(left))
+      return left
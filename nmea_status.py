@@ -0,0 +1,183 @@
+#******************
+# NMEA Logger
+# Status LEDs driven by one controller thread
+#******************
+# Ingest threads (or their write stage, see nmea_pipeline.py) only update
+# counters and times in their SourceStatus, one per source name (plain
+# attribute writes, no locks, no GPIO). The controller reads them every
+# cadence seconds and plays one frame of FRAME steps per state:
+#   green  x.......   receiving, position and AIS/radar targets seen
+#   blue   x.......   receiving, no position for stale_sec
+#   blue   x.x.....   receiving, position ok, no AIS/radar for stale_sec
+#   red    x.x.....   no flash drive with free space left (see nmea_storage.py)
+#   green  ....xxxx   FTP transfer in progress
+# All LEDs stay dark while no data is received.
+# FakeGPIO stands in for RPi.GPIO off a Pi; it records the pin levels.
+#******************
+
+
+import logging
+import time
+
+
+RED = 21
+BLUE = 20
+GREEN = 26
+LEDS = (RED, BLUE, GREEN)
+FRAME = 8
+PATTERNS = {
+   "ok":          (GREEN, "x......."),
+   "no_position": (BLUE,  "x......."),
+   "no_targets":  (BLUE,  "x.x....."),
+   "disk_full":   (RED,   "x.x....."),
+   "transfer":    (GREEN, "....xxxx"),
+}
+
+
+class FakeGPIO(object):
+   #The parts of RPi.GPIO the logger uses
+   BCM = 11
+   OUT = 0
+   IN = 1
+   PUD_UP = 22
+   HIGH = 1
+   LOW = 0
+
+   def __init__(self):
+      self.levels = {}
+      self.inputs = {}
+      #(time, pin, level) of every output change
+      self.history = []
+
+   def setmode(self, mode):
+      pass
+
+   def setwarnings(self, flag):
+      pass
+
+   def setup(self, pin, direction, pull_up_down=None):
+      if direction == self.IN:
+         self.inputs.setdefault(pin, self.HIGH)
+
+   def output(self, pin, level):
+      self.levels[pin] = level
+      self.history.append((time.monotonic(), pin, level))
+
+   def input(self, pin):
+      return self.inputs.get(pin, self.HIGH)
+
+
+def load_gpio():
+   #RPi.GPIO on a Pi, the stand-in anywhere else
+   try:
+      import RPi.GPIO as GPIO
+      return GPIO
+   except (ImportError, RuntimeError):
+      logging.info("RPi.GPIO not available, using the GPIO stand-in")
+      return FakeGPIO()
+
+
+class SourceStatus(object):
+   #Each attribute has one writer, the reader or its write stage; times are epoch ms
+   def __init__(self, name):
+      self.name = name
+      self.lines = 0
+      self.errors = 0
+      self.ais_decoded = 0
+      #Sentences dropped by a full pipeline queue, see nmea_pipeline.py
+      self.dropped = 0
+      self.last_position = 0
+      self.last_target = 0
+
+
+class StatusController(object):
+   def __init__(self, gpio, cadence=0.25, stale_sec=600):
+      self.gpio = gpio
+      self.cadence = cadence
+      self.stale_sec = stale_sec
+      self.sources = []
+      #Set by the monitor and transfer threads
+      self.disk_full = False
+      self.transferring = False
+      self.levels = dict((pin, None) for pin in LEDS)
+      self.lines_seen = 0
+      self.current = []
+
+   def source(self, name):
+      #A source restarted by the supervisor keeps its counters
+      for st in self.sources:
+         if st.name == name:
+            return st
+      st = SourceStatus(name)
+      self.sources.append(st)
+      return st
+
+   def states(self, now_ms=None):
+      #Names of the active states, see PATTERNS
+      if now_ms is None:
+         now_ms = int(time.time() * 1000)
+      stale = now_ms - self.stale_sec * 1000
+      out = []
+      lines = sum(st.lines for st in self.sources)
+      if lines != self.lines_seen:
+         self.lines_seen = lines
+         if not any(st.last_position > stale for st in self.sources):
+            out.append("no_position")
+         elif not any(st.last_target > stale for st in self.sources):
+            out.append("no_targets")
+         else:
+            out.append("ok")
+      if self.disk_full:
+         out.append("disk_full")
+      if self.transferring:
+         out.append("transfer")
+      return out
+
+   def frame(self, states):
+      #Level of each LED for each step of a frame
+      steps = dict((pin, [False] * FRAME) for pin in LEDS)
+      for state in states:
+         pin, pattern = PATTERNS[state]
+         for i, c in enumerate(pattern):
+            if c == "x":
+               steps[pin][i] = True
+      return steps
+
+   def set(self, pin, on):
+      if self.levels[pin] != on:
+         self.gpio.output(pin, self.gpio.HIGH if on else self.gpio.LOW)
+         self.levels[pin] = on
+
+   def self_test(self):
+      #Two blinks of each LED at startup
+      for pin in (RED, BLUE, GREEN):
+         for i in range(2):
+            self.set(pin, True)
+            time.sleep(0.3)
+            self.set(pin, False)
+            time.sleep(0.15)
+
+   def run(self, should_stop):
+      self.self_test()
+      step = 0
+      steps = None
+      wake = time.monotonic()
+      while not should_stop():
+         if step == 0:
+            states = self.states()
+            if states != self.current:
+               logging.info("Status: " + (", ".join(states) if states else "no data"))
+            self.current = states
+            steps = self.frame(states)
+         for pin in LEDS:
+            self.set(pin, steps[pin][step])
+         step = (step + 1) % FRAME
+         #Fixed cadence, however long the GPIO calls took
+         wake = wake + self.cadence
+         delay = wake - time.monotonic()
+         if delay > 0:
+            time.sleep(delay)
+         else:
+            wake = time.monotonic()
+      for pin in LEDS:
+         self.set(pin, False)
@@ -0,0 +1,225 @@
+#******************
+# NMEA Logger
+# Storage manager: free space of the flash drives, spill-over and retention
+#******************
+# The flash drive the logger started on is the first Volume, with its own
+# complete/ and transferred/ directories. Only with spill (storage_spill=1,
+# off by default) is every other writable directory under the media root
+# write-tested, given complete/ and transferred/ and used as a further
+# volume, in name order. Free space is read with statvfs and cached for
+# refresh_sec seconds.
+# SourceLog asks select() for a volume when it opens a file, so new files
+# go to the first volume with room: a volume is full below low_pct % free
+# and only used again above high_pct %, so the logger does not flip between
+# two drives at the limit. When every volume is full the one with the most
+# free space is used and disk_full is reported; capture goes on as long as
+# anything can be written.
+# check(), run by the storage thread every check_sec seconds, refreshes the
+# free space, picks up flash drives mounted since, and evicts files from
+# transferred/ (already uploaded, oldest first): all files older than
+# retention_days, and on a volume below low_pct % free as many as it takes
+# to get back above high_pct %. Files in complete/ that are still waiting
+# for upload are never evicted.
+#******************
+
+
+import logging
+import os
+import threading
+import time
+
+
+class Volume(object):
+   def __init__(self, name, path):
+      self.name = name
+      #Ends with "/", like the flashdrive paths of the logger
+      self.path = path
+      self.complete = path + "complete"
+      self.transferred = path + "transferred"
+      self.free = 0
+      self.total = 0
+      self.checked = 0
+      #Set below low_pct % free, cleared above high_pct %
+      self.full = False
+
+   def refresh(self):
+      st = os.statvfs(self.path)
+      self.free = st.f_bavail * st.f_frsize
+      self.total = st.f_blocks * st.f_frsize
+      self.checked = time.monotonic()
+
+   def free_pct(self):
+      return 100.0 * self.free / self.total if self.total else 0.0
+
+
+def prepare_volume(path):
+   #True if a test file can be written and read back in path; also creates
+   #complete/ and transferred/
+   ofil = os.path.join(path, "testnmeaout.txt")
+   try:
+      with open(ofil, "w") as f:
+         f.write("test")
+      with open(ofil) as f:
+         ok = f.read() == "test"
+      os.remove(ofil)
+      if not ok:
+         return False
+      for sub in ("complete", "transferred"):
+         if not os.path.exists(os.path.join(path, sub)):
+            os.makedirs(os.path.join(path, sub))
+      return True
+   except OSError:
+      logging.info(os.path.basename(path) + " is not writable")
+      return False
+
+
+def find_volumes(media_root, limit=None):
+   #Names of the writable volumes under media_root, in name order; stops
+   #after limit volumes, so the others are not touched
+   try:
+      names = sorted(os.listdir(media_root))
+   except OSError:
+      return []
+   found = []
+   for name in names:
+      if limit is not None and len(found) >= limit:
+         break
+      if os.path.isdir(media_root + name) and prepare_volume(media_root + name):
+         found.append(name)
+   return found
+
+
+class StorageManager(object):
+   def __init__(self, media_root, primary, spill=False, low_pct=10, high_pct=15, retention_days=0, refresh_sec=30):
+      self.media_root = media_root
+      self.spill = spill
+      self.low_pct = low_pct
+      self.high_pct = max(high_pct, low_pct)
+      self.retention_days = retention_days
+      self.refresh_sec = refresh_sec
+      self.lock = threading.Lock()
+      self.volumes = [Volume(primary, media_root + primary + "/")]
+      self.active = self.volumes[0]
+      #Called with each volume found after startup
+      self.on_added = None
+      #Names that failed the write test, not tested again
+      self.rejected = set()
+      self.evicted_files = 0
+      self.evicted_bytes = 0
+      if spill:
+         self.scan()
+      for v in self.volumes:
+         self.update(v)
+
+   def scan(self):
+      #Add volumes mounted since the last scan; returns the new ones
+      try:
+         names = sorted(os.listdir(self.media_root))
+      except OSError:
+         return []
+      known = set(v.name for v in self.volumes) | self.rejected
+      added = []
+      for name in names:
+         if name in known or not os.path.isdir(self.media_root + name):
+            continue
+         if not prepare_volume(self.media_root + name):
+            self.rejected.add(name)
+            continue
+         v = Volume(name, self.media_root + name + "/")
+         added.append(v)
+         logging.info("Storage: volume " + name + " added")
+      if added:
+         with self.lock:
+            self.volumes = self.volumes + added
+      return added
+
+   def update(self, v):
+      #Refresh the free space of v and its full flag
+      try:
+         v.refresh()
+      except OSError as e:
+         #Unplugged: the volume is not chosen again until it is back
+         logging.info("Storage: cannot read " + v.name + ": " + str(e))
+         v.free = 0
+         v.full = True
+         return
+      pct = v.free_pct()
+      if not v.full and pct < self.low_pct:
+         v.full = True
+         logging.info("Storage: " + v.name + " below " + str(self.low_pct) + "% free")
+      elif v.full and pct >= self.high_pct:
+         v.full = False
+         logging.info("Storage: " + v.name + " back above " + str(self.high_pct) + "% free")
+
+   def select(self):
+      #Flash drive path for a new file
+      with self.lock:
+         volumes = self.volumes
+      now = time.monotonic()
+      for v in volumes:
+         if now - v.checked >= self.refresh_sec:
+            self.update(v)
+      chosen = None
+      for v in volumes:
+         if not v.full:
+            chosen = v
+            break
+      if chosen is None:
+         chosen = max(volumes, key=lambda v: v.free)
+      if chosen is not self.active:
+         logging.info("Storage: new files go to " + chosen.name + " (" + str(round(chosen.free_pct(), 1)) + "% free)")
+         self.active = chosen
+      return chosen.path
+
+   def disk_full(self):
+      return all(v.full for v in self.volumes)
+
+   def check(self):
+      #Run by the storage thread: new volumes, free space, eviction
+      if self.spill:
+         for v in self.scan():
+            if self.on_added is not None:
+               self.on_added(v)
+      for v in self.volumes:
+         self.update(v)
+         if not os.path.isdir(v.transferred):
+            continue
+         if self.retention_days > 0:
+            self.evict(v, max_age=self.retention_days * 86400)
+         if v.total and v.free_pct() < self.low_pct:
+            self.evict(v, need=self.high_pct * v.total / 100.0 - v.free)
+            self.update(v)
+
+   def evict(self, v, max_age=None, need=None):
+      #Remove files from transferred/, oldest first: those older than max_age
+      #seconds, or until need bytes are freed
+      files = []
+      for filename in os.listdir(v.transferred):
+         path = os.path.join(v.transferred, filename)
+         try:
+            st = os.stat(path)
+         except OSError:
+            continue
+         files.append((st.st_mtime, st.st_size, path))
+      files.sort()
+      cutoff = time.time() - max_age if max_age is not None else None
+      freed = 0
+      count = 0
+      for mtime, size, path in files:
+         if cutoff is not None and mtime >= cutoff:
+            break
+         if need is not None and freed >= need:
+            break
+         try:
+            os.remove(path)
+         except OSError as e:
+            logging.info("Storage: could not evict " + path + ": " + str(e))
+            continue
+         freed = freed + size
+         count = count + 1
+      if count:
+         self.evicted_files = self.evicted_files + count
+         self.evicted_bytes = self.evicted_bytes + freed
+         reason = "older than " + str(self.retention_days) + " days" if max_age is not None else "to free space"
+         logging.info("Storage: evicted " + str(count) + " transferred files (" + str(freed) + " bytes) from " + v.name + ", " + reason)
+      return freed
@@ -0,0 +1,95 @@
+#******************
+# NMEA Logger
+# Supervised worker threads: restart with exponential backoff and jitter
+#******************
+# Supervisor extends the staged Shutdown (see nmea_shutdown.py). A worker
+# started with supervise() is run again when it raises or returns while its
+# stage is still running, after a delay that doubles with every restart up
+# to backoff_max seconds. Each delay is cut by a random part of up to jitter,
+# so workers failing on the same cause (a USB hub reset, the network going
+# down) do not all retry at the same moment. A worker that ran stable_sec
+# seconds before failing starts again from backoff_base.
+# The backoff waits on the stage Event, so a shutdown is not held up by a
+# worker waiting to restart. Restarts and uptime per worker are kept in
+# Worker for the metrics.
+# start() still runs a thread once, for work that finishes (file recovery).
+#******************
+
+
+import logging
+import random
+import time
+from nmea_shutdown import Shutdown, STAGES
+
+
+class Backoff(object):
+   #Delays base, base*factor, base*factor^2, ... up to cap, each reduced by
+   #a random fraction of up to jitter
+   def __init__(self, base=1.0, cap=300.0, factor=2.0, jitter=0.5):
+      self.base = base
+      self.cap = cap
+      self.factor = factor
+      self.jitter = jitter
+      self.attempt = 0
+
+   def next(self):
+      delay = min(self.cap, self.base * self.factor ** self.attempt)
+      self.attempt = self.attempt + 1
+      return delay * (1 - self.jitter * random.random())
+
+   def reset(self):
+      self.attempt = 0
+
+
+class Worker(object):
+   #State of one supervised worker; times are epoch seconds
+   def __init__(self, name, stage):
+      self.name = name
+      self.stage = stage
+      self.up = False
+      self.started = 0
+      self.restarts = 0
+      self.last_error = None
+
+   def uptime(self):
+      #Seconds since the last (re)start, 0 while waiting to restart
+      return time.time() - self.started if self.up else 0
+
+
+class Supervisor(Shutdown):
+   def __init__(self, stages=STAGES, backoff_base=1.0, backoff_max=300.0, stable_sec=60):
+      Shutdown.__init__(self, stages)
+      self.backoff_base = backoff_base
+      self.backoff_max = backoff_max
+      self.stable_sec = stable_sec
+      self.workers = []
+
+   def supervise(self, stage, name, target, *args):
+      worker = Worker(name, stage)
+      with self.lock:
+         self.workers.append(worker)
+      return self.start(stage, name, self._run, worker, target, args)
+
+   def _run(self, worker, target, args):
+      backoff = Backoff(self.backoff_base, self.backoff_max)
+      while not self.stopping(worker.stage):
+         worker.started = time.time()
+         worker.up = True
+         try:
+            target(*args)
+            if self.stopping(worker.stage):
+               break
+            worker.last_error = "returned"
+            logging.info("Worker " + worker.name + " returned while running")
+         except Exception as e:
+            worker.last_error = str(e)
+            logging.exception("Worker " + worker.name + " failed")
+         worker.up = False
+         if time.time() - worker.started >= self.stable_sec:
+            backoff.reset()
+         delay = backoff.next()
+         worker.restarts = worker.restarts + 1
+         logging.info("Restarting " + worker.name + " in " + str(round(delay, 1)) + " s (restart " + str(worker.restarts) + ")")
+         if self.wait(delay, worker.stage):
+            break
+      worker.up = False
@@ -0,0 +1,54 @@
+#******************
+# NMEA Logger
+# Cached timestamp prefix for logged lines
+#******************
+# Time is read from the monotonic clock anchored to the wall clock, and
+# re-anchored every resync_sec so clock corrections (GPS, NTP) are picked up.
+# The date/time part of the prefix is formatted once per second; per call
+# only the milliseconds are added from a lookup table.
+#   utc     20200101-000000.000 UTC,      (default, as always written)
+#   epoch   1577836800.000,               (timestamp_format=epoch)
+#******************
+
+
+import time
+
+
+FORMATS = ("utc", "epoch")
+_UTC_MS = ["%03d UTC," % ms for ms in range(1000)]
+_EPOCH_MS = ["%03d," % ms for ms in range(1000)]
+
+
+class Timestamper(object):
+   def __init__(self, fmt="utc", resync_sec=60):
+      if fmt not in FORMATS:
+         raise ValueError("timestamp format must be utc or epoch")
+      self.epoch = fmt == "epoch"
+      self.suffixes = _EPOCH_MS if self.epoch else _UTC_MS
+      self.resync_sec = resync_sec
+      self.second = None
+      self.prefix = ""
+      self.anchor()
+
+   def anchor(self):
+      self.wall = time.time()
+      self.mono = time.monotonic()
+
+   def now_ms(self):
+      #Wall clock time in epoch milliseconds
+      mono = time.monotonic()
+      if mono - self.mono >= self.resync_sec:
+         self.anchor()
+      return int((self.wall + (mono - self.mono)) * 1000)
+
+   def stamp(self):
+      #(epoch ms, line prefix) for the current time
+      ms = self.now_ms()
+      second = ms // 1000
+      if second != self.second:
+         self.second = second
+         if self.epoch:
+            self.prefix = str(second) + "."
+         else:
+            self.prefix = time.strftime("%Y%m%d-%H%M%S.", time.gmtime(second))
+      return ms, self.prefix + self.suffixes[ms % 1000]
@@ -0,0 +1,90 @@
+#******************
+# NMEA Logger
+# Batched output file writer
+#******************
+# Records are collected in memory and written with one write() call when
+# buffer_bytes have accumulated or the oldest unwritten record is flush_sec
+# old, instead of one write per sentence. fsync_sec > 0 also forces the data
+# to the flash drive at that interval; with 0 it is only synced at rollover
+# and close. At most flush_sec of data is lost if the logger is killed, at
+# most fsync_sec (or a whole file) on a power loss. close() always writes and
+# syncs everything, so an orderly shutdown loses nothing.
+# on_sync(offset), if set, is called after every fsync with the size of the
+# file now on the drive; it always ends on a record boundary.
+# [General] write_buffer_kb, write_flush_sec and fsync_sec set the values.
+#******************
+
+
+import os
+import time
+
+
+class BatchWriter(object):
+   def __init__(self, path, buffer_bytes=65536, flush_sec=1.0, fsync_sec=0):
+      self.path = path
+      self.buffer_bytes = buffer_bytes
+      self.flush_sec = flush_sec
+      self.fsync_sec = fsync_sec
+      self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+      #Bytes in the file plus bytes buffered
+      self.pos = os.fstat(self.fd).st_size
+      self.buf = bytearray()
+      self.since = 0.0
+      self.last_sync = time.monotonic()
+      self.closed = False
+      self.writes = 0
+      self.syncs = 0
+      self.on_sync = None
+
+   def write(self, data):
+      #data is str (encoded as utf-8) or bytes
+      if isinstance(data, str):
+         data = data.encode("utf-8")
+      if not self.buf:
+         self.since = time.monotonic()
+      self.buf += data
+      self.pos = self.pos + len(data)
+      if len(self.buf) >= self.buffer_bytes or time.monotonic() - self.since >= self.flush_sec:
+         self.drain()
+
+   def drain(self):
+      #Write the buffer, then sync if fsync_sec has passed
+      view = memoryview(self.buf)
+      done = 0
+      while done < len(view):
+         done = done + os.write(self.fd, view[done:])
+         self.writes = self.writes + 1
+      view.release()
+      del self.buf[:]
+      if self.fsync_sec > 0 and time.monotonic() - self.last_sync >= self.fsync_sec:
+         self.sync()
+
+   def poll(self):
+      #Time based flush for when no records arrive
+      if self.buf and time.monotonic() - self.since >= self.flush_sec:
+         self.drain()
+
+   def flush(self):
+      if self.buf:
+         self.drain()
+
+   def sync(self):
+      os.fsync(self.fd)
+      self.syncs = self.syncs + 1
+      self.last_sync = time.monotonic()
+      if self.on_sync is not None:
+         self.on_sync(self.pos - len(self.buf))
+
+   def tell(self):
+      return self.pos
+
+   def fileno(self):
+      return self.fd
+
+   def close(self):
+      if self.closed:
+         return
+      self.flush()
+      self.sync()
+      os.close(self.fd)
+      self.closed = True
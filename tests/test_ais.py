@@ -0,0 +1,56 @@
+from nmea_ais import AisDecoder, Position, Static, payload_bits
+from nmea_benchmark import armor, checksum
+
+
+TYPE1 = "!AIVDM,1,1,,B,177KQJ5000G?tO`K>RA1wUbN0TKH,0*5C"
+TYPE5 = ("!AIVDM,2,1,1,A,55?MbV02;H;s<HtKR20EHE:0@T4@Dn2222222216L961O5Gf0NSQEp6ClRp8,0*1C",
+   "!AIVDM,2,2,1,A,88888888880,2*25")
+
+
+def vdm(bits):
+   payload, fill = armor(bits)
+   body = "AIVDM,1,1,,A," + payload + "," + str(fill)
+   return "!" + body + "*" + checksum(body)
+
+
+def type5_bits():
+   payload = TYPE5[0].split(",")[5] + TYPE5[1].split(",")[5]
+   return payload_bits(payload, 2)
+
+
+def test_position_report():
+   rec = AisDecoder().feed(TYPE1)
+   assert rec == Position(1, 477553000, 47.58283333333333, -122.34583333333333, 0.0, 51.0, 181, 15, 5)
+
+
+def test_static_report_in_two_fragments():
+   decoder = AisDecoder()
+   assert decoder.feed(TYPE5[0], 0.0) is None
+   rec = decoder.feed(TYPE5[1], 0.5)
+   assert rec == Static(5, 351759000, "EVER DIADEM", "3FOF8", 70, 9134270, "NEW YORK", 225, 70, 1, 31)
+   assert decoder.errors == 0
+
+
+def test_short_static_report():
+   #424 bits cut to 420: the last character of the destination is lost
+   bits = type5_bits()
+   assert len(bits) == 424
+   decoder = AisDecoder()
+   for n in (420, 421):
+      rec = decoder.feed(vdm(bits[:n]))
+      assert rec.mmsi == 351759000
+      assert rec.destination == "NEW YORK"
+   assert decoder.errors == 0
+
+
+def test_bad_sentences_are_counted():
+   decoder = AisDecoder()
+   assert decoder.feed(TYPE1[:-2] + "00") is None
+   #X is outside the armoring alphabet
+   body = "AIVDM,1,1,,A,1X,0"
+   assert decoder.feed("!" + body + "*" + checksum(body)) is None
+   assert decoder.errors == 2
+   assert decoder.feed(vdm("0001")) is None
+   assert decoder.unsupported == 1
+   assert decoder.feed(TYPE5[1], 1.0) is None
+   assert decoder.errors == 2
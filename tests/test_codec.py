@@ -0,0 +1,23 @@
+import gzip
+import time
+
+from nmea_codec import CompressedWriter, complete_length
+
+
+def test_member_synced_at_flush(tmp_path):
+   path = str(tmp_path / "a.dat.gz")
+   out = CompressedWriter(path, "gzip", flush_sec=60, fsync_sec=0)
+   out.write("$GPGGA,1*00\n")
+   out.flush()
+   assert out.raw.syncs == 1
+   #Nothing new: no member to finish, no sync
+   out.flush()
+   assert out.raw.syncs == 1
+   out.write("$GPGGA,2*00\n")
+   out.last_flush = time.monotonic() - 60
+   out.poll()
+   assert out.raw.syncs == 2
+   assert complete_length(path, "gzip") == out.raw.tell()
+   out.close()
+   with gzip.open(path, "rt") as f:
+      assert f.read() == "$GPGGA,1*00\n$GPGGA,2*00\n"
@@ -0,0 +1,39 @@
+from nmea_ais import decode, payload_bits
+from nmea_benchmark import armor, checksum, uint
+from nmea_dedup import AisThrottle, payload_key
+
+
+def report(mmsi, status=0, repeat=0):
+   #Class A position report with the given navigation status
+   bits = (uint(1, 6) + uint(repeat, 2) + uint(mmsi, 30) + uint(status, 4) + uint(-128, 8) +
+      uint(0, 10) + uint(0, 1) + uint(0, 28) + uint(0, 27) + uint(0, 12) + uint(511, 9) +
+      uint(0, 6) + uint(0, 2) + uint(0, 3) + uint(0, 1) + uint(0, 19))
+   return armor(bits)[0]
+
+
+def vdm(payload):
+   body = "AIVDM,1,1,,A," + payload + ",0"
+   return "!" + body + "*" + checksum(body)
+
+
+def test_known_payloads():
+   assert payload_key("177KQJ5000G?tO`K>RA1wUbN0TKH") == (477553000, 1)
+   assert payload_key("15M67FC000G?ufbE`FepT@3n00Sa") == (366053209, 1)
+
+
+def test_matches_decoder():
+   for mmsi in (503123456, 235000001, 1, 999999999, 272939526):
+      for status in (0, 5, 15):
+         for repeat in (0, 3):
+            payload = report(mmsi, status, repeat)
+            assert payload_key(payload) == (mmsi, 1)
+            assert decode(payload_bits(payload)).mmsi == mmsi
+
+
+def test_throttle_per_vessel():
+   #MMSIs 2^28 apart and different navigation status are different vessels
+   t = AisThrottle(min_interval=10)
+   assert t.accept(vdm(report(235000001, 0)), 0.0)
+   assert t.accept(vdm(report(235000001 + (1 << 28), 0)), 0.1)
+   assert not t.accept(vdm(report(235000001, 5)), 0.2)
+   assert t.accept(vdm(report(235000001, 5)), 10.5)
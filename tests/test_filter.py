@@ -0,0 +1,52 @@
+from nmea_filter import SentenceFilter, sentence_address
+
+
+GGA = "$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47"
+GNGGA = "$GNGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*59"
+GSV = "$GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,010,00,13,06,292,00*74"
+VDM = "!AIVDM,1,1,,B,177KQJ5000G?tO`K>RA1wUbN0TKH,0*5C"
+HDT = "$HEHDT,274.07,T*03"
+
+
+def test_address():
+   assert sentence_address(GGA) == "GPGGA"
+   assert sentence_address(VDM) == "AIVDM"
+   assert sentence_address("\\s:r3669961,c:1241544035*4A\\" + VDM) == "AIVDM"
+   assert sentence_address("$GPTXT*00") == "GPTXT"
+   assert sentence_address("noise") is None
+
+
+def test_type_any_talker():
+   sf = SentenceFilter("GGA,*VDM")
+   assert sf.accepts(GGA) and sf.accepts(GNGGA) and sf.accepts(VDM)
+   assert not sf.accepts(GSV)
+   #GGA in the payload is not the address
+   assert not sf.accepts("!AIVDO,1,1,,B,GGA,0*00")
+
+
+def test_talker_prefix_and_deny():
+   sf = SentenceFilter("GP*,-GPGSV")
+   assert sf.accepts(GGA)
+   assert not sf.accepts(GSV)
+   assert not sf.accepts(GNGGA)
+   assert not sf.accepts(VDM)
+   #Only deny entries: everything else passes
+   sf = SentenceFilter("-GPGSV")
+   assert sf.accepts(HDT) and not sf.accepts(GSV)
+
+
+def test_wildcards_and_exact():
+   sf = SentenceFilter("G?GGA, $HEHDT, !AIVD[MO]")
+   assert sf.accepts(GGA) and sf.accepts(GNGGA) and sf.accepts(HDT) and sf.accepts(VDM)
+   assert not sf.accepts(GSV)
+   assert not sf.accepts("$GPHDT,274.07,T*1B")
+   sf = SentenceFilter("*")
+   assert sf.accepts(GSV) and not sf.accepts("noise")
+
+
+def test_accepts_address_cached():
+   sf = SentenceFilter("GGA")
+   assert sf.accepts_address("GPGGA")
+   assert not sf.accepts_address("GPGSV")
+   assert sf.cache == {"GPGGA": True, "GPGSV": False}
+   assert sf.accepts(GGA) and not sf.accepts(GSV)
@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("pyftpdlib")
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+
+from nmea_ftp import FtpUploader
+
+
+@pytest.fixture
+def server(tmp_path):
+   #FTP server on a free local port, serving tmp_path/root
+   root = tmp_path / "root"
+   (root / "vessel").mkdir(parents=True)
+   authorizer = DummyAuthorizer()
+   authorizer.add_user("pi", "secret", str(root), perm="elradfmwMT")
+   handler = type("Handler", (FTPHandler,), {"authorizer": authorizer})
+   ftpd = FTPServer(("127.0.0.1", 0), handler)
+   thread = threading.Thread(target=ftpd.serve_forever, kwargs={"timeout": 0.05})
+   thread.daemon = True
+   thread.start()
+   yield ftpd.address[1], root / "vessel"
+   ftpd.close_all()
+   thread.join(5)
+
+
+def archive(tmp_path, size=1 << 20):
+   path = tmp_path / "20261018_120000_GPS.zip"
+   path.write_bytes(os.urandom(size))
+   return str(path)
+
+
+def settled(path):
+   #Size of a remote file once the server has stopped writing to it
+   last = -1
+   while os.path.getsize(path) != last:
+      last = os.path.getsize(path)
+      time.sleep(0.2)
+   return last
+
+
+class StopAfter(object):
+   #should_stop() that turns true after n calls, i.e. n blocks into an upload.
+   #Waits a moment first so the server has stored the blocks sent: dropping
+   #the control connection also discards what it has not read yet.
+   def __init__(self, n):
+      self.n = n
+
+   def __call__(self):
+      self.n = self.n - 1
+      if self.n == -1:
+         time.sleep(0.5)
+      return self.n < 0
+
+
+def test_resume_partial_upload(server, tmp_path):
+   port, remote = server
+   path = archive(tmp_path)
+   data = open(path, "rb").read()
+   (remote / os.path.basename(path)).write_bytes(data[:300000])
+   done = []
+   uploader = FtpUploader("127.0.0.1", "pi", "secret", "/vessel", 1, port=port)
+   uploader.upload([path], lambda p, nbytes, seconds: done.append((p, nbytes)))
+   uploader.close()
+   assert done == [(path, len(data) - 300000)]
+   assert (remote / os.path.basename(path)).read_bytes() == data
+
+
+def test_interrupted_upload_resumes(server, tmp_path):
+   port, remote = server
+   path = archive(tmp_path)
+   data = open(path, "rb").read()
+   done = []
+   on_done = lambda p, nbytes, seconds: done.append((p, nbytes))
+   uploader = FtpUploader("127.0.0.1", "pi", "secret", "/vessel", 1, port=port)
+   uploader.upload([path], on_done, StopAfter(20))
+   #Cut for shutdown: nothing reported, the session is not kept
+   assert done == []
+   assert uploader.sessions == [None]
+   partial = settled(str(remote / os.path.basename(path)))
+   assert 0 < partial < len(data)
+
+   uploader.upload([path], on_done)
+   uploader.close()
+   assert done == [(path, len(data) - partial)]
+   assert (remote / os.path.basename(path)).read_bytes() == data
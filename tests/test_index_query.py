@@ -0,0 +1,101 @@
+import io
+import os
+from nmea_ais import AisDecoder
+from nmea_archiver import Archiver
+from nmea_benchmark import synthetic_sentences
+from nmea_codec import CompressedWriter
+from nmea_filter import sentence_address
+from nmea_index import FileIndex, load_index
+from nmea_query import Query, query_file, stamp
+from nmea_writer import BatchWriter
+
+
+START_MS = 1577836800000
+
+
+def write_rollover(directory, sentences, codec):
+   #Logs sentences the way SourceLog does with index_files=1 and rotates
+   #the file into complete/; returns the path of the index
+   complete = os.path.join(directory, "complete")
+   os.makedirs(complete, exist_ok=True)
+   name = "20200101-000000-test.dat" + {"none": "", "gzip": ".gz"}[codec]
+   path = os.path.join(directory, name)
+   index = FileIndex("test")
+   index.stream(name)
+   if codec == "none":
+      out = BatchWriter(path)
+   else:
+      out = CompressedWriter(path, codec, flush_sec=0)
+      out.on_block = lambda start, end: index.block(name, start, end)
+   text_start = 0
+   for i, sentence in enumerate(sentences):
+      ms = START_MS + i * 50
+      index.add(ms, sentence_address(sentence) or "", sentence)
+      out.write(stamp(ms) + sentence + "\n")
+      if codec == "none" and i % 500 == 499:
+         index.block(name, text_start, out.tell())
+         text_start = out.tell()
+      elif codec != "none" and i % 500 == 499:
+         out.flush()
+   if codec == "none":
+      index.block(name, text_start, out.tell())
+   out.close()
+   os.replace(path, os.path.join(complete, name))
+   idx = os.path.join(complete, "20200101-000000-test.idx")
+   index.save(idx)
+   if codec == "none":
+      Archiver(complete, "dat").compress(os.path.join(complete, name))
+   return idx
+
+
+def vessel_sentences(sentences, mmsi):
+   #Sentences of the messages nmea_ais decodes to mmsi, all fragments
+   decoder = AisDecoder()
+   pending = []
+   out = []
+   for sentence in sentences:
+      if not sentence_address(sentence).endswith("VDM"):
+         continue
+      pending.append(sentence)
+      rec = decoder.feed(sentence)
+      f = sentence.split(",")
+      if rec is not None and rec.mmsi == mmsi:
+         out.extend(pending)
+      if f[1] == f[2]:
+         pending = []
+   return out
+
+
+def run_query(idx, mmsi):
+   doc = load_index(idx)
+   query = Query(mmsi=[mmsi])
+   counts = {"files": 0, "matched": 0, "blocks": 0, "read": 0, "rows": 0}
+   out = io.StringIO()
+   if query.wants_file(doc):
+      query_file(query, os.path.dirname(idx), doc, out, counts)
+   return [line.split(" UTC,", 1)[1] for line in out.getvalue().splitlines()]
+
+
+def check_round_trip(tmp_path, codec):
+   sentences = synthetic_sentences(3000)
+   idx = write_rollover(str(tmp_path), sentences, codec)
+   decoder = AisDecoder()
+   vessels = set()
+   for sentence in sentences:
+      rec = decoder.feed(sentence)
+      if rec is not None:
+         vessels.add(rec.mmsi)
+   assert set(load_index(idx)["mmsi"]) == vessels
+   for mmsi in sorted(vessels)[:5]:
+      expected = vessel_sentences(sentences, mmsi)
+      assert expected
+      assert run_query(idx, mmsi) == expected
+   assert run_query(idx, 100000000) == []
+
+
+def test_round_trip_zipped_text(tmp_path):
+   check_round_trip(tmp_path, "none")
+
+
+def test_round_trip_gzip(tmp_path):
+   check_round_trip(tmp_path, "gzip")
@@ -0,0 +1,30 @@
+import pytest
+
+from nmea_benchmark import checksum
+from nmea_position import ChecksumError, checksum_ok, parse_position
+
+
+GGA = "$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47"
+
+
+def test_checksum():
+   assert checksum_ok(GGA)
+   assert not checksum_ok(GGA[:-2] + "48")
+   assert not checksum_ok(GGA[:-3])
+   assert checksum_ok("\\s:r3669961,c:1241544035*4A\\" + GGA)
+   #Longer than any NMEA 0183 sentence, e.g. behind a long tag block
+   body = "GPTXT," + "A" * 200
+   assert checksum_ok("$" + body + "*" + checksum(body))
+   assert not checksum_ok("$" + body + "B*" + checksum(body))
+
+
+def test_parse_position():
+   lat, lon = parse_position(GGA)
+   assert lat == pytest.approx(48.1173)
+   assert lon == pytest.approx(11.516666666)
+   body = "GNRMC,123519,A,3351.000,S,15112.000,W,0.0,0.0,181026,,"
+   assert parse_position("$" + body + "*" + checksum(body)) == pytest.approx((-33.85, -151.2))
+   body = "GPGLL,4807.038,N,01131.000,E,123519,V"
+   assert parse_position("$" + body + "*" + checksum(body)) is None
+   with pytest.raises(ChecksumError):
+      parse_position(GGA[:-2] + "00")
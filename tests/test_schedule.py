@@ -0,0 +1,23 @@
+from nmea_schedule import TransferQueue
+
+
+def test_reload_closes_journal(tmp_path):
+   #The transfer thread loads the queue again on every restart
+   (tmp_path / "a.zip").write_bytes(b"x" * 10)
+   queue = TransferQueue(str(tmp_path))
+   queue.load()
+   first = queue.journal
+   queue.load()
+   assert first.closed
+   assert not queue.journal.closed
+   (tmp_path / "b.zip").write_bytes(b"y" * 20)
+   queue.add(str(tmp_path / "b.zip"))
+   #Uploaded and moved out of complete/
+   queue.remove(str(tmp_path / "a.zip"))
+   (tmp_path / "a.zip").unlink()
+   queue.close()
+   queue = TransferQueue(str(tmp_path))
+   queue.load()
+   assert queue.pending() == [str(tmp_path / "b.zip")]
+   assert queue.backlog_bytes() == 20
+   queue.close()
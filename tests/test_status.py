@@ -0,0 +1,81 @@
+import time
+
+from nmea_status import FakeGPIO, StatusController, BLUE, GREEN, RED, LEDS
+
+
+NOW = 1760000000000
+
+
+def levels(gpio, pin):
+   return [level for t, p, level in gpio.history if p == pin]
+
+
+def steps(frame, pin):
+   return "".join("x" if on else "." for on in frame[pin])
+
+
+class StopAfter(object):
+   def __init__(self, n):
+      self.n = n
+
+   def __call__(self):
+      self.n = self.n - 1
+      return self.n < 0
+
+
+def test_states():
+   status = StatusController(FakeGPIO(), stale_sec=600)
+   st = status.source("gps")
+   #Idle: nothing received, all LEDs dark
+   assert status.states(NOW) == []
+   assert all(steps(status.frame([]), pin) == "........" for pin in LEDS)
+   #Logging, without and with positions and targets
+   st.lines = 10
+   assert status.states(NOW) == ["no_position"]
+   st.lines = 20
+   st.last_position = NOW - 1000
+   assert status.states(NOW) == ["no_targets"]
+   st.lines = 30
+   st.last_target = NOW - 1000
+   assert status.states(NOW) == ["ok"]
+   #Targets older than stale_sec
+   st.lines = 40
+   assert status.states(NOW + 601000) == ["no_position"]
+   #Nothing new since the last frame
+   assert status.states(NOW) == []
+   #Uploading and storage error
+   status.transferring = True
+   status.disk_full = True
+   st.lines = 50
+   assert status.states(NOW) == ["ok", "disk_full", "transfer"]
+   assert status.source("gps") is st
+
+
+def test_frames():
+   status = StatusController(FakeGPIO())
+   frame = status.frame(["ok", "transfer"])
+   assert steps(frame, GREEN) == "x...xxxx"
+   assert steps(frame, BLUE) == "........"
+   frame = status.frame(["no_targets", "disk_full"])
+   assert steps(frame, BLUE) == "x.x....."
+   assert steps(frame, RED) == "x.x....."
+   assert steps(frame, GREEN) == "........"
+
+
+def test_run_drives_pins(monkeypatch):
+   monkeypatch.setattr(time, "sleep", lambda s: None)
+   gpio = FakeGPIO()
+   status = StatusController(gpio, cadence=0)
+   st = status.source("gps")
+   st.lines = 1
+   st.last_position = st.last_target = int(time.time() * 1000)
+   status.transferring = True
+   status.disk_full = True
+   #One frame after the self test
+   status.run(StopAfter(8))
+   #Self test: two blinks per LED, then green x...xxxx and red x.x.....
+   assert levels(gpio, GREEN) == [1, 0, 1, 0] + [1, 0, 1, 0]
+   assert levels(gpio, RED) == [1, 0, 1, 0] + [1, 0, 1, 0]
+   assert levels(gpio, BLUE) == [1, 0, 1, 0]
+   assert status.current == ["ok", "disk_full", "transfer"]
+   assert all(gpio.levels[pin] == gpio.LOW for pin in LEDS)
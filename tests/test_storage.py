@@ -0,0 +1,27 @@
+import os
+
+from nmea_storage import StorageManager, find_volumes, prepare_volume
+
+
+def media(tmp_path):
+   for name in ("usb", "usb1"):
+      (tmp_path / name).mkdir()
+   return str(tmp_path) + "/"
+
+
+def test_other_drives_untouched_without_spill(tmp_path):
+   root = media(tmp_path)
+   assert find_volumes(root, 1) == ["usb"]
+   storage = StorageManager(root, "usb")
+   storage.check()
+   assert [v.name for v in storage.volumes] == ["usb"]
+   assert storage.select() == root + "usb/"
+   assert os.listdir(root + "usb1") == []
+
+
+def test_spill_adds_drives(tmp_path):
+   root = media(tmp_path)
+   prepare_volume(root + "usb")
+   storage = StorageManager(root, "usb", spill=True)
+   assert [v.name for v in storage.volumes] == ["usb", "usb1"]
+   assert sorted(os.listdir(root + "usb1")) == ["complete", "transferred"]